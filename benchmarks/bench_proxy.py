@@ -0,0 +1,385 @@
+"""Benchmark the proxy hot path against direct calls to a stand-in upstream.
+
+Run from the repository root, so the working tree's tokentap is measured:
+
+    python -m benchmarks.bench_proxy --concurrency 1,16,64 --requests 200 -o before.json
+    python -m benchmarks.bench_proxy --concurrency 1,16,64 --requests 200 --compare before.json
+
+The upstream and the proxy each run in their own process, so the CPU time
+and peak RSS reported are the proxy's alone. Every concurrency level is
+measured twice, straight against the upstream and through the proxy; the
+difference of the latency percentiles is the overhead the proxy adds.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import aiohttp
+import click
+
+from benchmarks.fake_upstream import StreamConfig, serve
+
+RESULT_VERSION = 1
+STARTUP_TIMEOUT = 30.0
+
+# Metrics compared against a baseline: (level key, value key, noise floor)
+COMPARED = (
+    ("overhead_ms", "p50", 1.0),
+    ("overhead_ms", "p99", 2.0),
+    ("overhead_ttft_ms", "p50", 1.0),
+    ("proxy", "cpu_ms_per_request", 0.1),
+)
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    """Return the q-th percentile (0-100) of values using nearest rank."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _process_usage() -> dict:
+    """Return this process's CPU time and peak RSS."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    max_rss_mb = max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+    return {"cpu_s": time.process_time(), "max_rss_mb": max_rss_mb}
+
+
+def _serve_proxy(port: int, upstream_url: str, prompts_dir: str, options: dict, conn) -> None:
+    """Run a ProxyServer, answering usage queries on conn until told to stop."""
+    from tokentap.proxy import ProxyServer
+
+    async def run() -> None:
+        proxy = ProxyServer(base_url=upstream_url, port=port, prompts_dir=Path(prompts_dir), **options)
+        await proxy.start()
+        conn.send("ready")
+        loop = asyncio.get_running_loop()
+        while await loop.run_in_executor(None, conn.recv) != "stop":
+            conn.send(_process_usage())
+        await proxy.stop()
+        conn.send(_process_usage())
+
+    asyncio.run(run())
+
+
+def _request_body(provider: str, prompt_bytes: int, stream: bool) -> tuple[bytes, bytes]:
+    """Return the body around a per-request marker, so prompts share a prefix but differ."""
+    filler = ("lorem ipsum dolor sit amet " * (prompt_bytes // 27 + 1))[:prompt_bytes]
+    body = {
+        "model": "bench",
+        "stream": stream,
+        "max_tokens": 1024,
+        "messages": [
+            {"role": "user", "content": filler},
+            {"role": "assistant", "content": "Noted."},
+            {"role": "user", "content": "Request MARKER"},
+        ],
+    }
+    if provider == "anthropic":
+        body["system"] = "You are a benchmark."
+    head, _, tail = json.dumps(body).encode().partition(b"MARKER")
+    return head, tail
+
+
+async def _run_level(url: str, head: bytes, tail: bytes, concurrency: int, requests: int) -> dict:
+    """Send requests with at most concurrency in flight; return latency samples in ms."""
+    ttft, duration = [], []
+    errors = 0
+    counter = iter(range(requests))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=300)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        async def worker() -> None:
+            nonlocal errors
+            for index in counter:
+                body = head + str(index).encode() + tail
+                started = time.perf_counter()
+                first = None
+                try:
+                    async with session.post(url, data=body, headers={"Content-Type": "application/json"}) as response:
+                        async for _ in response.content.iter_any():
+                            if first is None:
+                                first = time.perf_counter()
+                        if response.status != 200:
+                            errors += 1
+                            continue
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                    continue
+                end = time.perf_counter()
+                ttft.append(((first or end) - started) * 1000)
+                duration.append((end - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "wall_s": wall,
+        "throughput_rps": len(duration) / wall if wall else 0.0,
+        "ttft_ms": {f"p{q}": _percentile(ttft, q) for q in (50, 99)},
+        "duration_ms": {f"p{q}": _percentile(duration, q) for q in (50, 99)},
+    }
+
+
+def _overhead(direct: dict, proxied: dict, key: str) -> dict:
+    return {
+        q: None if proxied[key][q] is None or direct[key][q] is None else proxied[key][q] - direct[key][q]
+        for q in ("p50", "p99")
+    }
+
+
+def _git_commit() -> str | None:
+    git = shutil.which("git")
+    if git is None:
+        return None
+    try:
+        result = subprocess.run([git, "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0:
+        return None
+    dirty = subprocess.run([git, "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True)
+    return result.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+
+def run_benchmark(
+    provider: str,
+    concurrency: list[int],
+    requests: int,
+    prompt_bytes: int,
+    stream: bool,
+    config: StreamConfig,
+    max_overhead_ms: float,
+    proxy_options: dict,
+    upstream_port: int,
+    proxy_port: int,
+) -> dict:
+    """Run every concurrency level directly and through the proxy; return the results document."""
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    upstream = context.Process(target=serve, args=(upstream_port, config, ready), daemon=True)
+    upstream.start()
+    if not ready.wait(STARTUP_TIMEOUT):
+        upstream.terminate()
+        raise click.ClickException("The stand-in upstream did not start")
+
+    prompts_dir = tempfile.mkdtemp(prefix="tokentap-bench-")
+    parent_conn, child_conn = context.Pipe()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    proxy = context.Process(
+        target=_serve_proxy,
+        args=(proxy_port, upstream_url, prompts_dir, proxy_options, child_conn),
+        daemon=True,
+    )
+    proxy.start()
+    try:
+        if not parent_conn.poll(STARTUP_TIMEOUT) or parent_conn.recv() != "ready":
+            raise click.ClickException("The proxy did not start")
+
+        path = "/v1/messages" if provider == "anthropic" else "/v1/chat/completions"
+        head, tail = _request_body(provider, prompt_bytes, stream)
+        direct_url = upstream_url + path
+        proxy_url = f"http://127.0.0.1:{proxy_port}{path}"
+
+        # Open connections and load the tokenizer before anything is measured
+        warmup = max(concurrency)
+        asyncio.run(_run_level(direct_url, head, tail, warmup, warmup))
+        asyncio.run(_run_level(proxy_url, head, tail, warmup, warmup))
+
+        levels = []
+        max_sustainable = 0
+        for level in concurrency:
+            direct = asyncio.run(_run_level(direct_url, head, tail, level, requests))
+            parent_conn.send("usage")
+            before = parent_conn.recv()
+            proxied = asyncio.run(_run_level(proxy_url, head, tail, level, requests))
+            parent_conn.send("usage")
+            after = parent_conn.recv()
+            proxied["cpu_ms_per_request"] = (after["cpu_s"] - before["cpu_s"]) * 1000 / requests
+            result = {
+                "concurrency": level,
+                "direct": direct,
+                "proxy": proxied,
+                "overhead_ms": _overhead(direct, proxied, "duration_ms"),
+                "overhead_ttft_ms": _overhead(direct, proxied, "ttft_ms"),
+            }
+            p99 = result["overhead_ms"]["p99"]
+            result["sustained"] = proxied["errors"] == 0 and p99 is not None and p99 <= max_overhead_ms
+            levels.append(result)
+            click.echo(
+                f"c={level:<5} direct p50 {direct['duration_ms']['p50']:.1f}ms"
+                f"  proxy p50 {proxied['duration_ms']['p50'] or 0:.1f}ms"
+                f"  overhead p50/p99 {result['overhead_ms']['p50'] or 0:.2f}/{p99 or 0:.2f}ms"
+                f"  cpu {proxied['cpu_ms_per_request']:.2f}ms/req  errors {proxied['errors']}",
+                err=True,
+            )
+
+        for result in levels:
+            if not result["sustained"]:
+                break
+            max_sustainable = result["concurrency"]
+
+        parent_conn.send("stop")
+        final = parent_conn.recv()
+        proxy.join(STARTUP_TIMEOUT)
+    finally:
+        if proxy.is_alive():
+            proxy.terminate()
+        upstream.terminate()
+        upstream.join()
+        shutil.rmtree(prompts_dir, ignore_errors=True)
+
+    return {
+        "version": RESULT_VERSION,
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": multiprocessing.cpu_count(),
+        },
+        "params": {
+            "provider": provider,
+            "stream": stream,
+            "requests": requests,
+            "prompt_bytes": prompt_bytes,
+            "output_tokens": config.output_tokens,
+            "chunk_tokens": config.chunk_tokens,
+            "token_rate": config.token_rate,
+            "max_overhead_ms": max_overhead_ms,
+            "proxy_options": proxy_options,
+        },
+        "levels": levels,
+        "max_sustainable_streams": max_sustainable,
+        "proxy_peak_rss_mb": final["max_rss_mb"],
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print per-level changes against a baseline; return the regressions found."""
+    if results["params"] != baseline.get("params"):
+        click.echo("warning: benchmark parameters differ from the baseline", err=True)
+    regressions = []
+    by_level = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    click.echo(f"{'level':<8}{'metric':<32}{'baseline':>12}{'current':>12}{'change':>10}")
+    for level in results["levels"]:
+        old = by_level.get(level["concurrency"])
+        if old is None:
+            continue
+        for group, key, floor in COMPARED:
+            before, after = old[group].get(key), level[group].get(key)
+            if before is None or after is None:
+                continue
+            change = (after - before) / abs(before) * 100 if before else 0.0
+            name = f"{group}.{key}"
+            click.echo(f"c={level['concurrency']:<6}{name:<32}{before:>12.3f}{after:>12.3f}{change:>9.1f}%")
+            if after - before > floor and change > tolerance:
+                regressions.append(f"c={level['concurrency']} {name}: {before:.3f} -> {after:.3f} (+{change:.1f}%)")
+    old_rss, new_rss = baseline.get("proxy_peak_rss_mb"), results["proxy_peak_rss_mb"]
+    if old_rss:
+        click.echo(f"{'':<8}{'proxy_peak_rss_mb':<32}{old_rss:>12.1f}{new_rss:>12.1f}{(new_rss - old_rss) / old_rss * 100:>9.1f}%")
+        if (new_rss - old_rss) / old_rss * 100 > tolerance:
+            regressions.append(f"proxy_peak_rss_mb: {old_rss:.1f} -> {new_rss:.1f}")
+    old_max = baseline.get("max_sustainable_streams")
+    if old_max is not None and results["max_sustainable_streams"] < old_max:
+        regressions.append(f"max_sustainable_streams: {old_max} -> {results['max_sustainable_streams']}")
+    return regressions
+
+
+def _parse_option(value: str) -> tuple[str, object]:
+    key, sep, raw = value.partition("=")
+    if not sep:
+        raise click.BadParameter(f"expected KEY=VALUE, got {value!r}", param_hint="--proxy-option")
+    try:
+        return key.replace("-", "_"), json.loads(raw)
+    except json.JSONDecodeError:
+        return key.replace("-", "_"), raw
+
+
+@click.command()
+@click.option("--provider", type=click.Choice(("openai", "anthropic")), default="openai", help="API shape of the requests")
+@click.option("--concurrency", "-c", default="1,8,32,128", help="Comma-separated concurrent stream counts to ramp through")
+@click.option("--requests", "-n", default=200, help="Requests per concurrency level")
+@click.option("--prompt-bytes", default=16 * 1024, help="Size of the prompt in each request body")
+@click.option("--output-tokens", default=256, help="Tokens generated per response")
+@click.option("--chunk-tokens", default=1, help="Tokens per SSE event")
+@click.option("--token-rate", default=0.0, help="Tokens per second per stream (0: unpaced)")
+@click.option("--no-stream", is_flag=True, help="Request complete JSON responses instead of SSE streams")
+@click.option("--max-overhead-ms", default=50.0, help="p99 overhead up to which a level counts as sustainable")
+@click.option("--proxy-option", "proxy_options", multiple=True, help="ProxyServer argument as KEY=VALUE (JSON values)")
+@click.option("--upstream-port", default=18471, help="Port of the stand-in upstream")
+@click.option("--proxy-port", default=18472, help="Port of the proxy under test")
+@click.option("--output", "-o", type=click.Path(dir_okay=False, path_type=Path), help="Write the results JSON here instead of stdout")
+@click.option("--compare", "baseline", type=click.Path(exists=True, dir_okay=False, path_type=Path), help="Baseline results to compare against")
+@click.option("--tolerance", default=20.0, help="Percent slowdown against the baseline counted as a regression")
+def main(
+    provider: str,
+    concurrency: str,
+    requests: int,
+    prompt_bytes: int,
+    output_tokens: int,
+    chunk_tokens: int,
+    token_rate: float,
+    no_stream: bool,
+    max_overhead_ms: float,
+    proxy_options: tuple[str, ...],
+    upstream_port: int,
+    proxy_port: int,
+    output: Path | None,
+    baseline: Path | None,
+    tolerance: float,
+):
+    """Measure the latency, CPU and memory the proxy adds."""
+    try:
+        levels = sorted({int(level) for level in concurrency.split(",") if level.strip()})
+    except ValueError:
+        raise click.BadParameter("expected comma-separated integers", param_hint="--concurrency")
+    if not levels or levels[0] < 1:
+        raise click.BadParameter("concurrency levels must be positive", param_hint="--concurrency")
+
+    results = run_benchmark(
+        provider=provider,
+        concurrency=levels,
+        requests=requests,
+        prompt_bytes=prompt_bytes,
+        stream=not no_stream,
+        config=StreamConfig(output_tokens, chunk_tokens, token_rate),
+        max_overhead_ms=max_overhead_ms,
+        proxy_options=dict(_parse_option(value) for value in proxy_options),
+        upstream_port=upstream_port,
+        proxy_port=proxy_port,
+    )
+
+    document = json.dumps(results, indent=2)
+    if output:
+        output.write_text(document + "\n")
+    elif baseline is None:
+        click.echo(document)
+
+    if baseline is not None:
+        regressions = compare(results, json.loads(baseline.read_text()), tolerance)
+        if regressions:
+            click.echo("\nRegressions:\n  " + "\n  ".join(regressions), err=True)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
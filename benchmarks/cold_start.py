@@ -0,0 +1,155 @@
+"""Measure how long a fresh ``tokentap start`` takes to relay its first byte.
+
+Run from the repository root:
+
+    python -m benchmarks.cold_start --runs 5 -o cold.json
+
+Each run launches the CLI non-interactively in a new process and sends one
+request as soon as the port accepts connections. The first-byte time is
+taken from the client's side, from process launch to the first response
+byte; the proxy's own startup timings (listening, tokenizer loaded, first
+byte relayed) are read back from its debug endpoint.
+"""
+
+import json
+import multiprocessing
+import platform
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+import click
+
+from benchmarks.bench_proxy import STARTUP_TIMEOUT, _git_commit
+from benchmarks.fake_upstream import StreamConfig, serve
+
+RESULT_VERSION = 1
+SHUTDOWN_TIMEOUT = 15.0
+
+_BODY = json.dumps({"model": "bench", "messages": [{"role": "user", "content": "Hello"}]}).encode()
+
+
+def _first_byte(port: int, deadline: float) -> float:
+    """Send one request as soon as the port accepts it; return when its first byte arrived."""
+    request = (
+        b"POST /v1/chat/completions HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+        b"Connection: close\r\nContent-Length: " + str(len(_BODY)).encode() + b"\r\n\r\n" + _BODY
+    )
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=STARTUP_TIMEOUT) as sock:
+                sock.sendall(request)
+                if sock.recv(1):
+                    return time.perf_counter()
+        except ConnectionError:
+            pass
+        time.sleep(0.002)
+    raise click.ClickException("The proxy did not answer in time")
+
+
+def _import_seconds(runs: int) -> float:
+    """Return the median time to import the CLI module, interpreter startup excluded."""
+
+    def median_run(code: str) -> float:
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True)
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples)
+
+    return max(0.0, median_run("import tokentap.cli") - median_run("pass"))
+
+
+def run_once(port: int, upstream_url: str, extra_args: list[str]) -> dict:
+    """Launch the CLI once and time it up to the first proxied byte."""
+    with tempfile.TemporaryDirectory(prefix="tokentap-cold-") as prompts_dir:
+        command = [
+            sys.executable, "-m", "tokentap.cli", "start", "--non-interactive", "--no-dashboard",
+            "--port", str(port), "--upstream", upstream_url, "--prompts-dir", prompts_dir, *extra_args,
+        ]
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        try:
+            first_byte = _first_byte(port, started + STARTUP_TIMEOUT) - started
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_tokentap/debug", timeout=5) as response:
+                startup = json.load(response)["startup"]
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(SHUTDOWN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+    return {"first_byte_s": first_byte, "proxy": startup}
+
+
+def _summary(values: list[float | None]) -> dict | None:
+    values = [value * 1000 for value in values if value is not None]
+    if not values:
+        return None
+    return {"min": min(values), "p50": statistics.median(values), "max": max(values)}
+
+
+@click.command()
+@click.option("--runs", "-n", default=5, type=click.IntRange(min=1), help="Launches to measure")
+@click.option("--upstream-port", default=18471, help="Port of the stand-in upstream")
+@click.option("--proxy-port", default=18472, help="Port of the proxy under test")
+@click.option("--output", "-o", type=click.Path(dir_okay=False, path_type=Path), help="Write the results JSON here instead of stdout")
+@click.argument("extra_args", nargs=-1, type=click.UNPROCESSED)
+def main(runs: int, upstream_port: int, proxy_port: int, output: Path | None, extra_args: tuple[str, ...]):
+    """Measure cold start to first proxied byte; extra arguments go to 'tokentap start'."""
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    upstream = context.Process(target=serve, args=(upstream_port, StreamConfig(), ready), daemon=True)
+    upstream.start()
+    if not ready.wait(STARTUP_TIMEOUT):
+        upstream.terminate()
+        raise click.ClickException("The stand-in upstream did not start")
+
+    try:
+        samples = []
+        for index in range(runs):
+            sample = run_once(proxy_port, f"http://127.0.0.1:{upstream_port}", list(extra_args))
+            click.echo(
+                f"run {index + 1}: first byte {sample['first_byte_s'] * 1000:.0f}ms"
+                f"  listening {(sample['proxy']['listening_s'] or 0) * 1000:.0f}ms"
+                f"  tokenizer {(sample['proxy']['tokenizer_s'] or 0) * 1000:.0f}ms",
+                err=True,
+            )
+            samples.append(sample)
+        import_s = _import_seconds(runs)
+    finally:
+        upstream.terminate()
+
+    results = {
+        "version": RESULT_VERSION,
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": list(extra_args),
+        },
+        "import_ms": import_s * 1000,
+        "first_byte_ms": _summary([sample["first_byte_s"] for sample in samples]),
+        "proxy_listening_ms": _summary([sample["proxy"]["listening_s"] for sample in samples]),
+        "proxy_tokenizer_ms": _summary([sample["proxy"]["tokenizer_s"] for sample in samples]),
+        "runs": samples,
+    }
+    document = json.dumps(results, indent=2)
+    if output:
+        output.write_text(document + "\n")
+    else:
+        click.echo(document)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Stand-in upstream streaming synthetic OpenAI and Anthropic responses.
+
+Used by the proxy benchmark, and runnable on its own:
+
+    python -m benchmarks.fake_upstream --port 9000 --output-tokens 256 --token-rate 50
+"""
+
+import asyncio
+import json
+from dataclasses import asdict, dataclass
+
+import click
+from aiohttp import web
+
+# One synthetic token
+WORD = "tok "
+
+
+@dataclass
+class StreamConfig:
+    """Shape of the generated responses."""
+
+    output_tokens: int = 256
+    chunk_tokens: int = 1
+    token_rate: float = 0.0
+
+    @property
+    def interval(self) -> float:
+        """Seconds between two content events, 0 for as fast as possible."""
+        return self.chunk_tokens / self.token_rate if self.token_rate > 0 else 0.0
+
+    def chunks(self) -> list[str]:
+        """Return the generated text split into content events."""
+        full, rest = divmod(self.output_tokens, self.chunk_tokens)
+        chunks = [WORD * self.chunk_tokens] * full
+        if rest:
+            chunks.append(WORD * rest)
+        return chunks
+
+
+def _sse(data: dict, event: str | None = None) -> bytes:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n".encode()
+
+
+def _openai_events(config: StreamConfig, model: str, prompt_tokens: int) -> tuple[bytes, list[bytes], bytes]:
+    """Return the opening event, the content events and the closing events of a chat completion stream."""
+    base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": model}
+    head = _sse({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}}]})
+    body = [_sse({**base, "choices": [{"index": 0, "delta": {"content": text}}]}) for text in config.chunks()]
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": config.output_tokens,
+        "total_tokens": prompt_tokens + config.output_tokens,
+    }
+    tail = _sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage})
+    return head, body, tail + b"data: [DONE]\n\n"
+
+
+def _anthropic_events(config: StreamConfig, model: str, prompt_tokens: int) -> tuple[bytes, list[bytes], bytes]:
+    """Return the opening events, the content events and the closing events of a Messages stream."""
+    message = {
+        "id": "msg_bench",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [],
+        "usage": {"input_tokens": prompt_tokens, "output_tokens": 1},
+    }
+    head = _sse({"type": "message_start", "message": message}, "message_start") + _sse(
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        "content_block_start",
+    )
+    body = [
+        _sse(
+            {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}},
+            "content_block_delta",
+        )
+        for text in config.chunks()
+    ]
+    tail = (
+        _sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        + _sse(
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn"},
+                "usage": {"output_tokens": config.output_tokens},
+            },
+            "message_delta",
+        )
+        + _sse({"type": "message_stop"}, "message_stop")
+    )
+    return head, body, tail
+
+
+def _complete_response(config: StreamConfig, model: str, prompt_tokens: int, anthropic: bool) -> dict:
+    text = "".join(config.chunks())
+    if anthropic:
+        return {
+            "id": "msg_bench",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": prompt_tokens, "output_tokens": config.output_tokens},
+        }
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": config.output_tokens,
+            "total_tokens": prompt_tokens + config.output_tokens,
+        },
+    }
+
+
+def make_app(config: StreamConfig) -> web.Application:
+    """Create the stand-in upstream application."""
+
+    async def generate(request: web.Request) -> web.StreamResponse:
+        raw = await request.read()
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            return web.json_response({"error": "invalid JSON"}, status=400)
+        model = body.get("model", "bench")
+        # Roughly four bytes per token, so usage scales with the body size
+        prompt_tokens = len(raw) // 4
+        anthropic = request.path.startswith("/v1/messages")
+        if not body.get("stream"):
+            return web.json_response(_complete_response(config, model, prompt_tokens, anthropic))
+
+        events = _anthropic_events if anthropic else _openai_events
+        head, content, tail = events(config, model, prompt_tokens)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await response.write(head)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for index, event in enumerate(content):
+            if config.interval:
+                # Pace against the start time so scheduling delays do not accumulate
+                delay = started + (index + 1) * config.interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await response.write(event)
+        await response.write(tail)
+        await response.write_eof()
+        return response
+
+    async def models(request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "bench", "object": "model"}]})
+
+    app = web.Application(client_max_size=1024**3)
+    app["config"] = asdict(config)
+    app.router.add_post("/v1/chat/completions", generate)
+    app.router.add_post("/v1/messages", generate)
+    app.router.add_get("/v1/models", models)
+    return app
+
+
+def serve(port: int, config: StreamConfig, ready=None) -> None:
+    """Serve the stand-in upstream until interrupted, setting ready once listening."""
+
+    async def run() -> None:
+        runner = web.AppRunner(make_app(config), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        if ready is not None:
+            ready.set()
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.option("--port", "-p", default=9000, help="Port to listen on")
+@click.option("--output-tokens", default=StreamConfig.output_tokens, help="Tokens generated per response")
+@click.option("--chunk-tokens", default=StreamConfig.chunk_tokens, help="Tokens per SSE event")
+@click.option("--token-rate", default=StreamConfig.token_rate, help="Tokens per second per stream (0: unpaced)")
+def main(port: int, output_tokens: int, chunk_tokens: int, token_rate: float):
+    """Run the stand-in upstream."""
+    serve(port, StreamConfig(output_tokens, chunk_tokens, token_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Shared fixtures: tiktoken encodings that load without network access."""
+
+import pytest
+import tiktoken.registry
+from tiktoken_ext import openai_public
+
+# A few merges across whitespace and newlines, so segmentation mistakes change counts
+_MERGES = [b"\n\n", b".\n", b"  ", b" \n", b"\n ", b"he", b"ll", b"hell", b"hello", b" w", b" wo", b"or", b"ld"]
+
+
+def _ranks(*args, **kwargs) -> dict[bytes, int]:
+    ranks = {bytes([i]): i for i in range(256)}
+    for merge in _MERGES:
+        ranks[merge] = len(ranks)
+    return ranks
+
+
+@pytest.fixture
+def offline_encodings(monkeypatch):
+    """Register every OpenAI encoding with its real split pattern and a tiny vocabulary."""
+    monkeypatch.setattr(openai_public, "load_tiktoken_bpe", _ranks)
+    monkeypatch.setattr(openai_public, "data_gym_to_mergeable_bpe_ranks", _ranks)
+    for name, constructor in openai_public.ENCODING_CONSTRUCTORS.items():
+        params = constructor()
+        params.pop("explicit_n_vocab", None)
+        params["special_tokens"] = {token: len(params["mergeable_ranks"]) + i for i, token in enumerate(params["special_tokens"])}
+        monkeypatch.setitem(tiktoken.registry.ENCODINGS, name, tiktoken.Encoding(**params))
@@ -0,0 +1,81 @@
+"""Admission control across upstream failover."""
+
+import asyncio
+import socket
+
+import aiohttp
+from aiohttp import web
+
+from tokentap.proxy import ProxyServer
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _live_upstream(port: int) -> tuple[web.AppRunner, dict]:
+    """Start a chat completions server that records its peak concurrency."""
+    seen = {"inflight": 0, "peak": 0, "requests": 0}
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def handle(request: web.Request) -> web.Response:
+        seen["inflight"] += 1
+        seen["peak"] = max(seen["peak"], seen["inflight"])
+        seen["requests"] += 1
+        try:
+            await asyncio.sleep(0.05)
+            return web.json_response(
+                {
+                    "model": "test",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}}],
+                    "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4},
+                }
+            )
+        finally:
+            seen["inflight"] -= 1
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", health)
+    app.router.add_post("/{path:.*}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, seen
+
+
+def test_failover_respects_max_inflight(tmp_path, offline_encodings):
+    async def run() -> tuple[list[int], dict]:
+        dead, live, port = _free_port(), _free_port(), _free_port()
+        upstream, seen = await _live_upstream(live)
+        proxy = ProxyServer(
+            base_url=f"http://127.0.0.1:{dead}",
+            port=port,
+            prompts_dir=tmp_path,
+            upstreams=[f"http://127.0.0.1:{dead}", f"http://127.0.0.1:{live}"],
+            max_inflight=1,
+            usage_source="upstream",
+        )
+        await proxy.start()
+        try:
+            body = {"model": "test", "messages": [{"role": "user", "content": "hello"}]}
+            async with aiohttp.ClientSession() as session:
+
+                async def send() -> int:
+                    async with session.post(f"http://127.0.0.1:{port}/v1/chat/completions", json=body) as resp:
+                        await resp.read()
+                        return resp.status
+
+                statuses = await asyncio.gather(*(send() for _ in range(5)))
+        finally:
+            await proxy.stop()
+            await upstream.cleanup()
+        return statuses, seen
+
+    statuses, seen = asyncio.run(run())
+    assert statuses == [200] * 5
+    assert seen["requests"] == 5
+    assert seen["peak"] == 1
@@ -0,0 +1,14 @@
+"""Deduplicating content store."""
+
+from tokentap.archive import ContentStore
+
+
+def test_known_digests_are_bounded(tmp_path):
+    store = ContentStore(tmp_path, known_objects=2)
+    written = [store.put_object({"role": "user", "content": str(i)})[1] for i in range(5)]
+    assert all(written)
+    assert len(store._known) == 2
+    # Forgotten digests are found on disk instead of being written again
+    digest, size = store.put_object({"role": "user", "content": "0"})
+    assert size == 0
+    assert store.get_object(digest) == {"role": "user", "content": "0"}
@@ -0,0 +1,132 @@
+"""Request body tee: spooling, spill to disk and truncation."""
+
+import asyncio
+import json
+import socket
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from tokentap.body import BodyTee
+from tokentap.proxy import ProxyServer
+
+
+class _Content:
+    """Stands in for an aiohttp StreamReader delivering fixed chunks."""
+
+    def __init__(self, chunks: list[bytes]):
+        self.chunks = chunks
+
+    async def iter_any(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def _relay(tee: BodyTee) -> list[bytes]:
+    async def run() -> list[bytes]:
+        return [chunk async for chunk in tee]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("spool_memory_bytes", [1024, 10], ids=["in-memory", "on-disk"])
+def test_body_is_relayed_and_spooled(spool_memory_bytes):
+    chunks = [b"0123456789", b"abcdefghij", b"KLMNOPQRST"]
+    sunk = []
+    tee = BodyTee(_Content(chunks), max_parse_bytes=30, spool_memory_bytes=spool_memory_bytes, sink=sunk.append)
+    assert _relay(tee) == chunks
+    # The spool moves to disk only past its memory budget
+    assert tee._spool._rolled == (spool_memory_bytes < 30)
+    assert (tee.complete, tee.truncated, tee.size) == (True, False, 30)
+    assert tee.read() == b"".join(chunks)
+    assert sunk == chunks
+    tee.close()
+
+
+def test_body_past_the_parse_limit_is_spilled_in_order():
+    chunks = [b"0123456789", b"abcdefghij", b"KLMNOPQRST", b"uvwxyz"]
+    spilled = []
+    tee = BodyTee(_Content(chunks), max_parse_bytes=25, spool_memory_bytes=15, spill=spilled.append)
+    assert _relay(tee) == chunks
+    assert (tee.complete, tee.truncated, tee.size) == (True, True, 36)
+    assert tee.read() is None
+    # The spooled prefix is read back by whoever calls the payload, not the relay
+    assert callable(spilled[0])
+    assert spilled[1:] == [b"uvwxyz"]
+    assert spilled[0]() + b"".join(spilled[1:]) == b"".join(chunks)
+    # The spool belongs to the payload now
+    tee.close()
+
+
+def test_truncation_without_spill_drops_the_copy():
+    tee = BodyTee(_Content([b"x" * 10, b"y" * 10]), max_parse_bytes=15, spool_memory_bytes=5)
+    assert _relay(tee) == [b"x" * 10, b"y" * 10]
+    assert tee.truncated
+    assert tee._spool.closed
+    assert tee.read() is None
+    tee.close()
+
+
+def test_incomplete_body_is_not_parsed():
+    class _Failing(_Content):
+        async def iter_any(self):
+            yield b"partial"
+            raise ConnectionResetError
+
+    tee = BodyTee(_Failing([]), max_parse_bytes=100)
+    with pytest.raises(ConnectionResetError):
+        _relay(tee)
+    assert tee.started and tee.finished.is_set()
+    assert not tee.complete
+    assert tee.read() is None
+    tee.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_proxy_archives_an_unparsed_body_whole(tmp_path, offline_encodings):
+    body = json.dumps({"model": "test", "messages": [{"role": "user", "content": "x" * 20_000}]}).encode()
+
+    async def run() -> int:
+        upstream_port, port = _free_port(), _free_port()
+
+        async def handle(request: web.Request) -> web.Response:
+            return web.json_response({"received": len(await request.read())})
+
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", handle)
+        upstream = web.AppRunner(app)
+        await upstream.setup()
+        await web.TCPSite(upstream, "127.0.0.1", upstream_port).start()
+        proxy = ProxyServer(
+            base_url=f"http://127.0.0.1:{upstream_port}",
+            port=port,
+            prompts_dir=tmp_path,
+            archive_format="dedup",
+            stream_threshold=1024,
+            max_parse_bytes=8192,
+        )
+        await proxy.start()
+
+        async def chunks():
+            for start in range(0, len(body), 1000):
+                yield body[start : start + 1000]
+                await asyncio.sleep(0)
+
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+                async with session.post(f"http://127.0.0.1:{port}/v1/chat/completions", data=chunks()) as resp:
+                    received = (await resp.json())["received"]
+        finally:
+            await proxy.stop()
+            await upstream.cleanup()
+        return received
+
+    assert asyncio.run(run()) == len(body)
+    [raw] = tmp_path.rglob("*_body.raw")
+    assert raw.read_bytes() == body
@@ -0,0 +1,206 @@
+"""Response cache keys, eviction and replay through the proxy."""
+
+import asyncio
+import json
+import socket
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from tokentap import cache as cache_module
+from tokentap.cache import ResponseCache
+from tokentap.proxy import ProxyServer
+
+_BODY = {"model": "test", "temperature": 0, "messages": [{"role": "user", "content": "hello"}]}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock.time)
+    return clock
+
+
+def test_only_temperature_zero_requests_have_a_key():
+    assert ResponseCache.key("/v1/chat/completions", _BODY) is not None
+    assert ResponseCache.key("/v1/chat/completions", {**_BODY, "temperature": 0.7}) is None
+    assert ResponseCache.key("/v1/chat/completions", {k: v for k, v in _BODY.items() if k != "temperature"}) is None
+    assert ResponseCache.key("/v1/chat/completions", [_BODY]) is None
+    assert ResponseCache.key("/v1/chat/completions", None) is None
+
+
+def test_key_follows_the_body_and_path():
+    key = ResponseCache.key("/v1/chat/completions", _BODY)
+    # Key order does not matter, content does
+    assert ResponseCache.key("/v1/chat/completions", dict(reversed(list(_BODY.items())))) == key
+    assert ResponseCache.key("/v1/chat/completions", {**_BODY, "model": "other"}) != key
+    assert ResponseCache.key("/v1/chat/completions", {**_BODY, "messages": [{"role": "user", "content": "hello!"}]}) != key
+    assert ResponseCache.key("/v1/completions", _BODY) != key
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    async def run():
+        cache = ResponseCache(tmp_path, ttl=60)
+        await cache.put("a" * 64, 200, [("Content-Type", "application/json")], [b"{}"])
+        clock.now += 30
+        fresh = await cache.get("a" * 64)
+        clock.now += 31
+        stale = await cache.get("a" * 64)
+        return cache, fresh, stale
+
+    cache, fresh, stale = asyncio.run(run())
+    assert fresh is not None and fresh.chunks == [b"{}"]
+    assert stale is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["memory_entries"], stats["disk_entries"]) == (1, 1, 0, 0)
+    assert not list(tmp_path.glob("*/*.cache"))
+
+
+def test_memory_tier_evicts_least_recently_used():
+    async def run():
+        cache = ResponseCache(memory_bytes=25)
+        for key in "abc":
+            await cache.put(key, 200, [], [b"x" * 10])
+            if key == "b":
+                # Touch "a" so that "b" is the oldest
+                await cache.get("a")
+        return cache, [await cache.get(key) is not None for key in "abc"]
+
+    cache, found = asyncio.run(run())
+    assert found == [True, False, True]
+    assert cache.stats()["memory_bytes"] == 20
+
+
+def test_oversized_entries_are_not_stored():
+    async def run():
+        cache = ResponseCache(max_entry_bytes=10)
+        await cache.put("a", 200, [], [b"x" * 6, b"x" * 6])
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.stats()["stored"] == 0
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disk_tier_evicts_oldest_and_survives_restart(tmp_path):
+    keys = [f"{i:02d}" + "0" * 62 for i in range(3)]
+
+    async def fill():
+        cache = ResponseCache(tmp_path, memory_bytes=0, disk_bytes=250)
+        for key in keys:
+            await cache.put(key, 200, [("Content-Type", "text/event-stream")], [b"data: 1\n\n", b"data: 2\n\n"])
+        return cache
+
+    cache = asyncio.run(fill())
+    assert cache.stats()["disk_entries"] < 3
+    assert cache.stats()["disk_bytes"] <= 250
+    kept = list(cache._disk)
+    assert kept == keys[-len(kept):]
+
+    async def reload():
+        restarted = ResponseCache(tmp_path, memory_bytes=1000)
+        return restarted, await restarted.get(keys[-1]), await restarted.get(keys[0])
+
+    restarted, hit, evicted = asyncio.run(reload())
+    assert hit.chunks == [b"data: 1\n\n", b"data: 2\n\n"]
+    assert hit.headers == [("Content-Type", "text/event-stream")]
+    assert evicted is None
+    assert restarted.stats()["disk_hits"] == 1
+
+
+_STREAM_CHUNKS = [
+    b'data: {"id":"c1","object":"chat.completion.chunk","model":"test","choices":[{"index":0,"delta":{"role":"assistant","content":"Hel"}}]}\n\n',
+    b'data: {"id":"c1","object":"chat.completion.chunk","model":"test","choices":[{"index":0,"delta":{"content":"lo"},"finish_reason":"stop"}]}\n\n',
+    b'data: {"id":"c1","object":"chat.completion.chunk","model":"test","choices":[],"usage":{"prompt_tokens":5,"completion_tokens":2,"total_tokens":7}}\n\n',
+    b"data: [DONE]\n\n",
+]
+
+
+async def _counting_upstream(port: int, calls: list) -> web.AppRunner:
+    """Start a server answering streamed and plain completions, recording each call."""
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        calls.append(body)
+        if not body.get("stream"):
+            return web.json_response({
+                "id": "c1",
+                "model": "test",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello"}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7},
+            })
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for chunk in _STREAM_CHUNKS:
+            await resp.write(chunk)
+            await asyncio.sleep(0.01)
+        return resp
+
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+@pytest.mark.parametrize("stream", [True, False], ids=["streamed", "plain"])
+def test_cache_hit_replays_the_response(tmp_path, offline_encodings, stream):
+    async def run():
+        upstream_port, port = _free_port(), _free_port()
+        calls, events = [], []
+        upstream = await _counting_upstream(upstream_port, calls)
+        cache = ResponseCache(tmp_path / "cache")
+        proxy = ProxyServer(
+            base_url=f"http://127.0.0.1:{upstream_port}",
+            port=port,
+            prompts_dir=tmp_path,
+            on_response=events.append,
+            cache=cache,
+        )
+        await proxy.start()
+        responses = []
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+                for body in ({**_BODY, "stream": stream}, {**_BODY, "stream": stream}, {**_BODY, "stream": stream, "temperature": 1}):
+                    async with session.post(f"http://127.0.0.1:{port}/v1/chat/completions", json=body) as resp:
+                        responses.append((resp.status, resp.headers.get("Content-Type"), resp.headers.get("X-Tokentap-Cache"), await resp.read()))
+                    for _ in range(100):
+                        if len(events) == len(responses) and cache.stats()["stored"]:
+                            break
+                        await asyncio.sleep(0.01)
+        finally:
+            await proxy.stop()
+            await upstream.cleanup()
+        return calls, events, responses, cache.stats()
+
+    calls, events, responses, stats = asyncio.run(run())
+    (miss_status, miss_type, miss_flag, miss_body), hit, bypass = responses
+    assert (miss_status, miss_flag) == (200, None)
+    assert hit == (200, miss_type, "hit", miss_body)
+    assert bypass[2] is None
+    if stream:
+        assert miss_type == "text/event-stream"
+        assert miss_body == b"".join(_STREAM_CHUNKS)
+    else:
+        assert json.loads(miss_body)["choices"][0]["message"]["content"] == "Hello"
+    # The second request never reached the upstream
+    assert len(calls) == 2
+    assert [event.cached for event in events] == [False, True, False]
+    assert events[1].output_tokens == events[0].output_tokens > 0
+    assert (stats["hits"], stats["misses"], stats["bypassed"], stats["stored"]) == (1, 1, 1, 1)
@@ -0,0 +1,102 @@
+"""Event channel fan-out and overflow policies."""
+
+import threading
+from dataclasses import replace
+
+import pytest
+
+from tokentap.events import EventChannel, RequestEvent, event_from_dict, event_to_dict
+
+
+def _event(request_id: int, type: str = "request") -> RequestEvent:
+    return RequestEvent(request_id=request_id, timestamp="2026-01-01T00:00:00", provider="up", path="/v1", type=type)
+
+
+def _ids(events: list[RequestEvent]) -> list[int]:
+    return [event.request_id for event in events]
+
+
+def test_drop_oldest_keeps_the_latest_events():
+    channel = EventChannel()
+    subscription = channel.subscribe(maxsize=3, overflow="drop-oldest")
+    for request_id in range(5):
+        channel.publish(_event(request_id))
+    assert _ids(subscription.drain()) == [2, 3, 4]
+    assert subscription.dropped == 2
+    assert subscription.stats()["delivered"] == 3
+
+
+def test_drop_newest_keeps_the_first_events():
+    channel = EventChannel()
+    subscription = channel.subscribe(maxsize=3, overflow="drop-newest")
+    for request_id in range(5):
+        channel.publish(_event(request_id))
+    assert _ids(subscription.drain()) == [0, 1, 2]
+    assert subscription.dropped == 2
+    # Room again after draining
+    channel.publish(_event(5))
+    assert _ids(subscription.drain()) == [5]
+
+
+def test_coalesce_replaces_a_pending_event_of_the_same_request():
+    channel = EventChannel()
+    subscription = channel.subscribe(maxsize=2, overflow="coalesce")
+    channel.publish(_event(1))
+    channel.publish(_event(2))
+    response = replace(_event(1), type="response", status=200)
+    channel.publish(response)
+    assert subscription.coalesced == 1
+    assert subscription.dropped == 0
+    # Nothing to merge with: the oldest event goes
+    channel.publish(_event(3))
+    assert subscription.dropped == 1
+    events = subscription.drain()
+    assert _ids(events) == [2, 3]
+    assert subscription.stats() == {"name": "", "queued": 0, "delivered": 2, "dropped": 1, "coalesced": 1}
+
+
+def test_coalesce_keeps_order_below_capacity():
+    channel = EventChannel()
+    subscription = channel.subscribe(maxsize=10, overflow="coalesce")
+    channel.publish(_event(1))
+    channel.publish(replace(_event(1), type="response"))
+    assert [event.type for event in subscription.drain()] == ["request", "response"]
+    assert subscription.coalesced == 0
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        EventChannel().subscribe(overflow="block")
+
+
+def test_subscribers_are_independent():
+    channel = EventChannel()
+    slow = channel.subscribe(maxsize=1, overflow="drop-newest", name="slow")
+    fast = channel.subscribe(maxsize=10, name="fast")
+    for request_id in range(3):
+        channel.publish(_event(request_id))
+    assert _ids(fast.drain()) == [0, 1, 2]
+    assert _ids(slow.drain()) == [0]
+    stats = channel.stats()
+    assert stats["published"] == 3
+    assert [(s["name"], s["dropped"]) for s in stats["subscribers"]] == [("slow", 2), ("fast", 0)]
+    slow.close()
+    channel.publish(_event(3))
+    assert len(slow) == 0
+    assert _ids(fast.drain()) == [3]
+
+
+def test_wait_wakes_on_publish_from_another_thread():
+    channel = EventChannel()
+    subscription = channel.subscribe()
+    timer = threading.Timer(0.05, channel.publish, (_event(7),))
+    timer.start()
+    assert _ids(subscription.wait(timeout=5)) == [7]
+    assert subscription.wait(timeout=0.01) == []
+    timer.join()
+
+
+def test_event_round_trips_through_dict():
+    event = replace(_event(4, "response"), status=200, tokens=12)
+    data = event_to_dict(event)
+    assert event_from_dict({**data, "field_from_a_newer_version": 1}) == event
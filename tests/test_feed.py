@@ -0,0 +1,135 @@
+"""Event feed server and the client remote dashboards read it with."""
+
+import socket
+import time
+import urllib.request
+
+import pytest
+
+from tokentap import feed as feed_module
+from tokentap.config import EVENTS_PATH
+from tokentap.events import EventChannel, RequestEvent
+from tokentap.feed import EventFeed, FeedClient, _read_messages, feed_url
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _event(request_id: int, preview: str = "") -> RequestEvent:
+    return RequestEvent(request_id=request_id, timestamp="2026-01-01T00:00:00", provider="up", path="/v1", preview=preview)
+
+
+def _wait(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def channel():
+    return EventChannel()
+
+
+@pytest.fixture
+def start_feed(channel):
+    feeds = []
+
+    def start(**options) -> EventFeed:
+        feed = EventFeed(channel, "127.0.0.1", _free_port(), **options)
+        feed.start()
+        feeds.append(feed)
+        return feed
+
+    yield start
+    for feed in feeds:
+        feed.close()
+
+
+def test_hello_carries_history_and_stats_then_events_come_in_batches(channel, start_feed):
+    feed = start_feed(batch_interval=0.2, history=3, stats=lambda: {"upstreams": 1})
+    for request_id in range(5):
+        channel.publish(_event(request_id))
+    assert _wait(lambda: len(feed._recent) == 3)
+
+    with urllib.request.urlopen(feed_url(f"127.0.0.1:{feed.port}"), timeout=5) as response:
+        messages = _read_messages(response)
+        kind, hello = next(messages)
+        assert kind == "hello"
+        # Only the most recent events, oldest first
+        assert [event["request_id"] for event in hello["events"]] == [2, 3, 4]
+        assert hello["stats"] == {"upstreams": 1}
+        for request_id in range(5, 9):
+            channel.publish(_event(request_id))
+        kind, batch = next(messages)
+    # Events published within one interval arrive as one message
+    assert kind == "events"
+    assert [event["request_id"] for event in batch] == [5, 6, 7, 8]
+    assert feed.connected == 1
+
+
+def test_client_that_does_not_read_is_dropped(channel, start_feed):
+    feed = start_feed(batch_interval=0.01, max_pending=2)
+    received = []
+    watcher = FeedClient(f"127.0.0.1:{feed.port}", received.append)
+    watcher.start()
+    assert watcher.wait_connected(5)
+
+    stalled = socket.create_connection(("127.0.0.1", feed.port))
+    stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    stalled.sendall(f"GET {EVENTS_PATH} HTTP/1.1\r\nHost: 127.0.0.1:{feed.port}\r\n\r\n".encode())
+    assert _wait(lambda: feed.clients == 2)
+
+    published = 0
+    preview = "x" * 64 * 1024
+    deadline = time.monotonic() + 10
+    while not feed.dropped and time.monotonic() < deadline:
+        channel.publish(_event(published, preview))
+        published += 1
+        time.sleep(0.002)
+    try:
+        assert feed.dropped == 1
+        assert _wait(lambda: feed.clients == 1)
+        # The client that keeps up still gets everything
+        assert _wait(lambda: len(received) == published)
+        assert [event.request_id for event in received] == list(range(published))
+    finally:
+        watcher.close()
+        stalled.close()
+
+
+def test_reconnect_does_not_repeat_history(channel, start_feed, monkeypatch):
+    monkeypatch.setattr(feed_module, "FEED_RECONNECT_DELAY", 0.05)
+    feed = start_feed(batch_interval=0.01)
+    for request_id in range(3):
+        channel.publish(_event(request_id))
+    assert _wait(lambda: len(feed._recent) == 3)
+
+    received = []
+    client = FeedClient(f"http://127.0.0.1:{feed.port}", received.append)
+    client.start()
+    try:
+        assert client.wait_connected(5)
+        assert _wait(lambda: len(received) == 3)
+
+        # Cut the connection from the server side
+        def disconnect() -> None:
+            for connection in list(feed._clients):
+                connection.transport.abort()
+
+        feed._loop.call_soon_threadsafe(disconnect)
+        assert _wait(lambda: client.reconnects == 1 and client.connected and feed.connected == 2)
+        channel.publish(_event(3))
+        assert _wait(lambda: len(received) == 4)
+        # The cut connection is forgotten once writing to it fails
+        assert _wait(lambda: feed.clients == 1)
+        time.sleep(0.1)
+    finally:
+        client.close()
+    assert [event.request_id for event in received] == [0, 1, 2, 3]
+    assert client.received == 4
@@ -0,0 +1,30 @@
+"""Prometheus exposition across workers."""
+
+from tokentap.metrics import MetricsRegistry, merge_expositions
+
+
+def _worker(worker_id: int) -> MetricsRegistry:
+    metrics = MetricsRegistry({"worker": str(worker_id)})
+    metrics.counter("requests_total", "Requests", ("model",)).inc(worker_id + 1, ("m",))
+    metrics.histogram("duration_seconds", "Duration", buckets=(1.0,)).observe(0.5)
+    return metrics
+
+
+def test_merge_keeps_each_family_together():
+    text = merge_expositions([_worker(0).render(), _worker(1).render(), ""])
+    lines = text.splitlines()
+    assert lines[:4] == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{model="m",worker="0"} 1',
+        'requests_total{model="m",worker="1"} 2',
+    ]
+    assert lines.count("# TYPE duration_seconds histogram") == 1
+    assert 'duration_seconds_bucket{worker="1",le="+Inf"} 1' in lines
+    assert lines.index("# TYPE duration_seconds histogram") > lines.index('requests_total{model="m",worker="1"} 2')
+
+
+def test_single_process_has_no_worker_label():
+    metrics = MetricsRegistry()
+    metrics.gauge("inflight", "In flight").set(3)
+    assert metrics.render().splitlines()[-1] == "inflight 3"
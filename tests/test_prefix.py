@@ -0,0 +1,93 @@
+"""Prompt prefix reuse tracking."""
+
+from tokentap.prefix import PrefixTracker
+
+SYSTEM = {"role": "system", "content": "You are a helpful assistant." * 2}
+
+
+def _conversation(*turns: str, system: dict = SYSTEM) -> list[dict]:
+    roles = ("user", "assistant")
+    return [system, *({"role": roles[i % 2], "content": turn} for i, turn in enumerate(turns))]
+
+
+def test_growing_conversation_reuses_the_previous_prompt():
+    tracker = PrefixTracker()
+    first = tracker.track(_conversation("hello"), "m", 100)
+    second = tracker.track(_conversation("hello", "hi there", "how are you?"), "m", 160)
+    third = tracker.track(_conversation("hello", "hi there", "how are you?", "fine", "good"), "m", 200)
+
+    assert first[0] == 0
+    # The whole earlier prompt is counted exactly, not estimated
+    assert second[0] == 100
+    assert third[0] == 160
+    assert first[1] == second[1] == third[1]
+    assert third[2] == (100 + 160) / (100 + 160 + 200)
+    stats = tracker.stats()
+    assert (stats["requests"], stats["prompt_tokens"], stats["prefix_tokens"]) == (3, 460, 260)
+    assert stats["recent_sessions"][first[1]]["requests"] == 3
+
+
+def test_shared_system_prompt_is_a_partial_hit():
+    tracker = PrefixTracker()
+    system = {"role": "system", "content": "x" * 30}
+    tracker.track(_conversation("y" * 10, system=system), "m", 82)
+    # The system prompt is 30 of the 41 characters of the first prompt
+    prefix_tokens, _, _ = tracker.track(_conversation("z" * 10, system=system), "m", 82)
+    assert prefix_tokens == 82 * 30 // 41
+    # Never more than the prompt itself
+    assert tracker.track(_conversation(system=system), "m", 5)[0] == 5
+
+
+def test_changed_system_prompt_or_model_is_a_miss():
+    tracker = PrefixTracker()
+    session = tracker.track(_conversation("hello"), "m", 100)[1]
+    changed = tracker.track(_conversation("hello", "hi", "more", system={"role": "system", "content": "Be terse."}), "m", 120)
+    assert changed[0] == 0
+    # Same conversation, so the drop in reuse shows in its session
+    assert changed[1] == session
+    other_model = tracker.track(_conversation("hello"), "other", 100)
+    assert other_model[0] == 0
+    assert other_model[1] != session
+
+
+def test_index_evicts_least_recently_used_prefixes():
+    tracker = PrefixTracker(max_entries=4)
+    a, b, c = _conversation("a"), _conversation("b"), _conversation("c")
+    tracker.track(a, "m", 10)
+    tracker.track(b, "m", 10)
+    # The system prompt is shared, so the index holds system, a and b
+    assert (tracker.entries, tracker.evictions) == (3, 0)
+    # Touching a makes b the least recently used
+    assert tracker.track(a, "m", 10)[0] == 10
+    tracker.track(c, "m", 10)
+    tracker.track(_conversation("d"), "m", 10)
+    assert tracker.entries == 4
+    assert tracker.evictions == 1
+    assert tracker.track(a, "m", 10)[0] == 10
+    # b's own prefix is gone; only the shared system prompt is found
+    assert tracker.track(b, "m", 10)[0] < 10
+
+
+def test_everything_evicted_gives_no_reuse():
+    tracker = PrefixTracker(max_entries=2)
+    tracker.track(_conversation("a"), "m", 10)
+    tracker.track(_conversation("b", system={"role": "system", "content": "other"}), "m", 10)
+    assert tracker.evictions == 2
+    assert tracker.track(_conversation("a"), "m", 10)[0] == 0
+    assert tracker.stats()["max_entries"] == 2
+
+
+def test_sessions_are_bounded():
+    tracker = PrefixTracker(max_sessions=2)
+    sessions = [tracker.track(_conversation(turn), "m", 10)[1] for turn in ("a", "b", "c")]
+    assert tracker.sessions == 2
+    assert list(tracker.stats()["recent_sessions"]) == [sessions[2], sessions[1]]
+    # A dropped session starts its totals again
+    tracker.track(_conversation("a", "reply", "more"), "m", 20)
+    assert tracker.stats()["recent_sessions"][sessions[0]]["requests"] == 1
+
+
+def test_prompt_without_messages_is_not_tracked():
+    tracker = PrefixTracker()
+    assert tracker.track([], "m", 10) is None
+    assert tracker.stats()["requests"] == 0
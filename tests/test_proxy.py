@@ -0,0 +1,244 @@
+"""Proxy responses when the upstream fails part way."""
+
+import asyncio
+import json
+import socket
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from tokentap.proxy import ProxyServer
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _stalling_upstream(port: int, stall: bool) -> web.AppRunner:
+    """Start a server streaming one chunk, then stalling or waiting before the rest."""
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        if not stall:
+            await asyncio.sleep(1)
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        try:
+            await resp.prepare(request)
+            await resp.write(b'data: {"choices": [{"index": 0, "delta": {"content": "hi"}}]}\n\n')
+            await asyncio.sleep(1)
+            await resp.write(b"data: [DONE]\n\n")
+        except ConnectionError:
+            pass
+        return resp
+
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+@pytest.mark.parametrize("stall", [True, False], ids=["after-headers", "before-headers"])
+def test_read_timeout(tmp_path, offline_encodings, stall):
+    async def run() -> tuple[int | None, bytes | None, list]:
+        upstream_port, port = _free_port(), _free_port()
+        upstream = await _stalling_upstream(upstream_port, stall)
+        events = []
+        proxy = ProxyServer(
+            base_url=f"http://127.0.0.1:{upstream_port}",
+            port=port,
+            prompts_dir=tmp_path,
+            on_response=events.append,
+            read_timeout=0.2,
+        )
+        await proxy.start()
+        status = body = None
+        try:
+            request = {"model": "test", "stream": True, "messages": [{"role": "user", "content": "hello"}]}
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+                async with session.post(f"http://127.0.0.1:{port}/v1/chat/completions", json=request) as resp:
+                    status = resp.status
+                    try:
+                        body = await resp.read()
+                    except aiohttp.ClientPayloadError:
+                        body = None
+            for _ in range(50):
+                if events:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            await proxy.stop()
+            await upstream.cleanup()
+        return status, body, events
+
+    status, body, events = asyncio.run(run())
+    if stall:
+        # The 200 was already sent; the body must not look complete
+        assert status == 200
+        assert body is None
+    else:
+        assert status == 504
+        assert body == b"Upstream timeout"
+    assert [event.status for event in events] == [504]
+
+
+async def _slow_stream(port: int) -> web.AppRunner:
+    """Start a server streaming ten chunks 50 ms apart."""
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        try:
+            for _ in range(10):
+                await resp.write(b'data: {"choices": [{"index": 0, "delta": {"content": "hi"}}]}\n\n')
+                await asyncio.sleep(0.05)
+            await resp.write(b"data: [DONE]\n\n")
+        except ConnectionError:
+            pass
+        return resp
+
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def test_client_disconnect_is_not_an_upstream_error(tmp_path, offline_encodings):
+    async def run() -> tuple[list, list[dict], str]:
+        ports = [_free_port(), _free_port()]
+        upstreams = [await _slow_stream(upstream_port) for upstream_port in ports]
+        port = _free_port()
+        events = []
+        proxy = ProxyServer(
+            base_url=f"http://127.0.0.1:{ports[0]}",
+            port=port,
+            prompts_dir=tmp_path,
+            upstreams=[f"http://127.0.0.1:{upstream_port}" for upstream_port in ports],
+            on_response=events.append,
+        )
+        await proxy.start()
+        try:
+            request = {"model": "test", "stream": True, "messages": [{"role": "user", "content": "hello"}]}
+            for _ in range(8):
+                async with aiohttp.ClientSession() as session:
+                    resp = await session.post(f"http://127.0.0.1:{port}/v1/chat/completions", json=request)
+                    await resp.content.readany()
+                    resp.close()
+            for _ in range(100):
+                if len(events) == 8:
+                    break
+                await asyncio.sleep(0.05)
+            metrics = proxy.metrics.render()
+            upstream_stats = proxy.upstreams.stats()
+        finally:
+            await proxy.stop()
+            for upstream in upstreams:
+                await upstream.cleanup()
+        return events, upstream_stats, metrics
+
+    events, upstream_stats, metrics = asyncio.run(run())
+    assert [event.status for event in events] == [499] * 8
+    assert all(upstream["healthy"] and not upstream["errors"] for upstream in upstream_stats)
+    assert "tokentap_upstream_errors_total{" not in metrics
+    assert 'tokentap_client_disconnects_total{model="test"} 8' in metrics
+
+
+_USAGE = {"prompt_tokens": 321, "completion_tokens": 45, "total_tokens": 366}
+
+
+async def _usage_upstream(port: int, bodies: list) -> web.AppRunner:
+    """Start a server reporting usage the way OpenAI does, recording each request body."""
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        bodies.append(body)
+        if not body.get("stream"):
+            return web.json_response({
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "hi"}, "finish_reason": "stop"}],
+                "usage": _USAGE,
+            })
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        chunks = [
+            {"choices": [{"index": 0, "delta": {"role": "assistant", "content": "hi"}}]},
+            {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+        ]
+        if include_usage:
+            chunks = [{**chunk, "usage": None} for chunk in chunks] + [{"choices": [], "usage": _USAGE}]
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for chunk in chunks:
+            # Split every event so the report straddles network reads
+            frame = f"data: {json.dumps({'object': 'chat.completion.chunk', **chunk})}\n\n".encode()
+            await resp.write(frame[:20])
+            await asyncio.sleep(0.005)
+            await resp.write(frame[20:])
+        await resp.write(b"data: [DONE]\n\n")
+        return resp
+
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+@pytest.mark.parametrize(
+    "request_options",
+    [None, {"include_usage": True}, "plain"],
+    ids=["injected", "client-asked", "not-streamed"],
+)
+def test_upstream_usage_is_parsed_and_injected_reports_are_hidden(tmp_path, offline_encodings, request_options):
+    async def run() -> tuple[list, list, bytes]:
+        upstream_port, port = _free_port(), _free_port()
+        bodies, events = [], []
+        upstream = await _usage_upstream(upstream_port, bodies)
+        proxy = ProxyServer(
+            base_url=f"http://127.0.0.1:{upstream_port}",
+            port=port,
+            prompts_dir=tmp_path,
+            on_response=events.append,
+            usage_source="upstream",
+            include_usage=True,
+        )
+        await proxy.start()
+        try:
+            request = {"model": "test", "stream": request_options != "plain", "messages": [{"role": "user", "content": "hello"}]}
+            if isinstance(request_options, dict):
+                request["stream_options"] = request_options
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+                async with session.post(f"http://127.0.0.1:{port}/v1/chat/completions", json=request) as resp:
+                    body = await resp.read()
+            for _ in range(100):
+                if events:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            await proxy.stop()
+            await upstream.cleanup()
+        return bodies, events, body
+
+    bodies, events, body = asyncio.run(run())
+    [event] = events
+    assert (event.tokens, event.output_tokens, event.usage_source) == (321, 45, "upstream")
+    if request_options == "plain":
+        assert "stream_options" not in bodies[0]
+        assert json.loads(body)["usage"] == _USAGE
+        return
+    assert bodies[0]["stream_options"] == {"include_usage": True}
+    frames = [frame for frame in body.decode().split("\n\n") if frame]
+    assert frames[-1] == "data: [DONE]"
+    chunks = [json.loads(frame.removeprefix("data: ")) for frame in frames[:-1]]
+    assert all(chunk["choices"] for chunk in chunks[:2])
+    if request_options is None:
+        # The report the proxy asked for is not relayed to a client that did not
+        assert len(chunks) == 2
+    else:
+        assert len(chunks) == 3
+        assert chunks[-1] == {"object": "chat.completion.chunk", "choices": [], "usage": _USAGE}
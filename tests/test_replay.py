@@ -0,0 +1,107 @@
+"""Replaying an archive against a model server."""
+
+import asyncio
+import json
+import socket
+
+from aiohttp import web
+
+from tokentap.archive import ContentStore, dump_json
+from tokentap.replay import Replayer, iter_archive
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _body(content: str, stream: bool = True) -> dict:
+    return {"model": "m", "stream": stream, "messages": [{"role": "user", "content": content}]}
+
+
+def _write_archive(prompts_dir) -> None:
+    """Archive two requests per file and two in the dedup store, interleaved in time."""
+    (prompts_dir / "2026-01-01_10-00-00-000000_000001_up.json").write_bytes(dump_json(_body("first")))
+    (prompts_dir / "2026-01-01_10-00-02-000000_000003_up.json").write_bytes(dump_json(_body("third", stream=False)))
+    (prompts_dir / "2026-01-01_10-00-02-000000_000003_up_response.json").write_bytes(dump_json({"usage": {}}))
+    store = ContentStore(prompts_dir, "gzip")
+    for request_id, second, content in ((2, 1, "second"), (4, 3, "fourth")):
+        name = f"2026-01-01_10-00-0{second}-000000_{request_id:06d}_up"
+        metadata = {"request_id": request_id, "timestamp": f"2026-01-01T10:00:0{second}", "path": "/v1/chat/completions?beta=1"}
+        store.save_request(name, metadata, _body(content))
+
+
+async def _upstream(port: int, received: list) -> web.AppRunner:
+    """Start a server answering with usage, recording each request."""
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        received.append((request.path, body))
+        usage = {"prompt_tokens": 10, "completion_tokens": 3}
+        if not body.get("stream"):
+            return web.json_response({"object": "chat.completion", "choices": [], "usage": usage})
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for chunk in ({"choices": [{"index": 0, "delta": {"content": "ok"}}]}, {"choices": [], "usage": usage}):
+            await resp.write(f"data: {json.dumps({'object': 'chat.completion.chunk', **chunk})}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        return resp
+
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def _replay(requests, **options) -> tuple[dict, list]:
+    async def run():
+        port = _free_port()
+        received = []
+        upstream = await _upstream(port, received)
+        try:
+            report = await Replayer(f"http://127.0.0.1:{port}", **options).run(requests)
+        finally:
+            await upstream.cleanup()
+        return report, received
+
+    return asyncio.run(run())
+
+
+def test_archive_is_listed_without_reading_bodies(tmp_path):
+    _write_archive(tmp_path)
+    requests = iter_archive(tmp_path)
+    assert not isinstance(requests, list)
+    requests = list(requests)
+    assert [request.name.split("_")[2] for request in requests] == ["000001", "000002", "000003", "000004"]
+    assert not hasattr(requests[0], "body")
+    assert requests[1].load() == ("/v1/chat/completions", _body("second"))
+
+
+def test_replay_sends_every_archived_request(tmp_path):
+    _write_archive(tmp_path)
+    report, received = _replay(list(iter_archive(tmp_path)), concurrency=1)
+
+    assert (report["requests"], report["succeeded"], report["errors"]) == (4, 4, {})
+    assert report["output_tokens"] == 12
+    assert [body["messages"][0]["content"] for _, body in received] == ["first", "second", "third", "fourth"]
+    assert {path for path, _ in received} == {"/v1/chat/completions"}
+    # Streams ask for usage so decode rates use token counts
+    assert [body.get("stream_options") for _, body in received] == [{"include_usage": True}] * 2 + [None, {"include_usage": True}]
+
+
+def test_body_is_read_when_its_request_is_sent(tmp_path):
+    _write_archive(tmp_path)
+    requests = list(iter_archive(tmp_path))
+    # Bodies that change or disappear after the scan are read as they are then
+    requests[0].source.write_bytes(dump_json(_body("rewritten")))
+    requests[2].source.unlink()
+    report, received = _replay(requests, rate=50, model="other")
+
+    assert report["errors"] == {"UnreadableBody": 1}
+    assert report["succeeded"] == 3
+    assert sorted(body["messages"][0]["content"] for _, body in received) == ["fourth", "rewritten", "second"]
+    assert {body["model"] for _, body in received} == {"other"}
+    assert report["schedule_lag_ms"] is not None
@@ -0,0 +1,164 @@
+"""Incremental SSE parsing and response assembly."""
+
+import json
+
+import pytest
+
+from tokentap.sse import ResponseAssembler, SSEDecoder, UsageReportFilter
+
+
+def _openai_stream(line_end: str = "\n") -> bytes:
+    chunks = [
+        {"choices": [{"index": 0, "delta": {"role": "assistant"}}], "usage": None},
+        {"choices": [{"index": 0, "delta": {"content": "Héllo, "}}], "usage": None},
+        {"choices": [{"index": 0, "delta": {"content": "世界 🌍"}}], "usage": None},
+        {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": None},
+        {"choices": [], "usage": {"prompt_tokens": 12, "completion_tokens": 5, "prompt_tokens_details": {"cached_tokens": 8}}},
+    ]
+    frames = [
+        f"data: {json.dumps({'id': 'c1', 'object': 'chat.completion.chunk', 'model': 'm', **chunk}, ensure_ascii=False)}"
+        for chunk in chunks
+    ]
+    frames.append("data: [DONE]")
+    return "".join(frame + line_end * 2 for frame in frames).encode()
+
+
+def _anthropic_stream() -> bytes:
+    events = [
+        ("message_start", {"type": "message_start", "message": {"id": "msg", "role": "assistant", "model": "claude", "usage": {"input_tokens": 10, "cache_read_input_tokens": 30, "output_tokens": 1}}}),
+        ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}),
+        ("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Grüße"}}),
+        ("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": " aus Köln"}}),
+        ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+        ("content_block_start", {"type": "content_block_start", "index": 1, "content_block": {"type": "tool_use", "id": "t", "name": "f", "input": {}}}),
+        ("content_block_delta", {"type": "content_block_delta", "index": 1, "delta": {"type": "input_json_delta", "partial_json": '{"city": '}}),
+        ("content_block_delta", {"type": "content_block_delta", "index": 1, "delta": {"type": "input_json_delta", "partial_json": '"Köln"}'}}),
+        ("content_block_stop", {"type": "content_block_stop", "index": 1}),
+        ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "tool_use"}, "usage": {"output_tokens": 7}}),
+        ("message_stop", {"type": "message_stop"}),
+    ]
+    return "".join(f"event: {name}\r\ndata: {json.dumps(data, ensure_ascii=False)}\r\n\r\n" for name, data in events).encode()
+
+
+def _decode(chunks: list[bytes]) -> list[tuple[str, str]]:
+    decoder = SSEDecoder()
+    events = []
+    for chunk in chunks:
+        events.extend(decoder.feed(chunk))
+    return events + decoder.close()
+
+
+@pytest.mark.parametrize("line_end", ["\n", "\r\n", "\r"])
+def test_every_split_point_gives_the_same_events(line_end):
+    stream = _openai_stream(line_end)
+    expected = _decode([stream])
+    assert len(expected) == 6
+    for split in range(1, len(stream)):
+        assert _decode([stream[:split], stream[split:]]) == expected, split
+
+
+def test_split_inside_crlf_and_multibyte_characters():
+    stream = _anthropic_stream()
+    expected = _decode([stream])
+    crlf = stream.index(b"\r\n") + 1
+    multibyte = stream.index("ü".encode()) + 1
+    emoji = _openai_stream().index("🌍".encode())
+    assert _decode([stream[:crlf], stream[crlf:]]) == expected
+    assert _decode([stream[:multibyte], stream[multibyte:]]) == expected
+    assert "�" not in "".join(data for _, data in expected)
+    openai = _openai_stream()
+    assert _decode([openai[: emoji + 2], openai[emoji + 2 : emoji + 3], openai[emoji + 3 :]]) == _decode([openai])
+    # One byte at a time
+    assert _decode([stream[i : i + 1] for i in range(len(stream))]) == expected
+
+
+def test_empty_read_between_cr_and_lf():
+    assert _decode([b"data: a\r", b"", b"\ndata: b\r\n\r\n"]) == [("message", "a\nb")]
+
+
+def _assemble(stream: bytes, chunk_size: int) -> ResponseAssembler:
+    assembler = ResponseAssembler("text/event-stream; charset=utf-8")
+    for start in range(0, len(stream), chunk_size):
+        assembler.feed(stream[start : start + chunk_size])
+    assembler.close()
+    return assembler
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_openai_stream_is_merged(chunk_size):
+    assembler = _assemble(_openai_stream("\r\n"), chunk_size)
+    assert assembler.kind == "openai"
+    assert assembler.output_text() == "Héllo, 世界 🌍"
+    assert assembler.result()["choices"][0]["finish_reason"] == "stop"
+    assert assembler.usage() == {"prompt_tokens": 12, "completion_tokens": 5, "cached_tokens": 8}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 4096])
+def test_anthropic_stream_is_merged(chunk_size):
+    assembler = _assemble(_anthropic_stream(), chunk_size)
+    assert assembler.kind == "anthropic"
+    result = assembler.result()
+    assert result["content"][0]["text"] == "Grüße aus Köln"
+    assert result["content"][1]["input"] == {"city": "Köln"}
+    assert result["stop_reason"] == "tool_use"
+    # Cache reads count as prompt tokens
+    assert assembler.usage() == {"prompt_tokens": 40, "completion_tokens": 7, "cached_tokens": 30}
+
+
+def test_final_frame_without_blank_line_is_dispatched():
+    stream = _openai_stream().rsplit(b"data: [DONE]", 1)[0].rstrip(b"\n")
+    assert stream.endswith(b"}")
+    assembler = _assemble(stream, 4096)
+    assert assembler.usage() == {"prompt_tokens": 12, "completion_tokens": 5, "cached_tokens": 8}
+
+
+def test_truncated_final_frame_is_ignored():
+    stream = _openai_stream()
+    cut = stream.index(b'data: {"id": "c1", "object": "chat.completion.chunk", "model": "m", "choices": []')
+    assembler = _assemble(stream[: cut + 40], 4096)
+    assert assembler.output_text() == "Héllo, 世界 🌍"
+    assert assembler.usage() is None
+
+
+def test_plain_json_body():
+    body = {"choices": [{"message": {"content": "hi"}}], "usage": {"prompt_tokens": 3, "completion_tokens": 1}}
+    assembler = ResponseAssembler("application/json")
+    data = json.dumps(body).encode()
+    assembler.feed(data[:10])
+    assembler.feed(data[10:])
+    assembler.close()
+    assert assembler.output_text() == "hi"
+    assert assembler.usage() == {"prompt_tokens": 3, "completion_tokens": 1, "cached_tokens": None}
+
+
+@pytest.mark.parametrize("line_end", ["\n", "\r\n", "\r"], ids=["lf", "crlf", "cr"])
+def test_usage_report_is_filtered_at_every_split_point(line_end):
+    stream = _openai_stream(line_end)
+    frames = stream.split(line_end.encode() * 2)
+    expected = (line_end.encode() * 2).join(frame for frame in frames if b'"choices": []' not in frame)
+    for split in range(len(stream) + 1):
+        usage_filter = UsageReportFilter()
+        relayed = usage_filter.feed(stream[:split]) + usage_filter.feed(stream[split:]) + usage_filter.close()
+        assert relayed == expected, split
+        assert usage_filter.removed == 1
+    # Complete events are passed on without waiting for the next one
+    usage_filter = UsageReportFilter()
+    assert usage_filter.feed(frames[0] + line_end.encode() * 2 + frames[1][:5]) == frames[0] + line_end.encode() * 2
+
+
+def test_usage_filter_keeps_other_chunks_without_choices():
+    stream = (
+        b'data: {"object": "chat.completion.chunk", "choices": [], "prompt_filter_results": []}\n\n'
+        b'data: {"object": "chat.completion.chunk", "choices": [], "usage": null}\n\n'
+        b"data: not json\n\n"
+        b"data: [DONE]\n\n"
+    )
+    usage_filter = UsageReportFilter()
+    assert usage_filter.feed(stream) + usage_filter.close() == stream
+    assert usage_filter.removed == 0
+
+
+def test_unterminated_usage_report_is_filtered_on_close():
+    usage_filter = UsageReportFilter()
+    assert usage_filter.feed(b'data: {"choices": [], "usage": {"prompt_tokens": 1}}') == b""
+    assert usage_filter.close() == b""
@@ -0,0 +1,168 @@
+"""Session store, recorder, stats and import."""
+
+import sqlite3
+from dataclasses import replace
+
+from click.testing import CliRunner
+
+from tokentap.archive import ContentStore, dump_json, render_markdown
+from tokentap.cli import main
+from tokentap.events import EventChannel, RequestEvent
+from tokentap.store import SessionStore, StoreRecorder, store_path
+
+
+def _request(request_id: int, model: str = "gpt-4o", tokens: int = 100, minute: int = 0) -> RequestEvent:
+    return RequestEvent(
+        request_id=request_id,
+        timestamp=f"2026-01-01T10:{minute:02d}:00.000000",
+        provider="openai",
+        path="/v1/chat/completions",
+        model=model,
+        tokens=tokens,
+        message_count=2,
+    )
+
+
+def _response(event: RequestEvent, duration_s: float, output_tokens: int = 10) -> RequestEvent:
+    return replace(event, type="response", status=200, ttft_s=duration_s / 2, duration_s=duration_s, output_tokens=output_tokens)
+
+
+def _rows(path) -> list[tuple]:
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT request_id, model, status, prompt_tokens, completion_tokens, duration_s FROM requests ORDER BY request_id").fetchall()
+
+
+def _populate(path) -> None:
+    store = SessionStore(path)
+    requests = [_request(1, tokens=100), _request(2, tokens=200, minute=1), _request(3, model="claude", tokens=50, minute=2)]
+    responses = [_response(requests[0], 1.0, 10), _response(requests[1], 3.0, 20), _response(requests[2], 2.0, 5)]
+    store.insert_events(requests)
+    store.insert_events(responses)
+    store.close()
+
+
+def test_upsert_merges_request_and_response_and_is_idempotent(tmp_path):
+    path = tmp_path / "store.db"
+    event = _request(1)
+    store = SessionStore(path)
+    for _ in range(2):
+        store.insert_events([event])
+        store.insert_events([_response(event, 1.5)])
+    # A late request event does not erase what the response filled in
+    store.insert_events([event])
+    store.close()
+    assert _rows(path) == [(1, "gpt-4o", 200, 100, 10, 1.5)]
+
+
+def test_summary_and_slowest(tmp_path):
+    path = tmp_path / "store.db"
+    _populate(path)
+    store = SessionStore(path)
+    try:
+        summary = {row["key"]: row for row in store.summary("model")}
+        slowest = store.slowest(2)
+        recent = store.summary("model", since="2026-01-01T10:01:00")
+    finally:
+        store.close()
+
+    assert summary["gpt-4o"]["requests"] == 2
+    assert summary["gpt-4o"]["prompt_tokens"] == 300
+    assert summary["gpt-4o"]["completion_tokens"] == 30
+    assert summary["gpt-4o"]["duration_s"] == 2.0
+    assert summary["gpt-4o"]["max_duration_s"] == 3.0
+    assert summary["gpt-4o"]["ttft_s"] == 1.0
+    assert summary["claude"]["requests"] == 1
+    assert [row["request_id"] for row in slowest] == [2, 3]
+    assert {row["key"]: row["requests"] for row in recent} == {"claude": 1, "gpt-4o": 1}
+
+
+def test_stats_command_lists_the_slowest_requests(tmp_path):
+    _populate(store_path(tmp_path))
+    result = CliRunner().invoke(main, ["stats", "--prompts-dir", str(tmp_path), "--slowest", "2"], env={"COLUMNS": "200"})
+    assert result.exit_code == 0, result.output
+    assert "Requests by model" in result.output
+    assert "Slowest 2 requests" in result.output
+    slow = result.output.split("Slowest 2 requests")[1]
+    cells = [
+        [cell.strip() for cell in line.replace("┃", "│").split("│")[1:-1]]
+        for line in slow.splitlines()
+        if "│" in line or "┃" in line
+    ]
+    assert cells[0] == ["Time", "Model", "Path", "Prompt", "Completion", "TTFT", "Duration"]
+    assert [row[-1] for row in cells[1:]] == ["3.00s", "2.00s"]
+
+
+def test_stats_command_without_a_store(tmp_path):
+    result = CliRunner().invoke(main, ["stats", "--prompts-dir", str(tmp_path)])
+    assert result.exit_code != 0
+    assert "tokentap import" in result.output
+
+
+def test_import_files_archive_round_trip(tmp_path):
+    stem = "2026-01-01_10-00-00-123456_000007_openai"
+    messages = [{"role": "user", "content": "hello"}]
+    (tmp_path / f"{stem}.json").write_bytes(dump_json({"model": "gpt-4o", "messages": messages}))
+    (tmp_path / f"{stem}.md").write_bytes(render_markdown("2026-01-01T10:00:00.123456", "openai", "gpt-4o", 1234, messages))
+    (tmp_path / f"{stem}_response.json").write_bytes(dump_json({"usage": {"completion_tokens": 42}}))
+    # Older archives named without microseconds or request id
+    (tmp_path / "2026-01-01_09-00-00_anthropic.json").write_bytes(dump_json({"model": "claude", "messages": messages * 2}))
+
+    runner = CliRunner()
+    for _ in range(2):
+        result = runner.invoke(main, ["import", "--prompts-dir", str(tmp_path)])
+        assert result.exit_code == 0, result.output
+        assert "Indexed 2 requests" in result.output
+
+    with sqlite3.connect(store_path(tmp_path)) as conn:
+        rows = conn.execute(
+            "SELECT timestamp, request_id, provider, model, prompt_tokens, completion_tokens, message_count FROM requests ORDER BY timestamp"
+        ).fetchall()
+    assert rows == [
+        ("2026-01-01T09:00:00", 0, "anthropic", "claude", None, None, 2),
+        ("2026-01-01T10:00:00.123456", 7, "openai", "gpt-4o", 1234, 42, 1),
+    ]
+
+
+def test_import_dedup_archive_keeps_live_rows(tmp_path):
+    content = ContentStore(tmp_path)
+    for request_id in (1, 2):
+        name = f"2026-01-01_10-00-0{request_id}-000000_{request_id:06d}_openai"
+        metadata = {
+            "request_id": request_id,
+            "timestamp": f"2026-01-01T10:00:0{request_id}",
+            "provider": "openai",
+            "path": "/v1/chat/completions",
+            "model": "gpt-4o",
+            "tokens": 10 * request_id,
+        }
+        content.save_request(name, metadata, {"model": "gpt-4o", "messages": [{"role": "user", "content": str(request_id)}]})
+        content.save_response(name, {"usage": {"completion_tokens": request_id}})
+
+    store = SessionStore(store_path(tmp_path))
+    try:
+        # A row the proxy recorded live wins over the archive
+        live = replace(_request(1, tokens=99), timestamp="2026-01-01T10:00:01", status=200)
+        store.insert_events([live])
+        assert store.import_prompts(tmp_path) == 2
+        assert store.import_prompts(tmp_path) == 2
+    finally:
+        store.close()
+
+    with sqlite3.connect(store_path(tmp_path)) as conn:
+        rows = conn.execute("SELECT request_id, path, prompt_tokens, completion_tokens, status FROM requests ORDER BY request_id").fetchall()
+    assert rows == [(1, "/v1/chat/completions", 99, None, 200), (2, "/v1/chat/completions", 20, 2, None)]
+
+
+def test_recorder_writes_channel_events(tmp_path):
+    path = tmp_path / "store.db"
+    channel = EventChannel()
+    recorder = StoreRecorder(path, channel.subscribe(), flush_interval=0.01)
+    recorder.start()
+    event = _request(1)
+    channel.publish(event)
+    channel.publish(_response(event, 0.5))
+    channel.publish(_request(2))
+    recorder.close()
+
+    assert recorder.stats() == {"recorded": 3, "errors": 0}
+    assert _rows(path) == [(1, "gpt-4o", 200, 100, 10, 0.5), (2, "gpt-4o", None, 100, None, None)]
@@ -0,0 +1,58 @@
+"""Token counting: cached message segments and tokenizer selection."""
+
+import random
+
+import pytest
+import tiktoken
+
+from tokentap import parser
+from tokentap.encoders import EncoderCache, TokenizerMap
+
+_PIECES = ["hello", " world", "Hello", "'s", "42", "1234", " ", "  ", "\n", "\n\n", " \n", ".", "!", "/", "é", "\t", "x"]
+
+
+@pytest.fixture
+def fresh_caches(monkeypatch, offline_encodings):
+    monkeypatch.setattr(parser, "encoders", EncoderCache())
+    monkeypatch.setattr(parser, "token_cache", parser.TokenCountCache())
+
+
+def _conversations(rng: random.Random, count: int):
+    """Yield message lists, often extending the previous one as clients do."""
+    messages = []
+    for _ in range(count):
+        if rng.random() < 0.3:
+            messages = []
+        content = "".join(rng.choice(_PIECES) for _ in range(rng.randint(0, 6)))
+        messages = messages + [{"role": rng.choice(["system", "user", "assistant"]), "content": content}]
+        yield messages
+
+
+@pytest.mark.parametrize("name", ["cl100k_base", "o200k_base", "r50k_base", "p50k_base"])
+def test_cached_counts_match_full_encode(fresh_caches, name):
+    encoding = tiktoken.get_encoding(name)
+    rng = random.Random(name)
+    for messages in _conversations(rng, 3000):
+        text = "\n".join(msg["content"] for msg in messages)
+        assert parser.count_message_tokens(messages, name) == len(encoding.encode_ordinary(text)), messages
+
+
+def test_only_safe_encodings_split_messages(fresh_caches):
+    assert parser.encoders.get("cl100k_base").splits_messages
+    assert parser.encoders.get("o200k_base").splits_messages
+    assert not parser.encoders.get("r50k_base").splits_messages
+    assert not parser.encoders.get("p50k_base").splits_messages
+
+
+def test_configured_default_wins_over_lookups(tmp_path):
+    tokenizers = TokenizerMap({"*": "r50k_base", "qwen*": "o200k_base"}, hub_cache=tmp_path)
+    assert tokenizers.resolve("gpt-4o") == "r50k_base"
+    assert tokenizers.resolve("Qwen2.5-7B") == "o200k_base"
+    assert TokenizerMap(hub_cache=tmp_path).resolve("gpt-4o") == "o200k_base"
+
+
+def test_failed_tokenizer_falls_back_to_configured_default(offline_encodings, tmp_path):
+    cache = EncoderCache()
+    assert cache.get(f"hf:{tmp_path / 'missing.json'}", "o200k_base").name == "o200k_base"
+    assert cache.get(f"hf:{tmp_path / 'other.json'}").name == "cl100k_base"
+    assert cache.get("not_an_encoding", "not_an_encoding").name == "cl100k_base"
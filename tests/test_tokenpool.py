@@ -0,0 +1,30 @@
+"""Token count pool statistics."""
+
+import asyncio
+
+import pytest
+
+from tokentap import parser
+from tokentap.tokenpool import TokenCountPool
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_cache_stats_come_from_the_counting_workers(monkeypatch, offline_encodings, mode):
+    monkeypatch.setattr(parser, "token_cache", parser.TokenCountCache())
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "hello world"}]
+
+    async def run() -> tuple[list[int], dict]:
+        pool = TokenCountPool(workers=1, mode=mode, batch_window=0)
+        try:
+            counts = [await pool.count(messages, "cl100k_base") for _ in range(3)]
+            return counts, pool.cache_stats()
+        finally:
+            pool.close()
+
+    counts, stats = asyncio.run(run())
+    assert len(set(counts)) == 1
+    assert stats["misses"] == 2
+    assert stats["hits"] == 4
+    assert stats["entries"] == 2
+    # The cache of this process is only used in thread mode
+    assert parser.token_cache.stats()["hits"] == (4 if mode == "thread" else 0)
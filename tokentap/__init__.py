@@ -1,3 +1,8 @@
 """tokentap - Token tracker for LLM CLI tools with live terminal dashboard."""
 
+import time
+
 __version__ = "0.1.0"
+
+# When tokentap was first imported; startup timings are measured from here
+IMPORTED_AT = time.time()
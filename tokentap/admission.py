@@ -0,0 +1,205 @@
+"""Admission control: in-flight limits with a queue in front of the upstreams."""
+
+import asyncio
+import itertools
+
+from tokentap.config import DEFAULT_MAX_INFLIGHT, DEFAULT_MAX_QUEUE, DEFAULT_QUEUE_POLICY, DEFAULT_QUEUE_TIMEOUT
+from tokentap.upstream import Upstream, UpstreamPool
+
+QUEUE_POLICIES = ("fifo", "priority")
+
+
+class AdmissionRejected(Exception):
+    """A request was refused because the queue was full or it waited too long."""
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("model", "exclude", "future")
+
+    def __init__(self, model: str, exclude: list[Upstream], future: asyncio.Future):
+        self.model = model
+        self.exclude = exclude
+        self.future = future
+
+
+class AdmissionController:
+    """Caps requests in flight per upstream replica and per model.
+
+    Requests over a limit wait in a queue, served in arrival order ("fifo")
+    or by priority, then arrival ("priority"). Whenever a request finishes,
+    the queue is scanned in order and every waiter whose replica and model
+    have room is admitted, so a request for a saturated model does not hold
+    back requests for others. Without limits, admission is a plain pick and
+    acquire on the pool. Only touched from the event loop.
+    """
+
+    def __init__(
+        self,
+        pool: UpstreamPool,
+        max_inflight: int = DEFAULT_MAX_INFLIGHT,
+        model_limits: dict[str, int] | None = None,
+        policy: str = DEFAULT_QUEUE_POLICY,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        timeout: float | None = DEFAULT_QUEUE_TIMEOUT,
+    ):
+        """Initialize the controller.
+
+        Args:
+            pool: Upstream replicas to admit requests to
+            max_inflight: Requests in flight per replica, 0 for no limit
+            model_limits: Requests in flight per model; "*" applies to models not listed
+            policy: "fifo", or "priority" to serve higher priorities first
+            max_queue: Waiting requests before new ones are refused with 429, 0 for no limit
+            timeout: Seconds a request may wait before it is refused with 503, None or 0 to wait indefinitely
+        """
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy!r}")
+        self.pool = pool
+        self.max_inflight = max_inflight
+        self.model_limits = dict(model_limits or {})
+        self.policy = policy
+        self.max_queue = max_queue
+        self.timeout = timeout or None
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._queue: list[tuple[int, int, _Waiter]] = []
+        self._order = itertools.count()
+        self._models: dict[str, int] = {}
+
+    @property
+    def limited(self) -> bool:
+        """Whether any limit is configured."""
+        return bool(self.max_inflight or self.model_limits)
+
+    def _model_limit(self, model: str) -> int:
+        return self.model_limits.get(model, self.model_limits.get("*", 0))
+
+    def _try_admit(self, model: str, exclude: list[Upstream] = ()) -> Upstream | None:
+        limit = self._model_limit(model)
+        if limit and self._models.get(model, 0) >= limit:
+            return None
+        upstream = self.pool.pick(model, exclude=exclude, capacity=self.max_inflight)
+        if upstream is None:
+            return None
+        self.pool.acquire(upstream)
+        self._models[model] = self._models.get(model, 0) + 1
+        self.admitted += 1
+        return upstream
+
+    async def admit(self, model: str, priority: int = 0, exclude: list[Upstream] = ()) -> tuple[Upstream, int]:
+        """Wait for room and return the acquired replica plus the queue depth found on arrival.
+
+        Args:
+            model: Model the request is for
+            priority: Higher is served first with the "priority" policy
+            exclude: Replicas not to admit to, such as ones that already failed
+
+        Raises:
+            AdmissionRejected: With status 429 if the queue is full, 503 on timeout
+        """
+        depth = self.waiting
+        if not depth:
+            upstream = self._try_admit(model, exclude)
+            if upstream is not None:
+                return upstream, 0
+        if self.max_queue and depth >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(429, "admission queue full")
+
+        waiter = _Waiter(model, list(exclude), asyncio.get_running_loop().create_future())
+        # Lower keys are served first; _insert keeps the queue sorted
+        entry = (-priority if self.policy == "priority" else 0, next(self._order), waiter)
+        self._insert(entry)
+        self.waiting += 1
+        self.queued += 1
+        # Waiters ahead may be blocked only by their model's limit
+        self._dispatch()
+        try:
+            done, _ = await asyncio.wait([waiter.future], timeout=self.timeout)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if not done:
+            self._abandon(waiter)
+            self.timed_out += 1
+            raise AdmissionRejected(503, f"no upstream capacity within {self.timeout:g}s")
+        return waiter.future.result(), depth
+
+    async def fail_over(
+        self, upstream: Upstream, model: str, error: BaseException, priority: int, tried: list[Upstream]
+    ) -> Upstream | None:
+        """Release a replica that could not be reached and admit the request to another one.
+
+        The freed slot goes to waiters like any other release. The request
+        then waits for room on a replica not in tried, under the same
+        limits, queue and timeout as a new request. Returns None if no
+        untried replica is left.
+
+        Raises:
+            AdmissionRejected: With status 429 if the queue is full, 503 on timeout
+        """
+        self.release(upstream, model, error)
+        if self.pool.pick(model, exclude=tried) is None:
+            return None
+        fallback, _ = await self.admit(model, priority, exclude=tried)
+        return fallback
+
+    def _insert(self, entry: tuple[int, int, _Waiter]) -> None:
+        queue = self._queue
+        index = len(queue)
+        while index and queue[index - 1][:2] > entry[:2]:
+            index -= 1
+        queue.insert(index, entry)
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """Give up waiting; a slot granted in the meantime is handed on."""
+        if waiter.future.done() and not waiter.future.cancelled():
+            self.release(waiter.future.result(), waiter.model)
+            return
+        waiter.future.cancel()
+        self.waiting -= 1
+        self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+
+    def release(self, upstream: Upstream, model: str, error: BaseException | str | None = None) -> None:
+        """Finish a request admitted for model and admit waiters that now fit."""
+        self.pool.release(upstream, error)
+        count = self._models.get(model, 0) - 1
+        if count > 0:
+            self._models[model] = count
+        else:
+            self._models.pop(model, None)
+        if self._queue:
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit waiters in queue order while their replica and model have room."""
+        remaining = []
+        for entry in self._queue:
+            waiter = entry[2]
+            upstream = self._try_admit(waiter.model, waiter.exclude)
+            if upstream is None:
+                remaining.append(entry)
+                continue
+            self.waiting -= 1
+            waiter.future.set_result(upstream)
+        self._queue = remaining
+
+    def stats(self) -> dict:
+        """Return queue depth, in-flight counts per model and admission counters."""
+        return {
+            "waiting": self.waiting,
+            "inflight": sum(self._models.values()),
+            "models": dict(self._models),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
@@ -0,0 +1,432 @@
+"""Background writer and storage formats for the prompt and response archive."""
+
+import gzip
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from tokentap.config import ARCHIVE_MAX_BATCH, ARCHIVE_QUEUE_SIZE, DEDUP_KNOWN_OBJECTS, DEFAULT_ARCHIVE_FSYNC
+
+FSYNC_POLICIES = ("never", "batch", "always")
+ARCHIVE_FORMATS = ("files", "dedup")
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+# Body fields that agent clients resend unchanged on every turn
+DEDUP_FIELDS = ("messages", "system", "tools")
+
+_COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+# Archive file stems: "<date>_<time>[-<usec>][_<request id>]_<provider>"
+_ARCHIVE_NAME = re.compile(
+    r"^(?P<date>\d{4}-\d{2}-\d{2})_(?P<time>\d{2}-\d{2}-\d{2})(?:-(?P<usec>\d{6}))?"
+    r"(?:_(?P<request_id>\d{6}))?_(?P<provider>.+)$"
+)
+
+Payload = bytes | Callable[[], bytes | None]
+
+_STOP = object()
+
+
+class ArchiveWriter:
+    """Writes archive files from a dedicated thread fed by a bounded queue.
+
+    Producers never block: when the queue is full the write is dropped and
+    counted. Payloads may be callables, which are rendered on the writer
+    thread so serialization stays off the event loop as well.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = ARCHIVE_QUEUE_SIZE,
+        fsync: str = DEFAULT_ARCHIVE_FSYNC,
+        max_batch: int = ARCHIVE_MAX_BATCH,
+        on_batch: Callable[[float], None] | None = None,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync!r}")
+        self.fsync = fsync
+        self.max_batch = max_batch
+        self.on_batch = on_batch
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._dirs: set[Path] = set()
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.batches = 0
+        self.bytes_written = 0
+
+    def start(self) -> None:
+        """Start the writer thread."""
+        self._thread = threading.Thread(target=self._run, name="tokentap-archive", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float | None = 10) -> None:
+        """Flush outstanding writes and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def write(self, path: Path, payload: Payload) -> bool:
+        """Queue a write that replaces path. Returns False if it was dropped."""
+        return self._submit((path, payload, False))
+
+    def append(self, path: Path, payload: Payload) -> bool:
+        """Queue a write that appends to path. Returns False if it was dropped."""
+        return self._submit((path, payload, True))
+
+    def run(self, job: Callable[[], int | None]) -> bool:
+        """Queue a job that writes on its own and returns the bytes written."""
+        return self._submit((None, job, False))
+
+    def _submit(self, item: tuple) -> bool:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self) -> None:
+        """Drain the queue in batches until stopped."""
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                running = False
+                batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self._write_batch(batch)
+            # Release rendered payloads before blocking on the next batch
+            del batch
+
+    def _write_batch(self, batch: list[tuple]) -> None:
+        """Write a batch, opening each file once and syncing per policy."""
+        started = time.perf_counter()
+        handles = {}
+        try:
+            for path, payload, append in batch:
+                try:
+                    if path is None:
+                        self.bytes_written += payload() or 0
+                        self.written += 1
+                        continue
+                    data = payload() if callable(payload) else payload
+                    if data is None:
+                        continue
+                    fp = handles.get(path)
+                    if fp is None or not append:
+                        if fp is not None:
+                            fp.close()
+                        if path.parent not in self._dirs:
+                            path.parent.mkdir(parents=True, exist_ok=True)
+                            self._dirs.add(path.parent)
+                        fp = handles[path] = open(path, "ab" if append else "wb")
+                    fp.write(data)
+                    if self.fsync == "always":
+                        fp.flush()
+                        os.fsync(fp.fileno())
+                    self.written += 1
+                    self.bytes_written += len(data)
+                except Exception:
+                    self.errors += 1
+        finally:
+            for fp in handles.values():
+                try:
+                    if self.fsync == "batch":
+                        fp.flush()
+                        os.fsync(fp.fileno())
+                    fp.close()
+                except OSError:
+                    self.errors += 1
+            self.batches += 1
+            if self.on_batch is not None:
+                self.on_batch(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        """Return queue depth and write/drop counters."""
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "batches": self.batches,
+            "bytes_written": self.bytes_written,
+        }
+
+
+def dump_json(obj) -> bytes:
+    """Serialize an object as compact UTF-8 JSON."""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def render_markdown(timestamp: str, provider: str, model: str, tokens: int | None, messages: list[dict]) -> bytes:
+    """Render a prompt as human-readable markdown."""
+    when = datetime.fromisoformat(timestamp)
+    lines = [
+        f"# Prompt - {when.strftime('%Y-%m-%d %H:%M:%S')}",
+        f"**Provider:** {provider.capitalize()}",
+        f"**Model:** {model}",
+        f"**Tokens:** {tokens or 0:,}",
+        "",
+        "## Messages",
+    ]
+
+    for msg in messages:
+        role = msg.get("role", "unknown").capitalize()
+        content = msg.get("content", "")
+        lines.append(f"### {role}")
+        lines.append(content)
+        lines.append("")
+
+    return "\n".join(lines).encode()
+
+
+def parse_archive_name(stem: str) -> dict | None:
+    """Return the timestamp (ISO format), request id and provider encoded in an archive file stem."""
+    match = _ARCHIVE_NAME.match(stem)
+    if match is None:
+        return None
+    timestamp = datetime.strptime(
+        f"{match['date']}_{match['time']}-{match['usec'] or '000000'}", "%Y-%m-%d_%H-%M-%S-%f"
+    )
+    return {
+        "timestamp": timestamp.isoformat(),
+        "request_id": int(match["request_id"] or 0),
+        "provider": match["provider"],
+    }
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def _decompress(data: bytes, suffix: str) -> bytes:
+    if suffix == ".gz":
+        return gzip.decompress(data)
+    if suffix == ".zst":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def check_compression(compression: str) -> None:
+    """Raise ValueError if the compression is unknown or its library is missing."""
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression!r}")
+    if compression == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ValueError("zstd compression requires the 'zstandard' package (pip install tokentap[zstd])")
+
+
+class ContentStore:
+    """Deduplicating archive that stores each unique message once.
+
+    Layout below root:
+        objects/<2 hex>/<sha256>.json[.gz|.zst]  one JSON value per unique message
+        requests/<name>.json[.gz|.zst]           manifest: metadata, the body
+                                                 without DEDUP_FIELDS and their
+                                                 object references
+        requests/<name>_response.json[...]       merged response document
+        requests/<name>_chunks.txt               raw response transcript
+        requests/<name>_body.raw                 raw body of a streamed request
+                                                 that was not parsed (no manifest)
+
+    The digests of the last known_objects objects written or found are
+    kept in memory, so repeated messages cost no file system check.
+
+    Methods that write are meant to run on the ArchiveWriter thread.
+    """
+
+    def __init__(
+        self, root: Path, compression: str = "none", fsync: bool = False, known_objects: int = DEDUP_KNOWN_OBJECTS
+    ):
+        check_compression(compression)
+        self.root = root
+        self.compression = compression
+        self.fsync = fsync
+        self.suffix = ".json" + _COMPRESSION_SUFFIXES[compression]
+        self.objects_dir = root / "objects"
+        self.requests_dir = root / "requests"
+        self.known_objects = max(1, known_objects)
+        self._known: OrderedDict[str, None] = OrderedDict()
+
+    @staticmethod
+    def digest(obj) -> str:
+        """Return the content hash of a JSON value."""
+        canonical = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def _object_path(self, digest: str, suffix: str | None = None) -> Path:
+        return self.objects_dir / digest[:2] / f"{digest}{suffix or self.suffix}"
+
+    def _write_file(self, path: Path, data: bytes) -> int:
+        """Atomically write data, so readers never see a partial object."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as fp:
+            fp.write(data)
+            if self.fsync:
+                fp.flush()
+                os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+        return len(data)
+
+    def put_object(self, obj) -> tuple[str, int]:
+        """Store a JSON value unless already present. Returns (digest, bytes written)."""
+        digest = self.digest(obj)
+        if digest in self._known:
+            self._known.move_to_end(digest)
+            return digest, 0
+        self._known[digest] = None
+        if len(self._known) > self.known_objects:
+            self._known.popitem(last=False)
+        if any(self._object_path(digest, ".json" + s).exists() for s in _COMPRESSION_SUFFIXES.values()):
+            return digest, 0
+        return digest, self._write_file(self._object_path(digest), _compress(dump_json(obj), self.compression))
+
+    def get_object(self, digest: str):
+        """Load a stored JSON value by digest."""
+        for suffix in _COMPRESSION_SUFFIXES.values():
+            path = self._object_path(digest, ".json" + suffix)
+            if path.exists():
+                return json.loads(_decompress(path.read_bytes(), suffix))
+        raise KeyError(digest)
+
+    def request_path(self, name: str, suffix: str = "") -> Path:
+        """Return the path of a request's manifest (or of a sibling file with suffix)."""
+        return self.requests_dir / f"{name}{suffix or self.suffix}"
+
+    def save_request(self, name: str, metadata: dict, body) -> int:
+        """Store a request body as a manifest referencing deduplicated objects."""
+        written = 0
+        refs = {}
+        if isinstance(body, dict):
+            body = dict(body)
+            for field in DEDUP_FIELDS:
+                value = body.get(field)
+                if not value:
+                    continue
+                # Keep the key as a placeholder so the field order survives
+                body[field] = None
+                if field == "messages" and isinstance(value, list):
+                    refs[field] = []
+                    for message in value:
+                        digest, size = self.put_object(message)
+                        refs[field].append(digest)
+                        written += size
+                else:
+                    refs[field], size = self.put_object(value)
+                    written += size
+        manifest = {"version": 1, **metadata, "body": body, "refs": refs}
+        data = _compress(dump_json(manifest), self.compression)
+        return written + self._write_file(self.request_path(name), data)
+
+    def save_response(self, name: str, response: dict) -> int:
+        """Store a merged response document next to its manifest."""
+        data = _compress(dump_json(response), self.compression)
+        return self._write_file(self.request_path(name, "_response" + self.suffix), data)
+
+    def iter_requests(self):
+        """Yield (name, manifest path) for every stored request, oldest first, without reading it."""
+        if not self.requests_dir.is_dir():
+            return
+        for path in sorted(self.requests_dir.iterdir()):
+            for suffix in _COMPRESSION_SUFFIXES.values():
+                ending = ".json" + suffix
+                if path.name.endswith(ending):
+                    name = path.name[: -len(ending)]
+                    if not name.endswith("_response"):
+                        yield name, path
+                    break
+
+    @staticmethod
+    def load_manifest(path: Path) -> dict:
+        """Read a manifest found by iter_requests."""
+        suffix = next((suffix for suffix in _COMPRESSION_SUFFIXES.values() if suffix and path.name.endswith(suffix)), "")
+        return json.loads(_decompress(path.read_bytes(), suffix))
+
+    def iter_manifests(self):
+        """Yield (name, manifest) for every stored request, oldest first."""
+        for name, path in self.iter_requests():
+            yield name, self.load_manifest(path)
+
+    def load_response(self, name: str) -> dict | None:
+        """Load the merged response of a request, if one was stored."""
+        for suffix in _COMPRESSION_SUFFIXES.values():
+            path = self.requests_dir / f"{name}_response.json{suffix}"
+            if path.exists():
+                return json.loads(_decompress(path.read_bytes(), suffix))
+        return None
+
+    def rebuild_body(self, manifest: dict):
+        """Reassemble the original request body from a manifest."""
+        body = manifest.get("body")
+        if not isinstance(body, dict):
+            return body
+        body = dict(body)
+        for field, ref in manifest.get("refs", {}).items():
+            if isinstance(ref, list):
+                body[field] = [self.get_object(digest) for digest in ref]
+            else:
+                body[field] = self.get_object(ref)
+        return body
+
+
+def export_archive(prompts_dir: Path, output_dir: Path) -> int:
+    """Rebuild markdown, raw JSON and response files from a deduplicated archive.
+
+    Returns the number of requests exported.
+    """
+    from tokentap.parser import parse_anthropic_request, parse_openai_request
+
+    store = ContentStore(prompts_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    exported = 0
+    for name, manifest in store.iter_manifests():
+        body = store.rebuild_body(manifest)
+        messages = []
+        if isinstance(body, dict):
+            if "/v1/messages" in manifest.get("path", ""):
+                messages = parse_anthropic_request(body)["messages"]
+            else:
+                messages = parse_openai_request(body)["messages"]
+        (output_dir / f"{name}.json").write_bytes(dump_json(body))
+        (output_dir / f"{name}.md").write_bytes(
+            render_markdown(
+                manifest.get("timestamp", datetime.now().isoformat()),
+                manifest.get("provider", "unknown"),
+                manifest.get("model", "unknown"),
+                manifest.get("tokens"),
+                messages,
+            )
+        )
+        response = store.load_response(name)
+        if response is not None:
+            (output_dir / f"{name}_response.json").write_bytes(dump_json(response))
+        exported += 1
+    return exported
@@ -0,0 +1,106 @@
+"""Streaming pass-through of request bodies with a spooled copy for parsing."""
+
+import asyncio
+import tempfile
+from typing import Callable
+
+from aiohttp import StreamReader
+
+from tokentap.config import BODY_SPOOL_MEMORY_BYTES, MAX_PARSE_BODY_BYTES
+
+
+class BodyTee:
+    """Async iterable that relays a request body upstream as it arrives.
+
+    Every chunk is also handed to an optional sink (the archive) and copied
+    into a spooled temporary file, which stays in memory up to
+    spool_memory_bytes and moves to disk beyond that; disk writes run in the
+    default executor. Once the body exceeds max_parse_bytes the copy is
+    dropped and the body is only relayed; an optional spill callback then
+    receives what was spooled and every later chunk, so a body too large to
+    parse can still be archived as is. What was spooled is passed as a
+    callable that reads and closes the spool, for the archive writer thread
+    to call, so the event loop never reads it back.
+
+    Iteration may start again after a connection failure as long as no
+    chunk was consumed yet; ``started`` tells whether that is still the case.
+    """
+
+    def __init__(
+        self,
+        content: StreamReader,
+        max_parse_bytes: int = MAX_PARSE_BODY_BYTES,
+        spool_memory_bytes: int = BODY_SPOOL_MEMORY_BYTES,
+        sink: Callable[[bytes], object] | None = None,
+        spill: Callable[[bytes | Callable[[], bytes]], object] | None = None,
+    ):
+        self.max_parse_bytes = max_parse_bytes
+        self.spool_memory_bytes = spool_memory_bytes
+        self.sink = sink
+        self.spill = spill
+        self.size = 0
+        self.started = False
+        self.complete = False
+        self.truncated = False
+        self.finished = asyncio.Event()
+        self._content = content
+        self._spool = tempfile.SpooledTemporaryFile(max_size=spool_memory_bytes)
+
+    def __aiter__(self):
+        return self._relay()
+
+    async def _relay(self):
+        loop = asyncio.get_running_loop()
+        try:
+            async for chunk in self._content.iter_any():
+                self.started = True
+                self.size += len(chunk)
+                if self.sink is not None:
+                    self.sink(chunk)
+                if not self.truncated:
+                    if self.size > self.max_parse_bytes:
+                        self.truncated = True
+                        if self.spill is not None:
+                            self.spill(self._spooled(chunk))
+                        else:
+                            self._spool.close()
+                    elif self.size > self.spool_memory_bytes:
+                        # This write moves the spool to disk or lands there
+                        await loop.run_in_executor(None, self._spool.write, chunk)
+                    else:
+                        self._spool.write(chunk)
+                elif self.spill is not None:
+                    self.spill(chunk)
+                yield chunk
+            self.complete = True
+        finally:
+            self.finished.set()
+
+    def _spooled(self, chunk: bytes) -> Callable[[], bytes]:
+        """Hand the spool over to a callable returning its content followed by chunk."""
+        spool, self._spool = self._spool, None
+
+        def read() -> bytes:
+            try:
+                spool.seek(0)
+                return spool.read() + chunk
+            finally:
+                spool.close()
+
+        return read
+
+    def release(self) -> None:
+        """Mark the body as done even if it was never (fully) relayed."""
+        self.finished.set()
+
+    def read(self) -> bytes | None:
+        """Return the spooled body, or None if it was truncated or incomplete."""
+        if self.truncated or not self.complete:
+            return None
+        self._spool.seek(0)
+        return self._spool.read()
+
+    def close(self) -> None:
+        """Discard the spooled copy, unless it was handed to the spill callback."""
+        if self._spool is not None:
+            self._spool.close()
@@ -0,0 +1,208 @@
+"""Response cache for deterministic requests, replayed chunk for chunk."""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from tokentap.config import CACHE_DISK_BYTES, CACHE_MAX_ENTRY_BYTES, CACHE_MEMORY_BYTES, CACHE_TTL
+
+# Response headers that describe one particular transfer, not the content
+_TRANSFER_HEADERS = {"content-length", "transfer-encoding", "connection", "keep-alive", "date", "content-encoding"}
+
+
+@dataclass(slots=True)
+class CachedResponse:
+    """A recorded upstream response, split at the original chunk boundaries."""
+
+    status: int
+    headers: list[tuple[str, str]]
+    chunks: list[bytes]
+    created: float
+
+    @property
+    def size(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks)
+
+
+def cacheable_headers(headers) -> list[tuple[str, str]]:
+    """Return the response headers worth replaying."""
+    return [(name, value) for name, value in headers.items() if name.lower() not in _TRANSFER_HEADERS]
+
+
+class ResponseCache:
+    """Two-tier cache of upstream responses keyed by path and canonical body.
+
+    Only requests that ask for ``temperature: 0`` are cached; anything else
+    may legitimately produce a different answer and always goes upstream.
+    The memory tier is an LRU bounded in bytes and touched only from the
+    event loop. The optional disk tier holds one file per entry, expires
+    entries after ttl seconds and evicts the oldest when over its size
+    budget; its methods run in executor threads.
+    """
+
+    def __init__(
+        self,
+        directory: Path | None = None,
+        memory_bytes: int = CACHE_MEMORY_BYTES,
+        disk_bytes: int = CACHE_DISK_BYTES,
+        ttl: float = CACHE_TTL,
+        max_entry_bytes: int = CACHE_MAX_ENTRY_BYTES,
+    ):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self._memory: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._memory_size = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stored = 0
+        self.bytes_saved = 0
+        if directory is not None:
+            self._load_disk_index()
+
+    @staticmethod
+    def key(path: str, body) -> str | None:
+        """Return the cache key of a request, or None if it is not deterministic."""
+        if not isinstance(body, dict) or body.get("temperature") != 0:
+            return None
+        canonical = json.dumps([path, body], ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def bypass(self) -> None:
+        """Count a request that was not eligible for caching."""
+        self.bypassed += 1
+
+    async def get(self, key: str) -> CachedResponse | None:
+        """Look a response up in memory, then on disk."""
+        entry = self._memory.get(key)
+        if entry is not None and self._expired(entry):
+            self._evict_memory(key)
+            entry = None
+        if entry is None and self.directory is not None and key in self._disk:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self._read_disk, key)
+            if entry is not None:
+                self.disk_hits += 1
+                self._put_memory(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._memory.move_to_end(key)
+        self.hits += 1
+        self.bytes_saved += entry.size
+        return entry
+
+    async def put(self, key: str, status: int, headers: list[tuple[str, str]], chunks: list[bytes]) -> None:
+        """Store a complete response in both tiers."""
+        entry = CachedResponse(status, headers, chunks, time.time())
+        if entry.size > self.max_entry_bytes:
+            return
+        self._put_memory(key, entry)
+        self.stored += 1
+        if self.directory is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_disk, key, entry)
+
+    def _expired(self, entry: CachedResponse) -> bool:
+        return self.ttl > 0 and time.time() - entry.created > self.ttl
+
+    def _put_memory(self, key: str, entry: CachedResponse) -> None:
+        if key in self._memory:
+            self._evict_memory(key)
+        self._memory[key] = entry
+        self._memory_size += entry.size
+        while self._memory_size > self.memory_bytes and self._memory:
+            self._evict_memory(next(iter(self._memory)))
+
+    def _evict_memory(self, key: str) -> None:
+        self._memory_size -= self._memory.pop(key).size
+
+    def _disk_path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.cache"
+
+    def _load_disk_index(self) -> None:
+        """Index existing entries, oldest first, dropping expired ones."""
+        if not self.directory.is_dir():
+            return
+        entries = []
+        now = time.time()
+        for path in self.directory.glob("*/*.cache"):
+            stat = path.stat()
+            if self.ttl > 0 and now - stat.st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def _read_disk(self, key: str) -> CachedResponse | None:
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as fp:
+                header = json.loads(fp.readline())
+                chunks = [fp.read(length) for length in header["chunks"]]
+        except (OSError, ValueError, KeyError):
+            self._forget_disk(key, path)
+            return None
+        entry = CachedResponse(header["status"], [tuple(h) for h in header["headers"]], chunks, header["created"])
+        if self._expired(entry):
+            self._forget_disk(key, path)
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: CachedResponse) -> None:
+        header = {
+            "status": entry.status,
+            "headers": entry.headers,
+            "created": entry.created,
+            "chunks": [len(chunk) for chunk in entry.chunks],
+        }
+        data = json.dumps(header).encode() + b"\n" + b"".join(entry.chunks)
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        try:
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            return
+        with self._disk_lock:
+            self._disk_size += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+                oldest, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                self._disk_path(oldest).unlink(missing_ok=True)
+
+    def _forget_disk(self, key: str, path: Path) -> None:
+        with self._disk_lock:
+            self._disk_size -= self._disk.pop(key, 0)
+        path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and tier sizes."""
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stored": self.stored,
+            "bytes_saved": self.bytes_saved,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_size,
+        }
@@ -1,17 +1,61 @@
 """CLI interface for tokentap."""
 
 import asyncio
+import itertools
 import json
+import sys
 import threading
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 
 import click
 from rich.console import Console
 
-from tokentap.config import DEFAULT_PROXY_PORT, DEFAULT_TOKEN_LIMIT, DEFAULT_PROMPTS_DIR, DEFAULT_UPSTREAM_HOST
-from tokentap.dashboard import TokenTapDashboard
-from tokentap.proxy import ProxyServer
+from tokentap import IMPORTED_AT
+from tokentap.admission import QUEUE_POLICIES
+from tokentap.archive import ARCHIVE_FORMATS, COMPRESSIONS, FSYNC_POLICIES, check_compression, export_archive
+from tokentap.config import (
+    ARCHIVE_QUEUE_SIZE,
+    CACHE_DISK_BYTES,
+    CACHE_TTL,
+    DEBUG_PATH,
+    DEFAULT_ARCHIVE_COMPRESSION,
+    DEFAULT_ARCHIVE_FORMAT,
+    DEFAULT_ARCHIVE_FSYNC,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_HEALTH_PATH,
+    DEFAULT_MAX_INFLIGHT,
+    DEFAULT_MAX_QUEUE,
+    DEFAULT_DASHBOARD_FPS,
+    DEFAULT_EVENT_OVERFLOW,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_PROMPTS_DIR,
+    DEFAULT_PROXY_PORT,
+    DEFAULT_QUEUE_POLICY,
+    DEFAULT_QUEUE_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+    DEFAULT_REPLAY_CONCURRENCY,
+    DEFAULT_ROUTING,
+    DEFAULT_TOKEN_LIMIT,
+    DEFAULT_TOKENIZER_MODE,
+    DEFAULT_TOKENIZER_WORKERS,
+    DEFAULT_UPSTREAM_HOST,
+    DEFAULT_USAGE_SOURCE,
+    EVENTS_PATH,
+    MAX_PARSE_BODY_BYTES,
+    METRICS_PATH,
+    PREFIX_INDEX_SIZE,
+    REPLAYS_DIRNAME,
+    STARTUP_TIMEOUT,
+    STREAM_BODY_THRESHOLD,
+)
+from tokentap.encoders import check_tokenizer
+from tokentap.events import OVERFLOW_POLICIES, EventChannel
+from tokentap.store import GROUP_BY, SessionStore, StoreRecorder, store_path
+from tokentap.tokenpool import TOKENIZER_MODES, USAGE_SOURCES
+from tokentap.upstream import ROUTING_POLICIES
+from tokentap.workers import reuse_port_supported
 
 console = Console()
 
@@ -44,89 +88,543 @@ def get_upstream_host_interactive() -> Path:
         return user_input
     return DEFAULT_UPSTREAM_HOST
 
-@click.command()
-@click.option("--port", "-p", default=DEFAULT_PROXY_PORT, help="Proxy port number")
+def proxy_options(func):
+    """Attach the options shared by the proxy-running commands."""
+    options = [
+        click.option("--port", "-p", default=DEFAULT_PROXY_PORT, envvar="TOKENTAP_PORT", help="Proxy port number"),
+        click.option("--prompts-dir", type=click.Path(file_okay=False, path_type=Path), envvar="TOKENTAP_PROMPTS_DIR", help=f"Directory to save prompts (default: {DEFAULT_PROMPTS_DIR}; asked for when interactive)"),
+        click.option("--non-interactive", "-y", is_flag=True, envvar="TOKENTAP_NON_INTERACTIVE", help="Never prompt; use defaults for options not given (implied when stdin is not a terminal)"),
+        click.option("--limit", "-l", default=DEFAULT_TOKEN_LIMIT, help="Token limit for fuel gauge"),
+        click.option("--no-dashboard", "-n", is_flag=True, help="Do not start dashboard"),
+        click.option("--fps", default=DEFAULT_DASHBOARD_FPS, type=click.FloatRange(min=0, min_open=True), help="Maximum dashboard redraws per second"),
+        click.option("--event-overflow", default=DEFAULT_EVENT_OVERFLOW, type=click.Choice(OVERFLOW_POLICIES), help="What to do when the dashboard falls behind"),
+        click.option("--feed-port", default=0, type=click.IntRange(min=0), help=f"Serve events at {EVENTS_PATH} on this port for 'tokentap dashboard --connect' (0: no feed)"),
+        click.option("--feed-host", default="127.0.0.1", help="Address the event feed listens on"),
+        click.option("--pool-size", default=DEFAULT_POOL_SIZE, help="Maximum pooled upstream connections"),
+        click.option("--connect-timeout", default=DEFAULT_CONNECT_TIMEOUT, help="Upstream connect timeout in seconds"),
+        click.option("--read-timeout", default=DEFAULT_READ_TIMEOUT, help="Upstream read timeout between chunks in seconds"),
+        click.option("--tokenizer-workers", default=DEFAULT_TOKENIZER_WORKERS, help="Number of token counting workers"),
+        click.option("--tokenizer", "tokenizer_map", multiple=True, help="Tokenizer for models matching a pattern as PATTERN=SPEC, SPEC being a tiktoken encoding or a tokenizer.json path ('*' for the default); repeatable"),
+        click.option("--tokenizer-mode", default=DEFAULT_TOKENIZER_MODE, type=click.Choice(TOKENIZER_MODES), help="Count tokens in threads or processes"),
+        click.option("--prefix-index-size", default=PREFIX_INDEX_SIZE, type=click.IntRange(min=0), help="Message prefixes remembered to measure prompt reuse (0: do not track)"),
+        click.option("--fsync", "archive_fsync", default=DEFAULT_ARCHIVE_FSYNC, type=click.Choice(FSYNC_POLICIES), help="When to fsync archive files"),
+        click.option("--archive-queue-size", default=ARCHIVE_QUEUE_SIZE, help="Pending archive writes before new ones are dropped"),
+        click.option("--archive-format", default=DEFAULT_ARCHIVE_FORMAT, type=click.Choice(ARCHIVE_FORMATS), help="Per-request files or a deduplicated store"),
+        click.option("--archive-compression", default=DEFAULT_ARCHIVE_COMPRESSION, type=click.Choice(COMPRESSIONS), help="Compression of the deduplicated store"),
+        click.option("--no-store", is_flag=True, help="Do not record requests in the session store"),
+        click.option("--upstream", "-u", "upstreams", multiple=True, envvar="TOKENTAP_UPSTREAM", help=f"Upstream URL; repeat to balance across replicas (default: {DEFAULT_UPSTREAM_HOST}; asked for when interactive)"),
+        click.option("--routing", default=DEFAULT_ROUTING, type=click.Choice(ROUTING_POLICIES), help="How requests are spread across upstreams"),
+        click.option("--health-path", default=DEFAULT_HEALTH_PATH, help="Path probed by upstream health checks"),
+        click.option("--max-inflight", default=DEFAULT_MAX_INFLIGHT, help="Requests in flight per upstream before queueing (0: unlimited)"),
+        click.option("--model-limit", "model_limits", multiple=True, help="Requests in flight for a model as MODEL=N ('*' for any model); repeatable"),
+        click.option("--queue-policy", default=DEFAULT_QUEUE_POLICY, type=click.Choice(QUEUE_POLICIES), help="Serve queued requests in arrival order or by X-Tokentap-Priority"),
+        click.option("--max-queue", default=DEFAULT_MAX_QUEUE, help="Queued requests before new ones get 429 (0: unlimited)"),
+        click.option("--queue-timeout", default=DEFAULT_QUEUE_TIMEOUT, help="Seconds a request may queue before it gets 503 (0: no timeout)"),
+        click.option("--stream-threshold", default=STREAM_BODY_THRESHOLD // 1024, help="Stream request bodies larger than this many KB upstream as they arrive"),
+        click.option("--max-parse-size", default=MAX_PARSE_BODY_BYTES // (1024 * 1024), help="Skip parsing streamed request bodies larger than this many MB"),
+        click.option("--usage", "usage_source", default=DEFAULT_USAGE_SOURCE, type=click.Choice(USAGE_SOURCES), help="Count tokens locally or trust the usage reported by the server"),
+        click.option("--include-usage", is_flag=True, help="Ask OpenAI-style streaming requests for a usage report (kept from clients that did not ask for one)"),
+        click.option("--no-stage-timing", is_flag=True, help="Do not time the stages of each request"),
+        click.option("--workers", "-w", default=1, type=click.IntRange(min=1), help="Proxy processes sharing the port"),
+        click.option("--cache", "use_cache", is_flag=True, help="Cache and replay responses to temperature 0 requests"),
+        click.option("--cache-dir", type=click.Path(file_okay=False, path_type=Path), help="Disk cache directory (default: <prompts dir>/cache)"),
+        click.option("--cache-ttl", default=CACHE_TTL, help="Seconds before a cached response expires"),
+        click.option("--cache-size", default=CACHE_DISK_BYTES // (1024 * 1024), help="Disk cache budget in MB"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+@click.group(invoke_without_command=True)
+@proxy_options
+@click.pass_context
+def main(ctx: click.Context, **options):
+    """Token tracker for LLM CLI tools. Starts the proxy when no command is given."""
+    if ctx.invoked_subcommand is None:
+        run_proxy(**options)
+
+
+@main.command()
+@proxy_options
+def start(**options):
+    """Start the proxy and dashboard."""
+    run_proxy(**options)
+
+
+@main.command()
+@click.option("--prompts-dir", type=click.Path(file_okay=False, path_type=Path), default=DEFAULT_PROMPTS_DIR, help="Deduplicated archive to read")
+@click.option("--output", "-o", type=click.Path(file_okay=False, path_type=Path), required=True, help="Directory for the exported files")
+def export(prompts_dir: Path, output: Path):
+    """Export a deduplicated archive as per-request markdown and JSON files."""
+    count = export_archive(prompts_dir, output)
+    console.print(f"[green]Exported {count} requests to {output}[/green]")
+
+
+@main.command("import")
+@click.option("--prompts-dir", type=click.Path(file_okay=False, path_type=Path), default=DEFAULT_PROMPTS_DIR, help="Prompts directory to index")
+def import_prompts(prompts_dir: Path):
+    """Index an existing prompts directory into the session store."""
+    store = SessionStore(store_path(prompts_dir))
+    try:
+        count = store.import_prompts(prompts_dir)
+    finally:
+        store.close()
+    console.print(f"[green]Indexed {count} requests into {store.path}[/green]")
+
+
+def _format_seconds(value: float | None) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+@main.command()
+@click.option("--prompts-dir", type=click.Path(file_okay=False, path_type=Path), default=DEFAULT_PROMPTS_DIR, help="Prompts directory holding the session store")
+@click.option("--by", "group_by", default="model", type=click.Choice(list(GROUP_BY)), help="Group totals by this field")
+@click.option("--days", type=int, help="Only include the last N days")
+@click.option("--slowest", type=int, default=0, help="Also list the N slowest requests")
+def stats(prompts_dir: Path, group_by: str, days: int | None, slowest: int):
+    """Show token and latency totals from the session store."""
+    from rich.table import Table
+
+    path = store_path(prompts_dir)
+    if not path.exists():
+        raise click.ClickException(f"No session store at {path}; run 'tokentap import' first")
+    since = (datetime.now() - timedelta(days=days)).isoformat() if days else None
+    store = SessionStore(path)
+    try:
+        rows = store.summary(group_by, since)
+        slow = store.slowest(slowest, since) if slowest else []
+    finally:
+        store.close()
+
+    table = Table(title=f"Requests by {group_by}")
+    for column in (group_by.capitalize(), "Requests", "Prompt", "Reuse", "Completion", "Avg TTFT", "Avg time", "Max time"):
+        table.add_column(column, justify="left" if column == group_by.capitalize() else "right")
+    for row in rows:
+        table.add_row(
+            str(row["key"]),
+            f"{row['requests']:,}",
+            f"{row['prompt_tokens']:,}",
+            "-" if row["reuse"] is None else f"{row['reuse']:.0%}",
+            f"{row['completion_tokens']:,}",
+            _format_seconds(row["ttft_s"]),
+            _format_seconds(row["duration_s"]),
+            _format_seconds(row["max_duration_s"]),
+        )
+    console.print(table)
+
+    if slow:
+        table = Table(title=f"Slowest {len(slow)} requests")
+        for column in ("Time", "Model", "Path", "Prompt", "Completion", "TTFT", "Duration"):
+            table.add_column(column, justify="left" if column in ("Time", "Model", "Path") else "right")
+        for row in slow:
+            table.add_row(
+                row["timestamp"][:19].replace("T", " "),
+                row["model"],
+                row["path"],
+                f"{row['prompt_tokens'] or 0:,}",
+                f"{row['completion_tokens'] or 0:,}",
+                _format_seconds(row["ttft_s"]),
+                _format_seconds(row["duration_s"]),
+            )
+        console.print(table)
+
+
+def _format_stat(stats: dict | None, key: str, unit: str = "") -> str:
+    return "-" if stats is None else f"{stats[key]:,.1f}{unit}"
+
+
+@main.command()
+@click.option("--prompts-dir", type=click.Path(exists=True, file_okay=False, path_type=Path), default=DEFAULT_PROMPTS_DIR, help="Prompts directory to replay")
+@click.option("--target", "-t", required=True, help="Base URL of the model server to send the requests to")
+@click.option("--concurrency", "-c", default=DEFAULT_REPLAY_CONCURRENCY, type=click.IntRange(min=1), help="Requests in flight (closed loop)")
+@click.option("--rate", type=click.FloatRange(min=0, min_open=True), help="Open loop: requests per second, whatever the responses")
+@click.option("--speedup", type=click.FloatRange(min=0, min_open=True), help="Open loop: recorded arrival times divided by this factor")
+@click.option("--limit", "-n", type=click.IntRange(min=1), help="Replay only the first N requests")
+@click.option("--model", help="Send every request with this model instead of the recorded one")
+@click.option("--stream/--no-stream", default=None, help="Force streaming on or off (default: as recorded)")
+@click.option("--path", "api_path", help="API path for every request (default: as recorded, or guessed from the body)")
+@click.option("--header", "-H", "headers", multiple=True, help="Extra request header as 'Name: value'; repeatable")
+@click.option("--timeout", default=DEFAULT_READ_TIMEOUT, help="Seconds allowed between two reads of a response")
+@click.option("--output", "-o", type=click.Path(dir_okay=False, path_type=Path), help=f"Report file (default: <prompts dir>/{REPLAYS_DIRNAME}/replay_<time>.json)")
+def replay(
+    prompts_dir: Path,
+    target: str,
+    concurrency: int,
+    rate: float | None,
+    speedup: float | None,
+    limit: int | None,
+    model: str | None,
+    stream: bool | None,
+    api_path: str | None,
+    headers: tuple[str, ...],
+    timeout: float,
+    output: Path | None,
+):
+    """Replay archived requests against a model server and report TTFT, decode rate and errors."""
+    from rich.table import Table
+
+    from tokentap.replay import Replayer, iter_archive
+
+    if rate is not None and speedup is not None:
+        raise click.BadParameter("use either --rate or --speedup", param_hint="--speedup")
+    extra_headers = {}
+    for value in headers:
+        name, sep, header_value = value.partition(":")
+        if not sep or not name.strip():
+            raise click.BadParameter(f"expected 'Name: value', got {value!r}", param_hint="--header")
+        extra_headers[name.strip()] = header_value.strip()
+
+    requests = list(itertools.islice(iter_archive(prompts_dir), limit))
+    if not requests:
+        raise click.ClickException(f"No archived requests in {prompts_dir}")
+
+    done = 0
+    failed = 0
+    with console.status(f"Replaying {len(requests)} requests against {target}") as status:
+
+        def on_result(result: dict) -> None:
+            nonlocal done, failed
+            done += 1
+            failed += result["error"] is not None
+            status.update(f"Replaying against {target}: {done}/{len(requests)} done, {failed} failed")
+
+        replayer = Replayer(
+            target,
+            concurrency=concurrency,
+            rate=rate,
+            speedup=speedup,
+            model=model,
+            stream=stream,
+            path=api_path,
+            headers=extra_headers,
+            timeout=timeout,
+            on_result=on_result,
+        )
+        report = asyncio.run(replayer.run(requests))
+
+    if output is None:
+        output = prompts_dir / REPLAYS_DIRNAME / f"replay_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+
+    loop_mode = f"closed loop, {concurrency} in flight" if report["mode"] == "closed" else (
+        f"open loop, {rate:g} req/s" if rate is not None else f"open loop, recorded timing / {speedup:g}"
+    )
+    table = Table(title=f"Replay of {report['requests']} requests ({loop_mode})")
+    for column in ("Metric", "Mean", "p50", "p90", "p99"):
+        table.add_column(column, justify="left" if column == "Metric" else "right")
+    for label, key, unit in (
+        ("TTFT", "ttft_ms", " ms"),
+        ("Duration", "duration_ms", " ms"),
+        ("Decode rate", "decode_tokens_per_s", " tok/s"),
+        ("Schedule lag", "schedule_lag_ms", " ms"),
+    ):
+        stats = report[key]
+        if stats is None and key == "schedule_lag_ms":
+            continue
+        table.add_row(label, *(_format_stat(stats, q, unit) for q in ("mean", "p50", "p90", "p99")))
+    console.print(table)
+    console.print(
+        f"{report['succeeded']:,} succeeded in {report['wall_s']:.1f}s: "
+        f"{report['throughput_rps']:.2f} req/s, {report['output_tokens_per_s']:,.1f} output tok/s, "
+        f"peak {report['peak_inflight']} in flight"
+    )
+    if report["errors"]:
+        console.print("[red]Errors: " + ", ".join(f"{error} x{count}" for error, count in report["errors"].items()) + "[/red]")
+    console.print(f"[green]Report written to {output}[/green]")
+
+
+@main.command()
+@click.option("--connect", "-c", "url", required=True, help="Event feed of a running proxy, e.g. http://host:8081 (see --feed-port)")
 @click.option("--limit", "-l", default=DEFAULT_TOKEN_LIMIT, help="Token limit for fuel gauge")
-@click.option("--no-dashboard", "-n", is_flag=True, help="Do not start dashboard")
-def main(port: int, limit: int, no_dashboard: bool):
+@click.option("--fps", default=DEFAULT_DASHBOARD_FPS, type=click.FloatRange(min=0, min_open=True), help="Maximum dashboard redraws per second")
+@click.option("--event-overflow", default=DEFAULT_EVENT_OVERFLOW, type=click.Choice(OVERFLOW_POLICIES), help="What to do when the dashboard falls behind")
+def dashboard(url: str, limit: int, fps: float, event_overflow: str):
+    """Watch a running proxy's event feed, from this or another host."""
+    from tokentap.dashboard import TokenTapDashboard
+    from tokentap.feed import FeedClient
+
+    events = EventChannel()
+    dashboard_events = events.subscribe(overflow=event_overflow, name="dashboard")
+    client = FeedClient(url, events.publish)
+    client.start()
+    if not client.wait_connected(STARTUP_TIMEOUT):
+        client.close()
+        raise click.ClickException(f"Could not connect to {client.url}: {client.error or 'timed out'}")
+
+    # Panels for stats the proxy does not send are left out, as in a local dashboard
+    stats = client.stats or {}
+
+    def remote(name: str):
+        if stats.get(name) is None:
+            return None
+        return lambda: (client.stats or {}).get(name)
+
+    view = TokenTapDashboard(
+        port=None,
+        token_limit=limit,
+        max_fps=fps,
+        upstream_stats=remote("upstreams"),
+        cache_stats=remote("cache"),
+        stage_stats=remote("stages"),
+        admission_stats=remote("admission"),
+        address=client.url,
+    )
+    try:
+        view.run(dashboard_events)
+    finally:
+        client.close()
+    console.print(f"[cyan]Watched {len(view.requests)} requests ({client.reconnects} reconnects).[/cyan]")
+
+
+def run_proxy(
+    port: int,
+    prompts_dir: Path | None,
+    non_interactive: bool,
+    limit: int,
+    no_dashboard: bool,
+    fps: float,
+    event_overflow: str,
+    feed_port: int,
+    feed_host: str,
+    pool_size: int,
+    connect_timeout: float,
+    read_timeout: float,
+    tokenizer_workers: int,
+    tokenizer_map: tuple[str, ...],
+    tokenizer_mode: str,
+    prefix_index_size: int,
+    archive_fsync: str,
+    archive_queue_size: int,
+    archive_format: str,
+    archive_compression: str,
+    no_store: bool,
+    upstreams: tuple[str, ...],
+    routing: str,
+    health_path: str,
+    max_inflight: int,
+    model_limits: tuple[str, ...],
+    queue_policy: str,
+    max_queue: int,
+    queue_timeout: float,
+    use_cache: bool,
+    cache_dir: Path | None,
+    cache_ttl: float,
+    cache_size: int,
+    stream_threshold: int,
+    max_parse_size: int,
+    usage_source: str,
+    include_usage: bool,
+    no_stage_timing: bool,
+    workers: int,
+):
     """Start the proxy and dashboard.
     """
+    if archive_format == "dedup":
+        try:
+            check_compression(archive_compression)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint="--archive-compression")
+    limits = {}
+    for value in model_limits:
+        model, _, limit = value.rpartition("=")
+        if not model or not limit.isdigit():
+            raise click.BadParameter(f"expected MODEL=N, got {value!r}", param_hint="--model-limit")
+        limits[model] = int(limit)
+    tokenizers = {}
+    for value in tokenizer_map:
+        pattern, _, spec = value.partition("=")
+        if not pattern or not spec:
+            raise click.BadParameter(f"expected PATTERN=SPEC, got {value!r}", param_hint="--tokenizer")
+        try:
+            check_tokenizer(spec)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint="--tokenizer")
+        tokenizers[pattern] = spec
+    if workers > 1 and not reuse_port_supported():
+        raise click.BadParameter("multiple workers require SO_REUSEPORT, which this platform lacks", param_hint="--workers")
+    # Each worker admits its share of a limit; a share of 0 would mean no limit
+    if workers > 1 and 0 < max_inflight < workers:
+        raise click.BadParameter(f"must be at least --workers ({workers}) so every worker gets a share", param_hint="--max-inflight")
+    for model, model_limit in limits.items():
+        if workers > 1 and 0 < model_limit < workers:
+            raise click.BadParameter(f"limit for {model!r} must be at least --workers ({workers}) so every worker gets a share", param_hint="--model-limit")
 
-    print(Path(".").resolve())
-    base_url = get_upstream_host_interactive()
-    
-    prompts_dir = get_prompts_dir_interactive()
+    # Only ask when someone can answer; scripts and containers get the defaults
+    interactive = not non_interactive and sys.stdin.isatty()
+    if interactive:
+        print(Path(".").resolve())
+    if upstreams:
+        base_url = upstreams[0]
+    else:
+        base_url = get_upstream_host_interactive() if interactive else DEFAULT_UPSTREAM_HOST
+
+    if prompts_dir is None:
+        prompts_dir = get_prompts_dir_interactive() if interactive else DEFAULT_PROMPTS_DIR
+    prompts_dir = prompts_dir.expanduser().resolve()
     prompts_dir.mkdir(parents=True, exist_ok=True)
 
-    # Create dashboard
-    dashboard = TokenTapDashboard(
-        port=port,
-        token_limit=limit
-    )
+    # Bounded channel between the proxy thread and consumers
+    events = EventChannel()
+    dashboard_events = None if no_dashboard else events.subscribe(overflow=event_overflow, name="dashboard")
+    recorder = None
+    if not no_store:
+        recorder = StoreRecorder(store_path(prompts_dir), events.subscribe(name="store"))
+        recorder.start()
 
-    # Event queue for thread-safe communication
-    event_queue = []
-    event_lock = threading.Lock()
-
-    def on_request(event: dict) -> None:
-        """Handle incoming request event."""
-        # Queue event for dashboard
-        with event_lock:
-            event_queue.append(event)
-
-    def poll_events() -> list[dict]:
-        """Poll for new events (called by dashboard)."""
-        with event_lock:
-            events = event_queue.copy()
-            event_queue.clear()
-        return events
-
-    # Create and start proxy
-    proxy = ProxyServer(
-        base_url=base_url,
-        port=port,
-        on_request=on_request,
-        prompts_dir=prompts_dir,
-    )
+    cache_options = None
+    if use_cache:
+        cache_options = {
+            "directory": cache_dir or prompts_dir / "cache",
+            "disk_bytes": cache_size * 1024 * 1024,
+            "ttl": cache_ttl,
+        }
+
+    proxy_options = {
+        "base_url": base_url,
+        "port": port,
+        "prompts_dir": prompts_dir,
+        "pool_size": pool_size,
+        "connect_timeout": connect_timeout,
+        "read_timeout": read_timeout,
+        "tokenizer_workers": tokenizer_workers,
+        "tokenizer_mode": tokenizer_mode,
+        "archive_fsync": archive_fsync,
+        "archive_queue_size": archive_queue_size,
+        "archive_format": archive_format,
+        "archive_compression": archive_compression,
+        "upstreams": list(upstreams) or None,
+        "routing": routing,
+        "health_path": health_path,
+        "max_inflight": max_inflight,
+        "model_limits": limits,
+        "queue_policy": queue_policy,
+        "max_queue": max_queue,
+        "queue_timeout": queue_timeout,
+        "stream_threshold": stream_threshold * 1024,
+        "max_parse_bytes": max_parse_size * 1024 * 1024,
+        "usage_source": usage_source,
+        "include_usage": include_usage,
+        "stage_timing": not no_stage_timing,
+        "launched_at": IMPORTED_AT,
+        "tokenizers": tokenizers,
+        "prefix_index_size": prefix_index_size,
+    }
+
+    feed = None
+    if feed_port:
+        from tokentap.feed import EventFeed
+
+        feed = EventFeed(events, feed_host, feed_port)
+
+    if workers > 1:
+        from tokentap.workers import ProxyWorkers
 
-    loop = asyncio.new_event_loop()
+        # Worker processes own the proxies; this process only collects events
+        proxy = loop = None
+        runner = ProxyWorkers(workers, proxy_options, events.publish, cache_options)
+        runner.start()
+        upstream_stats = cache_stats = stage_stats = admission_stats = None
+    else:
+        from tokentap.cache import ResponseCache
+        from tokentap.proxy import ProxyServer
 
-    def run_proxy():
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(proxy.start())
-        loop.run_forever()
+        cache = ResponseCache(**cache_options) if cache_options is not None else None
+        proxy = ProxyServer(**proxy_options, on_request=events.publish, on_response=events.publish, cache=cache)
+        events.register_metrics(proxy.metrics)
+        upstream_stats = proxy.upstreams.stats
+        cache_stats = cache.stats if cache else None
+        stage_stats = None if no_stage_timing else proxy.stages.summary
+        admission_stats = proxy.admission.stats if proxy.admission.limited else None
+        if feed is not None:
+            sources = {"upstreams": upstream_stats, "cache": cache_stats, "stages": stage_stats, "admission": admission_stats}
+            feed.stats = lambda: {name: source() if source else None for name, source in sources.items()}
+            feed.register_metrics(proxy.metrics)
 
-    proxy_thread = threading.Thread(target=run_proxy, daemon=True)
-    proxy_thread.start()
+        loop = asyncio.new_event_loop()
+        listening = threading.Event()
+        failure: list[BaseException] = []
 
-    # Give proxy time to start
-    import time
-    time.sleep(0.5)
+        def serve():
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(proxy.start())
+            except BaseException as e:
+                failure.append(e)
+                return
+            finally:
+                listening.set()
+            loop.run_forever()
 
-    console.print(f"[green]Proxy running on http://127.0.0.1:{port}[/green]")
-    console.print(f"[green]Saving prompts to {prompts_dir}[/green]")
-    console.print()
+        runner = threading.Thread(target=serve, daemon=True)
+        runner.start()
+
+    # Build the dashboard while the proxy binds
+    dashboard = None
     if not no_dashboard:
-        console.print("[dim]Starting dashboard...[/dim]")
+        from tokentap.dashboard import TokenTapDashboard
 
-    import time
-    time.sleep(1)
+        dashboard = TokenTapDashboard(
+            port=port,
+            token_limit=limit,
+            max_fps=fps,
+            upstream_stats=upstream_stats,
+            cache_stats=cache_stats,
+            stage_stats=stage_stats,
+            admission_stats=admission_stats,
+        )
 
-    # Run dashboard
+    started = False
     try:
-        if no_dashboard:
-            while True:
-                poll_events()
-                time.sleep(0.1)
+        if proxy is None:
+            started = runner.wait_ready(STARTUP_TIMEOUT)
+            error = "a worker exited or did not start in time"
         else:
-            dashboard.run(poll_events)
+            started = listening.wait(STARTUP_TIMEOUT) and not failure
+            error = str(failure[0]) if failure else "timed out"
+        if not started:
+            raise click.ClickException(f"The proxy could not listen on port {port}: {error}")
+
+        ready_ms = (time.time() - IMPORTED_AT) * 1000
+        console.print(
+            f"[green]Proxy running on http://127.0.0.1:{port}"
+            + (f" ({workers} workers)" if workers > 1 else "")
+            + f"[/green] [dim](ready in {ready_ms:.0f} ms)[/dim]"
+        )
+        console.print(f"[green]Saving prompts to {prompts_dir}[/green]")
+        console.print(f"[green]Metrics at http://127.0.0.1:{port}{METRICS_PATH}, debug info at {DEBUG_PATH}[/green]")
+        if feed is not None:
+            try:
+                feed.start()
+            except OSError as e:
+                raise click.ClickException(f"The event feed could not listen on {feed_host}:{feed_port}: {e}")
+            console.print(f"[green]Event feed at http://{feed_host}:{feed_port}{EVENTS_PATH}[/green]")
+        console.print()
+
+        # Run dashboard
+        if dashboard is None:
+            while runner.is_alive():
+                runner.join(1)
+        else:
+            dashboard.run(dashboard_events)
     except KeyboardInterrupt:
         pass
     finally:
-        loop.call_soon_threadsafe(loop.stop)
-        console.print()
-        console.print(f"[cyan]Session complete. Total: {dashboard.total_tokens:,} tokens across {len(dashboard.requests)} requests.[/cyan]")
-
+        if proxy is None:
+            runner.close()
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(proxy.stop(), loop).result(timeout=5)
+            loop.call_soon_threadsafe(loop.stop)
+        elif failure:
+            loop.run_until_complete(proxy.stop())
+        if feed is not None:
+            feed.close()
+        if recorder is not None:
+            recorder.close()
+        if dashboard is not None and started:
+            console.print()
+            console.print(f"[cyan]Session complete. Total: {dashboard.total_tokens:,} tokens across {len(dashboard.requests)} requests.[/cyan]")
 
 if __name__ == "__main__":
     main()
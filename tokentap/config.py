@@ -7,7 +7,106 @@ DEFAULT_TOKEN_LIMIT = 65536
 DEFAULT_PROXY_PORT = 8080
 DEFAULT_PROMPTS_DIR = Path("./prompts").resolve()
 DEFAULT_UPSTREAM_HOST = "http://127.0.0.1:1234"
+STARTUP_TIMEOUT = 30.0
+
+# Token counting
+TOKEN_CACHE_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TOKENIZER_WORKERS = 2
+DEFAULT_TOKENIZER_MODE = "thread"
+TOKENIZER_BATCH_WINDOW = 0.002
+TOKENIZER_MAX_BATCH = 32
+DEFAULT_USAGE_SOURCE = "local"
+DEFAULT_TOKENIZER = "cl100k_base"
+ENCODER_CACHE_SIZE = 4
+TOKENIZER_MODELS_MAX = 1024
+
+# Prompt prefix reuse (an index size of 0 disables tracking)
+PREFIX_INDEX_SIZE = 50000
+PREFIX_SESSIONS_MAX = 1000
+REUSE_BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0)
+
+# Prompt archive
+ARCHIVE_QUEUE_SIZE = 10000
+ARCHIVE_MAX_BATCH = 256
+DEFAULT_ARCHIVE_FSYNC = "never"
+DEFAULT_ARCHIVE_FORMAT = "files"
+DEFAULT_ARCHIVE_COMPRESSION = "none"
+# Object digests the dedup store remembers as written; older ones are looked up on disk
+DEDUP_KNOWN_OBJECTS = 100_000
+MAX_RESPONSE_BODY_BYTES = 16 * 1024 * 1024
+
+# Session store
+STORE_FILENAME = "tokentap.db"
+STORE_FLUSH_INTERVAL = 0.5
+STORE_MAX_BATCH = 500
+
+# Upstream replicas
+DEFAULT_ROUTING = "least-loaded"
+DEFAULT_HEALTH_PATH = "/v1/models"
+UPSTREAM_HEALTH_INTERVAL = 10.0
+UPSTREAM_HEALTH_TIMEOUT = 5.0
+UPSTREAM_EJECT_AFTER = 3
+
+# Admission control (0 disables a limit)
+DEFAULT_MAX_INFLIGHT = 0
+DEFAULT_MAX_QUEUE = 0
+DEFAULT_QUEUE_POLICY = "fifo"
+DEFAULT_QUEUE_TIMEOUT = 60.0
+PRIORITY_HEADER = "X-Tokentap-Priority"
+
+# Request bodies
+STREAM_BODY_THRESHOLD = 1024 * 1024
+MAX_PARSE_BODY_BYTES = 64 * 1024 * 1024
+BODY_SPOOL_MEMORY_BYTES = 8 * 1024 * 1024
+
+# Response cache
+CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+CACHE_DISK_BYTES = 1024 * 1024 * 1024
+CACHE_MAX_ENTRY_BYTES = 8 * 1024 * 1024
+CACHE_TTL = 24 * 60 * 60.0
+
+# Proxy workers
+WORKER_SHUTDOWN_TIMEOUT = 10.0
+# Seconds a worker waits for each other worker's metrics when answering a scrape
+WORKER_METRICS_TIMEOUT = 2.0
+
+# Metrics endpoint
+METRICS_PATH = "/_tokentap/metrics"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Stage timing and profiling
+DEBUG_PATH = "/_tokentap/debug"
+STAGE_WINDOW = 500
+PROFILES_DIRNAME = "profiles"
+DEFAULT_PROFILE_REQUESTS = 100
+TRACEMALLOC_FRAMES = 25
+PROFILE_REPORT_LINES = 50
+
+# Archive replay
+DEFAULT_REPLAY_CONCURRENCY = 4
+REPLAYS_DIRNAME = "replays"
+
+# Event channel
+EVENT_BUFFER_SIZE = 10000
+DEFAULT_EVENT_OVERFLOW = "coalesce"
+
+# Event feed for remote dashboards
+EVENTS_PATH = "/_tokentap/events"
+FEED_BATCH_INTERVAL = 0.1
+FEED_CLIENT_BUFFER = 100
+FEED_STATS_INTERVAL = 1.0
+FEED_HEARTBEAT_INTERVAL = 15.0
+FEED_READ_TIMEOUT = 45.0
+FEED_RECONNECT_DELAY = 2.0
 
 # Dashboard settings
 PROMPT_PREVIEW_LENGTH = 200
 MAX_LOG_ENTRIES = 100
+LATENCY_WINDOW = 200
+DEFAULT_DASHBOARD_FPS = 10
+
+# Upstream connection pool
+DEFAULT_POOL_SIZE = 100
+DEFAULT_KEEPALIVE_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 600.0
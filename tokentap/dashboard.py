@@ -1,5 +1,9 @@
 """Rich terminal dashboard for displaying LLM traffic."""
 
+import time
+from collections import deque
+from typing import Callable
+from dataclasses import replace
 from datetime import datetime
 
 from rich.console import Console
@@ -10,48 +14,122 @@ from rich.progress import BarColumn, Progress, TextColumn
 from rich.table import Table
 from rich.text import Text
 
-from tokentap.config import MAX_LOG_ENTRIES, PROMPT_PREVIEW_LENGTH
+from tokentap.config import DEFAULT_DASHBOARD_FPS, LATENCY_WINDOW, MAX_LOG_ENTRIES
+from tokentap.events import RequestEvent
+
+
+def _percentile(values, q: float) -> float | None:
+    """Return the q-th percentile (0-100) of values using nearest rank."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+RESIZE_CHECK_INTERVAL = 0.5
 
 
 class TokenTapDashboard:
     """Terminal dashboard for displaying intercepted LLM traffic."""
 
-    def __init__(self, port: int, token_limit: int):
+    def __init__(
+        self,
+        port: int | None,
+        token_limit: int,
+        max_fps: float = DEFAULT_DASHBOARD_FPS,
+        upstream_stats: Callable[[], list[dict]] | None = None,
+        cache_stats: Callable[[], dict] | None = None,
+        stage_stats: Callable[[], dict] | None = None,
+        admission_stats: Callable[[], dict] | None = None,
+        address: str | None = None,
+    ):
         self.console = Console()
         self.port = port
+        self.address = address or f"http://127.0.0.1:{port}"
         self.token_limit = token_limit
+        self.max_fps = max_fps
+        self.upstream_stats = upstream_stats
+        self._upstreams: list[dict] = upstream_stats() if upstream_stats else []
+        self.cache_stats = cache_stats
+        self._cache: dict | None = cache_stats() if cache_stats else None
+        self.stage_stats = stage_stats
+        self._stages: dict = stage_stats() if stage_stats else {}
+        self.admission_stats = admission_stats
+        self._admission: dict | None = admission_stats() if admission_stats else None
         self.total_tokens = 0
-        self.requests: list[dict] = []
+        self.requests: list[RequestEvent] = []
         self.last_prompt = ""
         self.last_provider = ""
+        self.latency = {
+            "ttft_s": deque(maxlen=LATENCY_WINDOW),
+            "gap_mean_s": deque(maxlen=LATENCY_WINDOW),
+            "tokens_per_s": deque(maxlen=LATENCY_WINDOW),
+            "duration_s": deque(maxlen=LATENCY_WINDOW),
+            "admission_wait_s": deque(maxlen=LATENCY_WINDOW),
+        }
+        self._panels = {
+            "header": self._make_header,
+            "gauge": self._make_fuel_gauge,
+            "latency": self._make_latency_panel,
+            "upstreams": self._make_upstream_panel,
+            "stages": self._make_stage_panel,
+            "table": self._make_request_table,
+            "prompt": self._make_prompt_panel,
+        }
+        if len(self._upstreams) < 2:
+            # A single upstream needs no balancing overview
+            del self._panels["upstreams"]
+        if stage_stats is None:
+            del self._panels["stages"]
+        self._layout: Layout | None = None
+        self._dirty: set[str] = set(self._panels)
 
-    def add_request(self, data: dict) -> None:
+    def add_request(self, event: RequestEvent) -> None:
         """Add a new intercepted request to the dashboard."""
-        tokens = data.get("tokens", 0)
-        self.total_tokens = tokens
-
-        # Store request info
-        request_info = {
-            "time": datetime.fromisoformat(data["timestamp"]).strftime("%H:%M:%S"),
-            "provider": data.get("provider", "unknown").capitalize(),
-            "model": data.get("model", "unknown"),
-            "tokens": tokens,
-        }
-        self.requests.append(request_info)
+        if event.type == "response":
+            self.add_response(event)
+            return
+
+        # Counts taken from the server's usage arrive with the response
+        if event.tokens is not None:
+            self.total_tokens = event.tokens
+        self._dirty.update(("gauge", "table", "prompt"))
+        if event.prefix_tokens is not None:
+            self._dirty.add("header")
+        self.requests.append(event)
 
         # Keep only the last N entries
         if len(self.requests) > MAX_LOG_ENTRIES:
             self.requests = self.requests[-MAX_LOG_ENTRIES:]
 
         # Update last prompt
-        messages = data.get("messages", [])
-        for msg in reversed(messages):
-            if msg.get("role") == "user":
-                self.last_prompt = msg.get("content", "")
-                break
-        self.last_provider = data.get("provider", "unknown").capitalize()
-
-    def load_history(self, history: list[dict]) -> None:
+        if event.preview:
+            self.last_prompt = event.preview
+        self.last_provider = event.provider.capitalize()
+
+    def add_response(self, event: RequestEvent) -> None:
+        """Replace a request's log entry with its finished response."""
+        self._dirty.update(("latency", "table"))
+        if event.prefix_tokens is not None:
+            self._dirty.add("header")
+        for key, values in self.latency.items():
+            value = getattr(event, key)
+            if value is not None:
+                values.append(value)
+
+        for index in range(len(self.requests) - 1, -1, -1):
+            if self.requests[index].request_id == event.request_id:
+                if index == len(self.requests) - 1 and self.requests[index].tokens is None and event.tokens is not None:
+                    self.total_tokens = event.tokens
+                    self._dirty.add("gauge")
+                self.requests[index] = event
+                return
+        # The request event was coalesced into this one or dropped
+        self.add_request(replace(event, type="request"))
+        self.requests[-1] = event
+
+    def load_history(self, history: list[RequestEvent]) -> None:
         """Load historical data to restore session state."""
         for event in history:
             self.add_request(event)
@@ -60,7 +138,25 @@ class TokenTapDashboard:
         """Create the header panel."""
         title = Text()
         title.append("TOKENTAP", style="bold cyan")
-        title.append(f" - LLM Traffic Inspector (http://127.0.0.1:{self.port})", style="dim")
+        title.append(f" - LLM Traffic Inspector ({self.address})", style="dim")
+        if self._cache is not None:
+            saved = self._cache["bytes_saved"] / (1024 * 1024)
+            title.append(
+                f"  Cache: {self._cache['hits']:,} hits / {self._cache['misses']:,} misses, {saved:,.1f} MB saved",
+                style="green",
+            )
+        prompt_tokens = prefix_tokens = 0
+        for req in self.requests:
+            if req.prefix_tokens is not None:
+                prompt_tokens += req.tokens or 0
+                prefix_tokens += req.prefix_tokens
+        if prompt_tokens:
+            title.append(f"  Prefix reuse: {prefix_tokens / prompt_tokens:.0%}", style="magenta")
+        if self._admission is not None:
+            title.append(
+                f"  Queue: {self._admission['waiting']:,} waiting, {self._admission['inflight']:,} in flight",
+                style="yellow" if self._admission["waiting"] else "green",
+            )
         return Panel(title, style="cyan", height=3)
 
     def _make_fuel_gauge(self) -> Panel:
@@ -98,16 +194,31 @@ class TokenTapDashboard:
         table.add_column("Provider", width=12)
         table.add_column("Model", width=30)
         table.add_column("Tokens", justify="right", width=10)
+        table.add_column("Reuse", justify="right", width=7)
+        table.add_column("Session", justify="right", width=8)
+        table.add_column("Out", justify="right", width=8)
+        table.add_column("TTFT", justify="right", width=8)
+        table.add_column("Tok/s", justify="right", width=8)
 
         # Show most recent requests
         display_requests = self.requests[-20:]
         for req in display_requests:
-            tokens_str = f"{req['tokens']:,}"
+            tokens_str = f"{req.tokens:,}" if req.tokens is not None else "-"
+            reuse_str = f"{req.prefix_tokens / req.tokens:.0%}" if req.prefix_tokens is not None and req.tokens else "-"
+            session_str = f"{req.session_reuse:.0%}" if req.session_reuse is not None else "-"
+            output_str = f"{req.output_tokens:,}" if req.output_tokens is not None else "-"
+            ttft_str = f"{req.ttft_s:.2f}s" if req.ttft_s is not None else "-"
+            tps_str = f"{req.tokens_per_s:.1f}" if req.tokens_per_s is not None else "-"
             table.add_row(
-                req["time"],
-                req["provider"],
-                req["model"],
+                datetime.fromisoformat(req.timestamp).strftime("%H:%M:%S"),
+                "Cache" if req.cached else req.provider.capitalize() or "-",
+                req.model,
                 tokens_str,
+                reuse_str,
+                session_str,
+                output_str,
+                ttft_str,
+                tps_str,
             )
 
         return Panel(
@@ -116,13 +227,111 @@ class TokenTapDashboard:
             border_style="green",
         )
 
+    def _make_latency_panel(self) -> Panel:
+        """Create the p50/p95 latency summary panel."""
+        table = Table(expand=True, show_header=True, header_style="bold magenta", box=None)
+        table.add_column("Metric")
+        table.add_column("p50", justify="right")
+        table.add_column("p95", justify="right")
+
+        rows = [
+            ("Time to first token", "ttft_s", "{:.2f}s", 1),
+            ("Inter-token gap", "gap_mean_s", "{:.1f}ms", 1000),
+            ("Decode tokens/s", "tokens_per_s", "{:.1f}", 1),
+            ("Total duration", "duration_s", "{:.2f}s", 1),
+        ]
+        if self._admission is not None:
+            rows.append(("Admission wait", "admission_wait_s", "{:.2f}s", 1))
+        for label, key, fmt, scale in rows:
+            values = self.latency[key]
+            cells = []
+            for q in (50, 95):
+                value = _percentile(values, q)
+                cells.append("-" if value is None else fmt.format(value * scale))
+            table.add_row(label, *cells)
+
+        return Panel(
+            table,
+            title=f"Latency (last {max(len(v) for v in self.latency.values())} responses)",
+            border_style="cyan",
+            height=self._latency_height,
+        )
+
+    @property
+    def _latency_height(self) -> int:
+        return 8 if self._admission is not None else 7
+
+    def _make_upstream_panel(self) -> Panel:
+        """Create the per-upstream routing summary panel."""
+        table = Table(expand=True, show_header=True, header_style="bold magenta", box=None)
+        table.add_column("Upstream")
+        table.add_column("Status")
+        table.add_column("Active", justify="right")
+        table.add_column("Requests", justify="right")
+        table.add_column("Errors", justify="right")
+        table.add_column("Models")
+
+        for upstream in self._upstreams:
+            status = Text("up", style="green") if upstream["healthy"] else Text("ejected", style="red")
+            table.add_row(
+                upstream["name"],
+                status,
+                str(upstream["outstanding"]),
+                f"{upstream['requests']:,}",
+                f"{upstream['errors']:,}",
+                ", ".join(upstream["models"][:3]) + ("..." if len(upstream["models"]) > 3 else ""),
+            )
+
+        return Panel(
+            table,
+            title="Upstreams",
+            border_style="magenta",
+            height=len(self._upstreams) + 3,
+        )
+
+    def _make_stage_panel(self) -> Panel:
+        """Create the per-stage p50/p95 timing panel."""
+        table = Table(expand=True, show_header=True, header_style="bold magenta", box=None)
+        table.add_column("")
+        for stage in self._stages:
+            table.add_column(stage.replace("_", " "), justify="right")
+        for label, key in (("p50", "p50_s"), ("p95", "p95_s")):
+            table.add_row(label, *(f"{stats[key] * 1000:.1f}ms" for stats in self._stages.values()))
+
+        return Panel(
+            table,
+            title="Stages",
+            border_style="blue",
+            height=5,
+        )
+
+    def _refresh_stats(self) -> None:
+        """Mark panels dirty whose upstream, cache, stage or queue counters changed."""
+        if "upstreams" in self._panels:
+            upstreams = self.upstream_stats()
+            if upstreams != self._upstreams:
+                self._upstreams = upstreams
+                self._dirty.add("upstreams")
+        if self.cache_stats is not None:
+            cache = self.cache_stats()
+            if cache != self._cache:
+                self._cache = cache
+                self._dirty.add("header")
+        if self.admission_stats is not None:
+            admission = self.admission_stats()
+            if admission != self._admission:
+                self._admission = admission
+                self._dirty.add("header")
+        if "stages" in self._panels:
+            stages = self.stage_stats()
+            if stages != self._stages:
+                self._stages = stages
+                self._dirty.add("stages")
+
     def _make_prompt_panel(self) -> Panel:
         """Create the last prompt preview panel."""
         if self.last_prompt:
-            preview = self.last_prompt[:PROMPT_PREVIEW_LENGTH]
-            if len(self.last_prompt) > PROMPT_PREVIEW_LENGTH:
-                preview += "..."
-            content = Text(preview)
+            content = Text(self.last_prompt)
         else:
             content = Text("No prompts intercepted yet...", style="dim italic")
 
@@ -137,40 +346,68 @@ class TokenTapDashboard:
             height=8,
         )
 
-    def render(self) -> Layout:
-        """Generate the full dashboard layout."""
+    def _build_layout(self) -> Layout:
+        """Create the empty panel layout."""
         layout = Layout()
 
         layout.split_column(
             Layout(name="header", size=3),
             Layout(name="gauge", size=5),
+            Layout(name="latency", size=self._latency_height),
+            Layout(name="upstreams", size=len(self._upstreams) + 3, visible="upstreams" in self._panels),
+            Layout(name="stages", size=5, visible="stages" in self._panels),
             Layout(name="table"),
             Layout(name="prompt", size=8),
         )
+        return layout
 
-        layout["header"].update(self._make_header())
-        layout["gauge"].update(self._make_fuel_gauge())
-        layout["table"].update(self._make_request_table())
-        layout["prompt"].update(self._make_prompt_panel())
+    def _update_layout(self) -> Layout:
+        """Rebuild only the panels whose data changed since the last frame."""
+        if self._layout is None:
+            self._layout = self._build_layout()
+            self._dirty.update(self._panels)
+        for name in self._dirty:
+            self._layout[name].update(self._panels[name]())
+        self._dirty.clear()
+        return self._layout
 
-        return layout
+    def render(self) -> Layout:
+        """Generate the full dashboard layout."""
+        self._dirty.update(self._panels)
+        return self._update_layout()
 
-    def run(self, poll_callback) -> None:
-        """Run the dashboard with live updates.
+    def run(self, events) -> None:
+        """Run the dashboard, redrawing at most max_fps times per second.
+
+        Blocks on the event subscription between frames, so an idle dashboard
+        does no work; bursts of events are folded into the next frame.
 
         Args:
-            poll_callback: Function to call that returns new events (list of dicts)
+            events: Subscription whose wait(timeout) returns the new RequestEvents
         """
-        with Live(self.render(), console=self.console, refresh_per_second=4, screen=True) as live:
+        frame_interval = 1 / self.max_fps
+        size = self.console.size
+        last_frame = 0.0
+        with Live(self.render(), console=self.console, auto_refresh=False, screen=True) as live:
+            live.refresh()
             try:
                 while True:
-                    # Poll for new events
-                    new_events = poll_callback()
-                    for event in new_events:
+                    if self._dirty:
+                        timeout = max(0.0, last_frame + frame_interval - time.monotonic())
+                    else:
+                        timeout = RESIZE_CHECK_INTERVAL
+                    for event in events.wait(timeout):
                         self.add_request(event)
+                    self._refresh_stats()
+
+                    if self.console.size != size:
+                        size = self.console.size
+                        self._dirty.update(self._panels)
 
                     # Update display
-                    live.update(self.render())
+                    if self._dirty and time.monotonic() - last_frame >= frame_interval:
+                        live.update(self._update_layout(), refresh=True)
+                        last_frame = time.monotonic()
 
             except KeyboardInterrupt:
                 pass
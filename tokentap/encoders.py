@@ -0,0 +1,241 @@
+"""Per-model tokenizers: tiktoken encodings and HuggingFace tokenizer.json files."""
+
+import fnmatch
+import importlib.util
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from tokentap.config import DEFAULT_TOKENIZER, ENCODER_CACHE_SIZE, TOKENIZER_MODELS_MAX
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_KINDS = ("tiktoken", "hf")
+
+# Encodings whose split patterns never merge across the message boundaries
+# the token count cache splits conversations at. The older GPT-2 style
+# patterns (r50k_base, p50k_base, ...) do, e.g. a space before a newline.
+SPLITTING_ENCODINGS = frozenset({"cl100k_base", "o200k_base"})
+
+
+class TiktokenEncoder:
+    """A tiktoken encoding such as cl100k_base or o200k_base."""
+
+    def __init__(self, name: str):
+        import tiktoken
+
+        self.name = name
+        self.splits_messages = name in SPLITTING_ENCODINGS
+        self._encoding = tiktoken.get_encoding(name)
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        """Return the token count of each text."""
+        if len(texts) == 1:
+            return [len(self._encoding.encode_ordinary(texts[0]))]
+        encoded = self._encoding.encode_ordinary_batch(texts, num_threads=min(len(texts), 8))
+        return [len(tokens) for tokens in encoded]
+
+
+class HFEncoder:
+    """A HuggingFace tokenizer loaded from a tokenizer.json file."""
+
+    # Pre-tokenizers vary (e.g. SentencePiece prefix spaces), so
+    # conversations are counted whole rather than per message run
+    splits_messages = False
+
+    def __init__(self, path: Path):
+        from tokenizers import Tokenizer
+
+        self.name = f"hf:{path}"
+        self._tokenizer = Tokenizer.from_file(str(path))
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        """Return the token count of each text, without special tokens."""
+        return [len(encoding.ids) for encoding in self._tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+
+def parse_spec(spec: str) -> tuple[str, str]:
+    """Split a tokenizer spec into its kind and target.
+
+    "tiktoken:NAME" and "hf:PATH" are explicit; otherwise anything that looks
+    like a path (a .json file or a directory holding tokenizer.json) is a
+    HuggingFace tokenizer and anything else a tiktoken encoding name.
+    """
+    kind, sep, target = spec.partition(":")
+    if sep and kind in TOKENIZER_KINDS:
+        return kind, target
+    if spec.endswith(".json") or os.sep in spec or spec.startswith(("~", ".")):
+        return "hf", spec
+    return "tiktoken", spec
+
+
+def _tokenizer_file(target: str) -> Path:
+    path = Path(target).expanduser()
+    return path / "tokenizer.json" if path.is_dir() else path
+
+
+def _hf_available() -> bool:
+    return importlib.util.find_spec("tokenizers") is not None
+
+
+def check_tokenizer(spec: str) -> None:
+    """Raise ValueError if a spec names an unknown encoding, a missing file or a missing library."""
+    kind, target = parse_spec(spec)
+    if kind == "tiktoken":
+        import tiktoken
+
+        if target not in tiktoken.list_encoding_names():
+            raise ValueError(f"Unknown tiktoken encoding: {target!r}")
+        return
+    if not _tokenizer_file(target).is_file():
+        raise ValueError(f"No tokenizer.json at {target}")
+    if not _hf_available():
+        raise ValueError("tokenizer.json files require the 'tokenizers' package (pip install tokentap[hf])")
+
+
+def load_encoder(spec: str) -> TiktokenEncoder | HFEncoder:
+    """Load the encoder a spec names."""
+    kind, target = parse_spec(spec)
+    if kind == "hf":
+        return HFEncoder(_tokenizer_file(target))
+    return TiktokenEncoder(target)
+
+
+class EncoderCache:
+    """Loaded encoders of this process, least recently used evicted first.
+
+    Each encoder is loaded once, on first use, and at most max_size stay in
+    memory. An encoder that fails to load is replaced by the fallback spec
+    given with it (logged once), and by cl100k_base if that fails too, so
+    counting goes on. tiktoken keeps its own copy of the built-in
+    encodings; the bound matters for tokenizer.json files.
+    """
+
+    def __init__(self, max_size: int = ENCODER_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._encoders: OrderedDict[str, TiktokenEncoder | HFEncoder] = OrderedDict()
+        # Held while loading, so concurrent first uses wait for one load
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+        self.failed: dict[str, str] = {}
+
+    def get(self, spec: str, fallback: str = DEFAULT_TOKENIZER) -> TiktokenEncoder | HFEncoder:
+        """Return the encoder for spec, loading it if needed.
+
+        Args:
+            spec: Tokenizer spec to load
+            fallback: Spec to count with if spec cannot be loaded, usually
+                the configured default
+        """
+        with self._lock:
+            return self._get(spec, fallback)
+
+    def _get(self, spec: str, fallback: str) -> TiktokenEncoder | HFEncoder:
+        encoder = self._encoders.get(spec)
+        if encoder is not None:
+            self._encoders.move_to_end(spec)
+            return encoder
+        try:
+            encoder = load_encoder(spec)
+        except Exception as e:
+            if spec == DEFAULT_TOKENIZER:
+                raise
+            if fallback == spec:
+                fallback = DEFAULT_TOKENIZER
+            logger.warning("Could not load tokenizer %s, counting with %s: %s", spec, fallback, e)
+            self.failed[spec] = str(e)
+            encoder = self._get(fallback, DEFAULT_TOKENIZER)
+        self.loads += 1
+        self._encoders[spec] = encoder
+        while len(self._encoders) > self.max_size:
+            self._encoders.popitem(last=False)
+            self.evictions += 1
+        return encoder
+
+    def stats(self) -> dict:
+        """Return the loaded encoders and load statistics."""
+        with self._lock:
+            return {
+                "loaded": list(self._encoders),
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "failed": dict(self.failed),
+            }
+
+
+encoders = EncoderCache()
+
+
+def _hub_cache() -> Path:
+    if os.environ.get("HF_HUB_CACHE"):
+        return Path(os.environ["HF_HUB_CACHE"])
+    return Path(os.environ.get("HF_HOME", Path.home() / ".cache" / "huggingface")) / "hub"
+
+
+class TokenizerMap:
+    """Chooses the tokenizer spec for the model named in a request.
+
+    In order: the first configured pattern matching the model (fnmatch
+    syntax, case-insensitive), a configured "*" default, a tokenizer.json
+    downloaded to the local HuggingFace hub cache for model ids like
+    "org/name", tiktoken's own table of OpenAI models, and finally the
+    built-in default. Answers are remembered per model name.
+    """
+
+    def __init__(
+        self,
+        patterns: dict[str, str] | None = None,
+        default: str = DEFAULT_TOKENIZER,
+        hub_cache: Path | None = None,
+    ):
+        """Initialize the map.
+
+        Args:
+            patterns: Model name patterns to tokenizer specs; "*" sets the default
+            default: Spec for models nothing else matches
+            hub_cache: HuggingFace hub cache to look for tokenizer.json files in
+                (default: $HF_HUB_CACHE, else $HF_HOME/hub or ~/.cache/huggingface/hub)
+        """
+        patterns = dict(patterns or {})
+        # A default set with "*" is a choice for every model, not a last resort
+        self.configured_default = "*" in patterns
+        self.default = patterns.pop("*", default)
+        self.patterns = patterns
+        self.hub_cache = hub_cache if hub_cache is not None else _hub_cache()
+        self._resolved: OrderedDict[str, str] = OrderedDict()
+
+    def resolve(self, model: str) -> str:
+        """Return the tokenizer spec for a model."""
+        spec = self._resolved.get(model)
+        if spec is None:
+            spec = self._lookup(model)
+            self._resolved[model] = spec
+            if len(self._resolved) > TOKENIZER_MODELS_MAX:
+                self._resolved.popitem(last=False)
+        return spec
+
+    def _lookup(self, model: str) -> str:
+        name = model.lower()
+        for pattern, spec in self.patterns.items():
+            if fnmatch.fnmatchcase(name, pattern.lower()):
+                return spec
+        if self.configured_default:
+            return self.default
+        if "/" in model and _hf_available():
+            snapshots = self.hub_cache / f"models--{model.replace('/', '--')}" / "snapshots"
+            candidates = sorted(snapshots.glob("*/tokenizer.json"), key=lambda path: path.stat().st_mtime)
+            if candidates:
+                return f"hf:{candidates[-1]}"
+        try:
+            import tiktoken
+
+            return tiktoken.encoding_name_for_model(model)
+        except (KeyError, ImportError):
+            return self.default
+
+    def stats(self) -> dict:
+        """Return the default spec and the spec chosen for each model seen."""
+        return {"default": self.default, "models": dict(self._resolved)}
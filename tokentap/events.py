@@ -0,0 +1,217 @@
+"""Bounded event channel between the proxy thread and its consumers."""
+
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass, fields
+
+from tokentap.config import DEFAULT_EVENT_OVERFLOW, EVENT_BUFFER_SIZE
+
+OVERFLOW_POLICIES = ("drop-oldest", "drop-newest", "coalesce")
+
+
+@dataclass(slots=True)
+class RequestEvent:
+    """Compact record of a proxied request, published to event consumers.
+
+    Carries only counts and a short prompt preview computed at the source;
+    the raw body and message list go to the archive writer alone. A
+    "response" event is a copy of the request event with the response
+    fields filled in. usage_source tells whether the token counts were
+    reported by the server ("upstream") or counted locally ("local").
+    prefix_tokens is the part of the prompt repeating an earlier prompt's
+    messages, and session_reuse that share over the prompts of session_id.
+    """
+
+    request_id: int
+    timestamp: str
+    provider: str
+    path: str
+    type: str = "request"
+    model: str = "unknown"
+    tokens: int | None = None
+    message_count: int = 0
+    preview: str = ""
+    status: int | None = None
+    queue_s: float | None = None
+    connect_s: float | None = None
+    ttfb_s: float | None = None
+    ttft_s: float | None = None
+    gap_mean_s: float | None = None
+    gap_max_s: float | None = None
+    duration_s: float | None = None
+    output_tokens: int | None = None
+    tokens_per_s: float | None = None
+    cached: bool = False
+    cached_tokens: int | None = None
+    usage_source: str | None = None
+    queue_depth: int = 0
+    admission_wait_s: float | None = None
+    prefix_tokens: int | None = None
+    session_id: str | None = None
+    session_reuse: float | None = None
+
+
+_EVENT_FIELDS = frozenset(field.name for field in fields(RequestEvent))
+
+
+def event_to_dict(event: RequestEvent) -> dict:
+    """Return an event as a JSON-serializable dict."""
+    return asdict(event)
+
+
+def event_from_dict(data: dict) -> RequestEvent:
+    """Rebuild an event from event_to_dict's output, ignoring fields this version lacks."""
+    return RequestEvent(**{key: value for key, value in data.items() if key in _EVENT_FIELDS})
+
+
+class Subscription:
+    """Bounded buffer of events for a single consumer.
+
+    Publishing never blocks. With "drop-oldest" and "drop-newest" the buffer
+    is a plain deque and needs no lock. "coalesce" first merges an incoming
+    event into a pending event of the same request (a response event carries
+    all request fields) by replacing it, and only drops the oldest event if nothing can be
+    merged; it takes a short lock for that.
+    """
+
+    def __init__(self, channel: "EventChannel", maxsize: int, overflow: str, name: str = ""):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow!r}")
+        self.name = name
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.coalesced = 0
+        self.delivered = 0
+        self._channel = channel
+        self._buffer: deque = deque(maxlen=maxsize if overflow == "drop-oldest" else None)
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock() if overflow == "coalesce" else None
+
+    def put(self, event: RequestEvent) -> None:
+        """Add an event, applying the overflow policy when the buffer is full."""
+        buffer = self._buffer
+        if len(buffer) >= self.maxsize:
+            if self.overflow == "drop-newest":
+                self.dropped += 1
+                return
+            if self.overflow == "coalesce":
+                self._coalesce(event)
+                self._wakeup.set()
+                return
+            # deque(maxlen) discards the oldest entry on append
+            self.dropped += 1
+        buffer.append(event)
+        self._wakeup.set()
+
+    def _coalesce(self, event: RequestEvent) -> None:
+        with self._lock:
+            for index in range(len(self._buffer) - 1, -1, -1):
+                if self._buffer[index].request_id == event.request_id:
+                    # A later event for the same request supersedes the pending one
+                    self._buffer[index] = event
+                    self.coalesced += 1
+                    return
+            if self._buffer:
+                self._buffer.popleft()
+            self.dropped += 1
+            self._buffer.append(event)
+
+    def drain(self, max_items: int | None = None) -> list[RequestEvent]:
+        """Remove and return buffered events without waiting."""
+        events = []
+        if self._lock is not None:
+            self._lock.acquire()
+        try:
+            while self._buffer and (max_items is None or len(events) < max_items):
+                events.append(self._buffer.popleft())
+        finally:
+            if self._lock is not None:
+                self._lock.release()
+        self.delivered += len(events)
+        return events
+
+    def wait(self, timeout: float | None = None, max_items: int | None = None) -> list[RequestEvent]:
+        """Block until events are available or timeout expires, then drain."""
+        if not self._buffer:
+            self._wakeup.clear()
+            # Re-check so an event published before the clear is not missed
+            if not self._buffer:
+                self._wakeup.wait(timeout)
+        return self.drain(max_items)
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def close(self) -> None:
+        """Stop receiving events."""
+        self._channel.unsubscribe(self)
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        """Return buffer depth and delivery counters."""
+        return {
+            "name": self.name,
+            "queued": len(self._buffer),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+class EventChannel:
+    """Fan-out of proxy events to any number of bounded subscriptions.
+
+    Events published while nobody is subscribed are discarded, so the
+    channel never accumulates memory on its own.
+    """
+
+    def __init__(self):
+        self._subscribers: tuple[Subscription, ...] = ()
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def publish(self, event: RequestEvent) -> None:
+        """Deliver an event to every subscriber. Never blocks."""
+        self.published += 1
+        for subscriber in self._subscribers:
+            subscriber.put(event)
+
+    def subscribe(
+        self,
+        maxsize: int = EVENT_BUFFER_SIZE,
+        overflow: str = DEFAULT_EVENT_OVERFLOW,
+        name: str = "",
+    ) -> Subscription:
+        """Create a new subscription with its own bounded buffer."""
+        subscription = Subscription(self, maxsize, overflow, name)
+        with self._lock:
+            self._subscribers = self._subscribers + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a subscription."""
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscription)
+
+    def stats(self) -> dict:
+        """Return the publish count and per-subscriber statistics."""
+        return {
+            "published": self.published,
+            "subscribers": [subscriber.stats() for subscriber in self._subscribers],
+        }
+
+    def register_metrics(self, metrics) -> None:
+        """Expose per-subscriber queue depth and drops in a MetricsRegistry."""
+        metrics.gauge(
+            "tokentap_event_queue_depth",
+            "Events waiting for each consumer",
+            ("subscriber",),
+            collect=lambda: {(s.name,): len(s) for s in self._subscribers},
+        )
+        metrics.counter(
+            "tokentap_events_dropped_total",
+            "Events dropped because a consumer fell behind",
+            ("subscriber",),
+            collect=lambda: {(s.name,): s.dropped for s in self._subscribers},
+        )
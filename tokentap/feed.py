@@ -0,0 +1,326 @@
+"""Server-sent event feed of proxy events, and the client remote dashboards read it with."""
+
+import asyncio
+import contextlib
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import deque
+from typing import Callable, Iterator
+
+from aiohttp import web
+
+from tokentap.config import (
+    EVENTS_PATH,
+    FEED_BATCH_INTERVAL,
+    FEED_CLIENT_BUFFER,
+    FEED_HEARTBEAT_INTERVAL,
+    FEED_READ_TIMEOUT,
+    FEED_RECONNECT_DELAY,
+    FEED_STATS_INTERVAL,
+    MAX_LOG_ENTRIES,
+    STARTUP_TIMEOUT,
+)
+from tokentap.events import EventChannel, RequestEvent, event_from_dict, event_to_dict
+
+_HEARTBEAT = b": keep-alive\n\n"
+
+
+def _frame(kind: str, data) -> bytes:
+    """Encode one server-sent event."""
+    return f"event: {kind}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+def feed_url(url: str) -> str:
+    """Return the feed URL for a base URL like "http://host:8081", adding the events path if none is given."""
+    if "://" not in url:
+        url = "http://" + url
+    parts = urllib.parse.urlsplit(url)
+    if parts.path in ("", "/"):
+        parts = parts._replace(path=EVENTS_PATH)
+    return urllib.parse.urlunsplit(parts)
+
+
+class _Client:
+    __slots__ = ("queue", "transport")
+
+    def __init__(self, queue: asyncio.Queue, transport: asyncio.Transport | None):
+        self.queue = queue
+        self.transport = transport
+
+
+class EventFeed:
+    """Serves the events of a channel to remote dashboards as server-sent events.
+
+    Runs its own event loop on a thread, so watchers cost the proxy only
+    one more channel subscription to append to. Every batch_interval the
+    events published since the last batch are serialized once and queued to
+    each client as one "events" message. A client whose max_pending batches
+    are still unsent is disconnected rather than buffered for; a new client
+    starts with a "hello" message holding the most recent events and
+    stats. With a stats callback, its result (upstream, cache, stage and
+    admission stats) is sent as a "stats" message every stats_interval.
+    """
+
+    def __init__(
+        self,
+        channel: EventChannel,
+        host: str,
+        port: int,
+        stats: Callable[[], dict] | None = None,
+        batch_interval: float = FEED_BATCH_INTERVAL,
+        max_pending: int = FEED_CLIENT_BUFFER,
+        stats_interval: float = FEED_STATS_INTERVAL,
+        history: int = MAX_LOG_ENTRIES,
+    ):
+        """Initialize the feed.
+
+        Args:
+            channel: Channel whose events are served
+            host: Address to listen on
+            port: Port to listen on
+            stats: Called on the feed thread for the stats sent to clients
+            batch_interval: Seconds between batches of events
+            max_pending: Batches queued per client before it is disconnected
+            stats_interval: Seconds between stats messages
+            history: Recent events sent to a client when it connects
+        """
+        self.channel = channel
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.batch_interval = batch_interval
+        self.max_pending = max_pending
+        self.stats_interval = stats_interval
+        self.connected = 0
+        self.dropped = 0
+        self._recent: deque[dict] = deque(maxlen=history)
+        self._latest_stats: dict | None = None
+        self._clients: set[_Client] = set()
+        self._events = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopped: asyncio.Event | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def clients(self) -> int:
+        """Clients currently connected."""
+        return len(self._clients)
+
+    def start(self, timeout: float = STARTUP_TIMEOUT) -> None:
+        """Start listening on the feed thread.
+
+        Raises:
+            OSError: If the port could not be bound
+        """
+        self._events = self.channel.subscribe(overflow="drop-oldest", name="feed")
+        listening = threading.Event()
+        failure: list[BaseException] = []
+
+        def run() -> None:
+            try:
+                asyncio.run(self._serve(listening))
+            except BaseException as e:
+                failure.append(e)
+                listening.set()
+
+        self._thread = threading.Thread(target=run, name="tokentap-feed", daemon=True)
+        self._thread.start()
+        if not listening.wait(timeout):
+            raise OSError(f"the event feed did not start within {timeout:g}s")
+        if failure:
+            self._events.close()
+            raise failure[0]
+
+    def close(self, timeout: float | None = 5) -> None:
+        """Disconnect all clients and stop the feed thread."""
+        if self._thread is None:
+            return
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join(timeout)
+        self._thread = None
+        self._events.close()
+
+    async def _serve(self, listening: threading.Event) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        app = web.Application()
+        app.router.add_get(EVENTS_PATH, self.handle_events)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+            if self.stats is not None:
+                self._latest_stats = self.stats()
+            listening.set()
+            await self._pump()
+        finally:
+            for client in list(self._clients):
+                with contextlib.suppress(asyncio.QueueFull):
+                    client.queue.put_nowait(None)
+                if client.transport is not None:
+                    client.transport.abort()
+            await runner.cleanup()
+
+    async def _pump(self) -> None:
+        """Batch new events and stats to every client until stopped."""
+        last_stats = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), self.batch_interval)
+            except asyncio.TimeoutError:
+                pass
+            events = self._events.drain()
+            if events:
+                batch = [event_to_dict(event) for event in events]
+                self._recent.extend(batch)
+                if self._clients:
+                    self._broadcast(_frame("events", batch))
+            if self.stats is not None and time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                stats = self.stats()
+                if stats != self._latest_stats:
+                    self._latest_stats = stats
+                    self._broadcast(_frame("stats", stats))
+
+    def _broadcast(self, frame: bytes) -> None:
+        for client in list(self._clients):
+            try:
+                client.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Its handler is stuck writing; closing the connection ends it
+                self.dropped += 1
+                self._clients.discard(client)
+                if client.transport is not None:
+                    client.transport.abort()
+
+    async def handle_events(self, request: web.Request) -> web.StreamResponse:
+        """Stream events to one client until it disconnects or falls behind."""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        client = _Client(asyncio.Queue(self.max_pending), request.transport)
+        # Registered before the snapshot is taken, so no batch falls between them
+        self._clients.add(client)
+        self.connected += 1
+        hello = _frame("hello", {"events": list(self._recent), "stats": self._latest_stats})
+        try:
+            await response.write(hello)
+            while True:
+                try:
+                    frame = await asyncio.wait_for(client.queue.get(), FEED_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    frame = _HEARTBEAT
+                if frame is None:
+                    break
+                await response.write(frame)
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(client)
+        return response
+
+    def register_metrics(self, metrics) -> None:
+        """Expose connected and dropped feed clients in a MetricsRegistry."""
+        metrics.gauge("tokentap_feed_clients", "Dashboards connected to the event feed", collect=lambda: {(): self.clients})
+        metrics.counter(
+            "tokentap_feed_clients_dropped_total",
+            "Feed clients disconnected for falling behind",
+            collect=lambda: {(): self.dropped},
+        )
+
+
+def _read_messages(stream) -> Iterator[tuple[str, object]]:
+    """Yield (event name, decoded data) for each server-sent event in a byte stream."""
+    kind, data = "message", []
+    for raw in stream:
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data:
+                yield kind, json.loads("\n".join(data))
+            kind, data = "message", []
+        elif line.startswith(":"):
+            continue
+        else:
+            name, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if name == "event":
+                kind = value
+            elif name == "data":
+                data.append(value)
+
+
+class FeedClient:
+    """Reads a proxy's event feed on a thread and hands the events to a callback.
+
+    Reconnects after FEED_RECONNECT_DELAY when the connection drops. The
+    recent events a feed sends on connect are only passed on for the first
+    connection, so a reconnect does not repeat them; events published while
+    disconnected are missed.
+    """
+
+    def __init__(self, url: str, on_event: Callable[[RequestEvent], None]):
+        """Initialize the client.
+
+        Args:
+            url: Feed URL, or the base URL of the feed's host and port
+            on_event: Called on the reader thread with each event
+        """
+        self.url = feed_url(url)
+        self.on_event = on_event
+        self.stats: dict | None = None
+        self.connected = False
+        self.error: str | None = None
+        self.received = 0
+        self.reconnects = 0
+        self._hello = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Start the reader thread."""
+        self._thread = threading.Thread(target=self._run, name="tokentap-feed-client", daemon=True)
+        self._thread.start()
+
+    def wait_connected(self, timeout: float | None = None) -> bool:
+        """Wait for the first connection; False if it did not succeed in time."""
+        return self._hello.wait(timeout)
+
+    def close(self) -> None:
+        """Stop reading; the thread exits with its current read."""
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                with urllib.request.urlopen(self.url, timeout=FEED_READ_TIMEOUT) as response:
+                    self.connected = True
+                    self.error = None
+                    for kind, data in _read_messages(response):
+                        self._handle(kind, data)
+                        if self._stop.is_set():
+                            return
+            except (OSError, ValueError) as e:
+                self.error = str(e)
+            self.connected = False
+            if self._stop.wait(FEED_RECONNECT_DELAY):
+                return
+            self.reconnects += 1
+
+    def _handle(self, kind: str, data) -> None:
+        if kind == "hello":
+            if not self._hello.is_set():
+                self._deliver(data["events"])
+            self.stats = data["stats"]
+            self._hello.set()
+        elif kind == "events":
+            self._deliver(data)
+        elif kind == "stats":
+            self.stats = data
+
+    def _deliver(self, events: list[dict]) -> None:
+        for data in events:
+            self.on_event(event_from_dict(data))
+        self.received += len(events)
@@ -0,0 +1,180 @@
+"""In-process metrics with Prometheus text exposition."""
+
+from bisect import bisect_left
+from typing import Callable
+
+from tokentap.config import LATENCY_BUCKETS
+
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: Labels, *extra: str) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(pair for pair in extra if pair)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class for a named metric family with optional labels.
+
+    Values live in a plain dict keyed by the label values and are updated
+    on the event loop thread, so recording a sample is a dict lookup and
+    an addition. A collect callback can supply values at scrape time
+    instead, for state that is already tracked elsewhere.
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        collect: Callable[[], dict[Labels, float]] | None = None,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+        # Labels shared by every sample, preformatted; set by the registry
+        self.const_labels = ""
+        self._values: dict[Labels, float] = {}
+
+    def samples(self) -> list[str]:
+        values = self.collect() if self.collect else self._values
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels, self.const_labels)} {_format_value(value)}"
+            for labels, value in values.items()
+        ]
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self.samples()]
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, labels: Labels = ()) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    type = "gauge"
+
+    def set(self, value: float, labels: Labels = ()) -> None:
+        self._values[labels] = value
+
+    def inc(self, amount: float = 1, labels: Labels = ()) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount: float = 1, labels: Labels = ()) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(Metric):
+    """Distribution of observations over fixed cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[Labels, list[float]] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                bucket = _format_labels(self.labelnames, labels, self.const_labels, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            suffix = _format_labels(self.labelnames, labels, self.const_labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def merge_expositions(texts: list[str]) -> str:
+    """Merge the expositions of registries with the same metrics, as from several workers.
+
+    Each family's HELP and TYPE lines are kept once and its samples from
+    every text follow them, as the text format requires. The samples must
+    differ in their labels, such as a worker label.
+    """
+    families: dict[str, tuple[list[str], list[str]]] = {}
+    for text in texts:
+        samples = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                headers, samples = families.setdefault(line.split(" ", 3)[2], ([], []))
+                if line not in headers:
+                    headers.append(line)
+            elif line and samples is not None:
+                samples.append(line)
+    lines = []
+    for headers, samples in families.values():
+        lines.extend(headers)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together for a scrape.
+
+    const_labels are added to every sample, e.g. the worker they come from.
+    """
+
+    def __init__(self, const_labels: dict[str, str] | None = None):
+        self._metrics: dict[str, Metric] = {}
+        self.const_labels = ",".join(f'{name}="{_escape(value)}"' for name, value in (const_labels or {}).items())
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        metric.const_labels = self.const_labels
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = (), collect=None) -> Counter:
+        """Create and register a counter."""
+        return self._register(Counter(name, help, labelnames, collect))
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...] = (), collect=None) -> Gauge:
+        """Create and register a gauge."""
+        return self._register(Gauge(name, help, labelnames, collect))
+
+    def histogram(
+        self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> Histogram:
+        """Create and register a histogram."""
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -1,22 +1,172 @@
 """Request parsing and token counting utilities."""
 
 import json
+import hashlib
+import threading
+from collections import OrderedDict
 from typing import Any
 
-import tiktoken
+from tokentap.config import DEFAULT_TOKENIZER, TOKEN_CACHE_MAX_BYTES
+from tokentap.encoders import encoders
+
+ENCODING_NAME = "cl100k_base"
+
+# Rough per-entry footprint: 16 byte digest, int and OrderedDict node
+_CACHE_ENTRY_BYTES = 200
 
 
 def get_encoding():
-    """Get the tiktoken encoding for token counting."""
-    return tiktoken.get_encoding("cl100k_base")
+    """Get the tiktoken encoding for token counting, loading it on first use."""
+    # Deferred so importing tokentap does not pay for tiktoken
+    import tiktoken
+
+    return tiktoken.get_encoding(ENCODING_NAME)
+
+
+def warm_up(tokenizer: str = DEFAULT_TOKENIZER) -> None:
+    """Load a tokenizer ahead of the first count."""
+    encoders.get(tokenizer).count_batch(["warm up"])
 
 
-def count_tokens(text: str) -> int:
-    """Count tokens in text using tiktoken cl100k_base encoding."""
+def count_tokens(text: str, tokenizer: str = DEFAULT_TOKENIZER) -> int:
+    """Count tokens in text, with cl100k_base unless another tokenizer spec is given."""
     if not text:
         return 0
-    encoding = get_encoding()
-    return len(encoding.encode(text))
+    return encoders.get(tokenizer).count_batch([text])[0]
+
+
+class TokenCountCache:
+    """Thread-safe LRU cache of token counts for conversation segments."""
+
+    def __init__(self, max_bytes: int = TOKEN_CACHE_MAX_BYTES):
+        self.max_entries = max(1, max_bytes // _CACHE_ENTRY_BYTES)
+        self._entries: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: bytes) -> int | None:
+        """Return the cached count for key, or None on a miss."""
+        with self._lock:
+            count = self._entries.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return count
+
+    def put(self, key: bytes, count: int) -> None:
+        """Store a count, evicting the least recently used entries."""
+        with self._lock:
+            self._entries[key] = count
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop all entries and reset statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """Return hit/miss statistics and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": len(self._entries) * _CACHE_ENTRY_BYTES,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+token_cache = TokenCountCache()
+
+
+def _starts_segment(text: str) -> bool:
+    """Check whether the tokenizer is guaranteed to split right before text.
+
+    The cl100k_base/o200k_base split patterns never merge a newline with a
+    following non-whitespace character (other than "/"), so a message that
+    starts with one can be encoded independently of what precedes it.
+    """
+    return bool(text) and not text[0].isspace() and text[0] != "/"
+
+
+def _iter_segments(messages: list[dict], encoder_name: str = ENCODING_NAME, split: bool = True):
+    """Yield (cache key, text) for independently encodable message runs.
+
+    Joining the yielded texts reproduces the newline-joined total_text exactly.
+    Keys are specific to the encoder; with split off, the whole conversation
+    is one run.
+    """
+    digest = None
+    parts: list[str] = []
+    for msg in messages:
+        content = msg.get("content") or ""
+        if split and digest is not None and _starts_segment(content):
+            parts.append("\n")
+            digest.update(b"\x01")
+            yield digest.digest(), "".join(parts)
+            digest, parts = None, []
+        if digest is None:
+            digest = hashlib.blake2b(encoder_name.encode("utf-8", "surrogatepass"), digest_size=16)
+        else:
+            parts.append("\n")
+        parts.append(content)
+        digest.update(msg.get("role", "unknown").encode("utf-8", "replace") + b"\x00")
+        digest.update(content.encode("utf-8", "surrogatepass") + b"\x00")
+    if digest is not None:
+        yield digest.digest(), "".join(parts)
+
+
+def count_message_tokens(
+    messages: list[dict], tokenizer: str = DEFAULT_TOKENIZER, fallback: str = DEFAULT_TOKENIZER
+) -> int:
+    """Count tokens of the newline-joined message contents, reusing cached segments.
+
+    The result equals count_tokens() of the joined text; only message runs
+    not seen before are encoded. fallback is counted with if tokenizer
+    cannot be loaded.
+    """
+    return count_message_tokens_batch([messages], tokenizer, fallback)[0]
+
+
+def count_message_tokens_batch(
+    conversations: list[list[dict]], tokenizer: str = DEFAULT_TOKENIZER, fallback: str = DEFAULT_TOKENIZER
+) -> list[int]:
+    """Count tokens for several message lists, encoding all cache misses at once."""
+    encoder = encoders.get(tokenizer, fallback)
+    segments = [list(_iter_segments(messages, encoder.name, encoder.splits_messages)) for messages in conversations]
+
+    counts: dict[bytes, int] = {}
+    missing: dict[bytes, str] = {}
+    for key, text in (segment for segs in segments for segment in segs):
+        if key in counts or key in missing:
+            continue
+        count = token_cache.get(key)
+        if count is None:
+            missing[key] = text
+        else:
+            counts[key] = count
+
+    if missing:
+        for key, count in zip(missing, encoder.count_batch(list(missing.values()))):
+            counts[key] = count
+            token_cache.put(key, count)
+
+    return [sum(counts[key] for key, _ in segs) for segs in segments]
+
+
+def token_cache_stats() -> dict:
+    """Return statistics of the shared token count cache."""
+    return token_cache.stats()
 
 
 def extract_text_from_content(content: Any) -> str:
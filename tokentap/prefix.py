@@ -0,0 +1,164 @@
+"""Prompt prefix reuse: how much of each prompt repeats an earlier one."""
+
+import hashlib
+from collections import OrderedDict
+
+from tokentap.config import PREFIX_INDEX_SIZE, PREFIX_SESSIONS_MAX
+
+
+def _prefix_hashes(messages: list[dict], model: str) -> tuple[list[bytes], list[int]]:
+    """Return the chained hash and cumulative length of every message prefix.
+
+    Hash i covers messages[0..i] and the model, since a server's prefix
+    cache is per model. Lengths count the newline-joined contents, the text
+    token counts are taken of.
+    """
+    digest = hashlib.blake2b(model.encode("utf-8", "surrogatepass"), digest_size=16)
+    hashes, lengths = [], []
+    length = -1
+    for msg in messages:
+        content = msg.get("content") or ""
+        digest.update(msg.get("role", "unknown").encode("utf-8", "replace") + b"\x00")
+        digest.update(content.encode("utf-8", "surrogatepass") + b"\x00")
+        # Copies share the state hashed so far, so each prefix costs one message
+        hashes.append(digest.copy().digest())
+        length += len(content) + 1
+        lengths.append(length)
+    return hashes, lengths
+
+
+def _session_id(messages: list[dict], model: str) -> str:
+    """Return a conversation's id: its model and first non-system message.
+
+    The system prompt is left out, so a conversation whose system prompt
+    changes stays one session and shows the drop in reuse.
+    """
+    first = next((msg for msg in messages if msg.get("role") != "system"), messages[0])
+    digest = hashlib.blake2b(model.encode("utf-8", "surrogatepass"), digest_size=6)
+    digest.update(first.get("role", "unknown").encode("utf-8", "replace") + b"\x00")
+    digest.update((first.get("content") or "").encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+
+class _Session:
+    __slots__ = ("requests", "prompt_tokens", "prefix_tokens")
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.prefix_tokens = 0
+
+    @property
+    def reuse(self) -> float:
+        return self.prefix_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+class PrefixTracker:
+    """Finds the longest message prefix each prompt shares with an earlier one.
+
+    Every prefix of every prompt is indexed by a chained hash of its
+    messages, mapped to its estimated token count: the prompt's tokens
+    scaled by the prefix's share of the text (exact for the whole prompt).
+    A request's reusable prefix is the longest of its own prefixes found in
+    the index, probed from the longest down; everything after it is new.
+    This works at message granularity, so a prefix the server could reuse
+    up to the middle of a changed message counts as new.
+
+    The index and the per-session totals are least-recently-used caches of
+    max_entries and max_sessions items, so memory stays bounded and an
+    update costs one hash per message and a few dict operations per
+    prefix. Only touched from the event loop.
+    """
+
+    def __init__(self, max_entries: int = PREFIX_INDEX_SIZE, max_sessions: int = PREFIX_SESSIONS_MAX):
+        """Initialize the tracker.
+
+        Args:
+            max_entries: Message prefixes remembered
+            max_sessions: Conversations whose reuse totals are kept
+        """
+        self.max_entries = max(1, max_entries)
+        self.max_sessions = max(1, max_sessions)
+        self._index: OrderedDict[bytes, int] = OrderedDict()
+        self._sessions: OrderedDict[str, _Session] = OrderedDict()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.prefix_tokens = 0
+        self.evictions = 0
+
+    @property
+    def entries(self) -> int:
+        """Message prefixes in the index."""
+        return len(self._index)
+
+    @property
+    def sessions(self) -> int:
+        """Conversations whose totals are kept."""
+        return len(self._sessions)
+
+    def track(self, messages: list[dict], model: str, tokens: int) -> tuple[int, str, float] | None:
+        """Record a prompt and return its reusable prefix tokens, session id and session reuse ratio.
+
+        Returns None for a prompt without messages.
+        """
+        if not messages:
+            return None
+        hashes, lengths = _prefix_hashes(messages, model)
+        index = self._index
+
+        prefix_tokens = 0
+        for key in reversed(hashes):
+            found = index.get(key)
+            if found is not None:
+                prefix_tokens = min(found, tokens)
+                break
+
+        total = lengths[-1] or 1
+        for key, length in zip(hashes, lengths):
+            index[key] = tokens * length // total
+            index.move_to_end(key)
+        # The whole prompt's count is exact, not a share
+        index[hashes[-1]] = tokens
+        while len(index) > self.max_entries:
+            index.popitem(last=False)
+            self.evictions += 1
+
+        session_id = _session_id(messages, model)
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session()
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        session.requests += 1
+        session.prompt_tokens += tokens
+        session.prefix_tokens += prefix_tokens
+
+        self.requests += 1
+        self.prompt_tokens += tokens
+        self.prefix_tokens += prefix_tokens
+        return prefix_tokens, session_id, session.reuse
+
+    def stats(self, recent: int = 10) -> dict:
+        """Return index occupancy, overall reuse and the most recently active sessions."""
+        sessions = list(self._sessions.items())[-recent:]
+        return {
+            "entries": self.entries,
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "sessions": self.sessions,
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "prefix_tokens": self.prefix_tokens,
+            "reuse": self.prefix_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "recent_sessions": {
+                session_id: {
+                    "requests": session.requests,
+                    "prompt_tokens": session.prompt_tokens,
+                    "prefix_tokens": session.prefix_tokens,
+                    "reuse": session.reuse,
+                }
+                for session_id, session in reversed(sessions)
+            },
+        }
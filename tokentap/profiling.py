@@ -0,0 +1,179 @@
+"""Per-stage request timing and on-demand profiler captures."""
+
+import cProfile
+import io
+import pstats
+import tracemalloc
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from tokentap.config import PROFILE_REPORT_LINES, STAGE_WINDOW, TRACEMALLOC_FRAMES
+
+# Phases of a proxied request, in the order they happen
+STAGES = (
+    "read_body",
+    "parse",
+    "cache_lookup",
+    "upstream_connect",
+    "upstream_headers",
+    "relay",
+    "sse_parse",
+    "tokenize_prompt",
+    "tokenize_output",
+    "archive_batch",
+)
+
+PROFILE_KINDS = ("cprofile", "tracemalloc")
+
+
+class StageStats:
+    """Rolling durations of each request stage.
+
+    Every stage keeps its last ``window`` samples for percentiles, plus
+    running totals for the metrics endpoint. Each stage is recorded from a
+    single thread (archive batches from the writer thread, everything else
+    from the event loop), so no lock is needed. While disabled, recording
+    is one attribute check.
+    """
+
+    def __init__(self, window: int = STAGE_WINDOW, enabled: bool = True):
+        self.enabled = enabled
+        self._samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self.count = dict.fromkeys(STAGES, 0)
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Add a duration to a stage."""
+        if not self.enabled:
+            return
+        self._samples[stage].append(seconds)
+        self.count[stage] += 1
+        self.seconds[stage] += seconds
+
+    def summary(self) -> dict[str, dict]:
+        """Return count, mean and percentiles (in seconds) of each stage seen in the window."""
+        result = {}
+        for stage, samples in self._samples.items():
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            last = len(ordered) - 1
+            result[stage] = {
+                "count": self.count[stage],
+                "mean_s": sum(ordered) / len(ordered),
+                **{
+                    f"p{q}_s": ordered[max(0, min(last, round(q / 100 * len(ordered)) - 1))]
+                    for q in (50, 95, 99)
+                },
+                "max_s": ordered[last],
+            }
+        return result
+
+
+class Profiler:
+    """Captures a cProfile or tracemalloc profile over the next N requests.
+
+    Nothing is traced until a capture starts; while idle the proxy only
+    checks ``active`` once per request. When the capture ends, a job is
+    handed back that writes the raw profile (loadable with pstats or
+    tracemalloc.Snapshot.load) and a text report of the top entries; it is
+    meant to run on the archive writer thread.
+    """
+
+    def __init__(self, directory: Path, suffix: str = ""):
+        self.directory = directory
+        self.suffix = suffix
+        self.kind: str | None = None
+        self.requests = 0
+        self.remaining = 0
+        self.started: datetime | None = None
+        self.reports: list[str] = []
+        self._profile: cProfile.Profile | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.kind is not None
+
+    def start(self, kind: str, requests: int) -> None:
+        """Start capturing until requests more requests have finished.
+
+        Raises:
+            ValueError: If kind or requests is invalid
+            RuntimeError: If a capture is running or its report is still being written
+        """
+        if kind not in PROFILE_KINDS:
+            raise ValueError(f"Unknown profile kind: {kind!r}")
+        if requests < 1:
+            raise ValueError("requests must be at least 1")
+        if self.active:
+            raise RuntimeError(f"A {self.kind} capture is already running")
+        if kind == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            if tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc is already tracing")
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.kind = kind
+        self.requests = self.remaining = requests
+        self.started = datetime.now()
+
+    def request_finished(self) -> Callable[[], int] | None:
+        """Count a finished request; return the report job once the capture is complete."""
+        self.remaining -= 1
+        if self.remaining > 0:
+            return None
+        return self.finish()
+
+    def finish(self) -> Callable[[], int] | None:
+        """End the capture now and return the job writing its report.
+
+        Tracing stops here rather than in the job, so it ends even if the
+        job is never run.
+        """
+        if not self.active:
+            return None
+        stem = f"{self.kind}_{self.started.strftime('%Y-%m-%d_%H-%M-%S')}{self.suffix}"
+        kind, self.kind = self.kind, None
+        if kind == "cprofile":
+            profile, self._profile = self._profile, None
+            profile.disable()
+            return lambda: self._write_cprofile(profile, stem)
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        return lambda: self._write_tracemalloc(snapshot, stem)
+
+    def _write_cprofile(self, profile: cProfile.Profile, stem: str) -> int:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{stem}.prof"
+        profile.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        return self._write_report(path, stem, report.getvalue())
+
+    def _write_tracemalloc(self, snapshot: tracemalloc.Snapshot, stem: str) -> int:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{stem}.tracemalloc"
+        snapshot.dump(str(path))
+        lines = [str(stat) for stat in snapshot.statistics("lineno")[:PROFILE_REPORT_LINES]]
+        return self._write_report(path, stem, "\n".join(lines) + "\n")
+
+    def _write_report(self, path: Path, stem: str, text: str) -> int:
+        report_path = self.directory / f"{stem}.txt"
+        data = text.encode()
+        report_path.write_bytes(data)
+        self.reports = [str(path), str(report_path)]
+        return path.stat().st_size + len(data)
+
+    def stats(self) -> dict:
+        """Return the capture state and the files of the last report."""
+        return {
+            "active": self.active,
+            "kind": self.kind,
+            "requests": self.requests,
+            "remaining": self.remaining if self.active else 0,
+            "started": self.started.isoformat() if self.started else None,
+            "reports": self.reports,
+        }
@@ -2,15 +2,107 @@
 
 import ssl
 import json
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
 from pathlib import Path
-from typing import Callable
+from typing import Awaitable, Callable
 from datetime import datetime
-from urllib.parse import urlparse
+from dataclasses import replace
 
 import aiohttp
 from aiohttp import web
 
-from tokentap.parser import count_tokens, parse_anthropic_request, parse_openai_request
+from tokentap.config import (
+    ARCHIVE_QUEUE_SIZE,
+    DEFAULT_ARCHIVE_COMPRESSION,
+    DEFAULT_ARCHIVE_FORMAT,
+    DEFAULT_ARCHIVE_FSYNC,
+    DEBUG_PATH,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_PROFILE_REQUESTS,
+    DEFAULT_HEALTH_PATH,
+    DEFAULT_KEEPALIVE_TIMEOUT,
+    DEFAULT_MAX_INFLIGHT,
+    DEFAULT_MAX_QUEUE,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_QUEUE_POLICY,
+    DEFAULT_QUEUE_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+    DEFAULT_ROUTING,
+    DEFAULT_TOKENIZER_MODE,
+    DEFAULT_TOKENIZER_WORKERS,
+    DEFAULT_USAGE_SOURCE,
+    MAX_PARSE_BODY_BYTES,
+    METRICS_PATH,
+    PREFIX_INDEX_SIZE,
+    PRIORITY_HEADER,
+    PROFILES_DIRNAME,
+    PROMPT_PREVIEW_LENGTH,
+    REUSE_BUCKETS,
+    STREAM_BODY_THRESHOLD,
+)
+from tokentap.admission import AdmissionController, AdmissionRejected
+from tokentap.archive import ArchiveWriter, ContentStore, Payload, dump_json, render_markdown
+from tokentap.body import BodyTee
+from tokentap.cache import ResponseCache, cacheable_headers
+from tokentap.encoders import TokenizerMap, encoders
+from tokentap.events import RequestEvent
+from tokentap.metrics import MetricsRegistry, merge_expositions
+from tokentap.parser import extract_last_user_message, parse_anthropic_request, parse_openai_request
+from tokentap.prefix import PrefixTracker
+from tokentap.profiling import PROFILE_KINDS, Profiler, StageStats
+from tokentap.sse import ResponseAssembler, UsageReportFilter
+from tokentap.timing import StreamTimer
+from tokentap.tokenpool import USAGE_SOURCES, TokenCountPool
+from tokentap.upstream import Upstream, UpstreamPool
+
+logger = logging.getLogger(__name__)
+
+
+async def _replay(chunks: list[bytes]):
+    """Yield recorded chunks like a live upstream stream."""
+    for chunk in chunks:
+        yield chunk
+
+# Failures that happen before the request reaches the upstream; safe to retry elsewhere
+_CONNECT_ERRORS = (aiohttp.ClientConnectorError, getattr(aiohttp, "ConnectionTimeoutError", aiohttp.ClientConnectorError))
+
+
+# Status recorded for a request whose client hung up, as nginx logs it
+_CLIENT_CLOSED = 499
+
+
+class _ClientGone(Exception):
+    """The client connection failed while its response was being written."""
+
+
+# Headers that describe the client's request rather than the forwarded one
+_REQUEST_ONLY_HEADERS = {"host", "content-length", "transfer-encoding", PRIORITY_HEADER.lower()}
+
+
+def _priority(value: str | None) -> int:
+    """Parse the admission priority header, defaulting to 0."""
+    try:
+        return int(value) if value else 0
+    except ValueError:
+        return 0
+
+
+def _request_usage_report(body_dict) -> bool:
+    """Ask an OpenAI-style streaming request to report usage in its last chunk.
+
+    Returns whether the body was changed.
+    """
+    if not isinstance(body_dict, dict) or body_dict.get("stream") is not True:
+        return False
+    options = body_dict.get("stream_options") or {}
+    if not isinstance(options, dict) or options.get("include_usage"):
+        return False
+    body_dict["stream_options"] = {**options, "include_usage": True}
+    return True
 
 
 class ProxyServer:
@@ -21,228 +113,942 @@ class ProxyServer:
         base_url: str,
         port: int,
         prompts_dir: Path,
-        on_request: Callable[[dict], None] | None = None,
+        on_request: Callable[[RequestEvent], None] | None = None,
+        on_response: Callable[[RequestEvent], None] | None = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+        connect_timeout: float | None = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float | None = DEFAULT_READ_TIMEOUT,
+        tokenizer_workers: int = DEFAULT_TOKENIZER_WORKERS,
+        tokenizer_mode: str = DEFAULT_TOKENIZER_MODE,
+        archive_fsync: str = DEFAULT_ARCHIVE_FSYNC,
+        archive_queue_size: int = ARCHIVE_QUEUE_SIZE,
+        archive_format: str = DEFAULT_ARCHIVE_FORMAT,
+        archive_compression: str = DEFAULT_ARCHIVE_COMPRESSION,
+        upstreams: list[str] | None = None,
+        routing: str = DEFAULT_ROUTING,
+        health_path: str = DEFAULT_HEALTH_PATH,
+        cache: ResponseCache | None = None,
+        worker_id: int = 0,
+        workers: int = 1,
+        stream_threshold: int = STREAM_BODY_THRESHOLD,
+        max_parse_bytes: int = MAX_PARSE_BODY_BYTES,
+        usage_source: str = DEFAULT_USAGE_SOURCE,
+        include_usage: bool = False,
+        stage_timing: bool = True,
+        max_inflight: int = DEFAULT_MAX_INFLIGHT,
+        model_limits: dict[str, int] | None = None,
+        queue_policy: str = DEFAULT_QUEUE_POLICY,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+        launched_at: float | None = None,
+        tokenizers: dict[str, str] | None = None,
+        prefix_index_size: int = PREFIX_INDEX_SIZE,
     ):
         """Initialize the proxy server.
 
         Args:
             port: Local port to listen on
             on_request: Callback function called with parsed request data
+            on_response: Callback function called with the request data plus
+                latency and output token metrics once the response has finished
+            pool_size: Maximum number of pooled upstream connections
+            keepalive_timeout: Seconds an idle upstream connection is kept open
+            connect_timeout: Seconds allowed for establishing an upstream connection
+            read_timeout: Seconds allowed between two reads from upstream
+            tokenizer_workers: Number of token counting workers
+            tokenizer_mode: Run token counting in "thread" or "process" workers
+            archive_fsync: When archive files are fsynced ("never", "batch", "always")
+            archive_queue_size: Pending archive writes before new ones are dropped
+            archive_format: "files" for per-request markdown/JSON files, "dedup"
+                for a content-addressed store of unique messages
+            archive_compression: Compression of the dedup store ("none", "gzip", "zstd")
+            upstreams: Upstream replicas to balance across, instead of base_url alone
+            routing: "least-loaded", or "model" to prefer replicas serving the requested model
+            health_path: Path probed on each replica by the background health check
+            cache: Response cache for temperature 0 requests, or None to always go upstream
+            worker_id: Index of this proxy among workers sharing the port
+            workers: Number of proxy workers sharing the port (SO_REUSEPORT when > 1)
+            stream_threshold: Request bodies larger than this many bytes (or of
+                unknown length) are streamed upstream instead of read first
+            max_parse_bytes: Streamed bodies larger than this are relayed and
+                archived but not parsed or token-counted
+            usage_source: "local" to count tokens with the local tokenizer, or
+                "upstream" to take them from the usage the server reports and
+                count locally only when a response carries none
+            include_usage: Add stream_options.include_usage to OpenAI-style
+                streaming requests, so the server reports usage at all; the
+                report is not relayed to clients that did not ask for it
+            stage_timing: Record how long each phase of a request takes
+            max_inflight: Requests in flight per upstream replica before new
+                ones are queued, 0 for no limit
+            model_limits: Requests in flight per model ("*" for any other model)
+            queue_policy: Serve queued requests "fifo" or by "priority"
+                (the X-Tokentap-Priority header, higher first)
+            max_queue: Queued requests before new ones are refused with 429
+            queue_timeout: Seconds a request may wait in the queue before it
+                is refused with 503
+            launched_at: Wall-clock time the process was launched, from which
+                the startup timings are measured (default: now)
+            tokenizers: Model name patterns to tokenizer specs (tiktoken
+                encoding names or tokenizer.json paths); "*" replaces the
+                cl100k_base default
+            prefix_index_size: Message prefixes remembered to find the part
+                of each prompt repeating an earlier one, 0 to not track reuse
         """
+        if usage_source not in USAGE_SOURCES:
+            raise ValueError(f"Unknown usage source: {usage_source!r}")
         self.base_url = base_url
+        self.cache = cache
+        self.upstreams = UpstreamPool(upstreams or [base_url], routing=routing, health_path=health_path)
+        self.admission = AdmissionController(
+            self.upstreams,
+            max_inflight=max_inflight,
+            model_limits=model_limits,
+            policy=queue_policy,
+            max_queue=max_queue,
+            timeout=queue_timeout,
+        )
         self.port = port
         self.on_request = on_request
+        self.on_response = on_response
         self.prompts_dir = prompts_dir
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.tokenizer_workers = tokenizer_workers
+        self.tokenizer_mode = tokenizer_mode
+        self.tokenizers = TokenizerMap(tokenizers)
+        self.prefixes = PrefixTracker(prefix_index_size) if prefix_index_size else None
+        self.stages = StageStats(enabled=stage_timing)
+        self.profiler = Profiler(prompts_dir / PROFILES_DIRNAME, suffix=f"_{worker_id}" if workers > 1 else "")
+        self.archive = ArchiveWriter(
+            max_queue=archive_queue_size,
+            fsync=archive_fsync,
+            on_batch=lambda seconds: self.stages.record("archive_batch", seconds),
+        )
+        self.store = None
+        if archive_format == "dedup":
+            self.store = ContentStore(prompts_dir, archive_compression, fsync=archive_fsync != "never")
+        self.metrics = MetricsRegistry({"worker": str(worker_id)} if workers > 1 else None)
+        # Set by the worker process to collect the other workers' metrics for a scrape
+        self.peer_metrics: Callable[[], Awaitable[list[str]]] | None = None
+        self._init_metrics()
         self.app = web.Application()
+        self.app.router.add_get(METRICS_PATH, self.handle_metrics)
+        self.app.router.add_get(DEBUG_PATH, self.handle_debug)
+        self.app.router.add_post(DEBUG_PATH + "/stages", self.handle_stages)
+        self.app.router.add_post(DEBUG_PATH + "/profile", self.handle_profile)
+        self.app.router.add_delete(DEBUG_PATH + "/profile", self.handle_profile)
         self.app.router.add_route("*", "/{path:.*}", self.handle_request)
         self._runner = None
         self._site = None
+        self._ssl_context = ssl.create_default_context()
+        self._session: aiohttp.ClientSession | None = None
+        self._token_pool: TokenCountPool | None = None
+        self._background: set[asyncio.Task] = set()
+        self.stream_threshold = stream_threshold
+        self.max_parse_bytes = max_parse_bytes
+        self.usage_source = usage_source
+        self.include_usage = include_usage
+        self.worker_id = worker_id
+        self.workers = workers
+        # Interleaved so request ids stay unique across workers
+        self._request_ids = itertools.count(worker_id + 1, workers)
+        self.launched_at = time.time() if launched_at is None else launched_at
+        # Seconds from launch until listening, tokenizer loaded and first byte relayed
+        self.startup: dict[str, float | None] = {"listening_s": None, "tokenizer_s": None, "first_byte_s": None}
+
+    def _init_metrics(self) -> None:
+        """Register the proxy's metrics."""
+        metrics = self.metrics
+        self._requests_total = metrics.counter(
+            "tokentap_requests_total", "Proxied requests by model and response status", ("model", "status")
+        )
+        self._prompt_tokens_total = metrics.counter(
+            "tokentap_prompt_tokens_total", "Prompt tokens counted per model", ("model",)
+        )
+        self._prefix_tokens_total = metrics.counter(
+            "tokentap_prompt_prefix_tokens_total",
+            "Prompt tokens repeating an earlier prompt's messages (reused) or not (new)",
+            ("model", "kind"),
+        )
+        self._prefix_reuse = metrics.histogram(
+            "tokentap_prompt_prefix_reuse_ratio", "Share of each prompt repeating an earlier one", ("model",), REUSE_BUCKETS
+        )
+        if self.prefixes is not None:
+            metrics.gauge(
+                "tokentap_prefix_index_entries",
+                "Message prefixes in the reuse index",
+                collect=lambda: {(): self.prefixes.entries},
+            )
+            metrics.gauge(
+                "tokentap_prefix_sessions",
+                "Conversations whose prefix reuse is tracked",
+                collect=lambda: {(): self.prefixes.sessions},
+            )
+        self._completion_tokens_total = metrics.counter(
+            "tokentap_completion_tokens_total", "Completion tokens counted per model", ("model",)
+        )
+        self._usage_source_total = metrics.counter(
+            "tokentap_usage_source_total", "Responses by where their token counts came from", ("source",)
+        )
+        self._upstream_errors_total = metrics.counter(
+            "tokentap_upstream_errors_total", "Upstream requests that failed or timed out", ("reason",)
+        )
+        self._client_disconnects_total = metrics.counter(
+            "tokentap_client_disconnects_total", "Requests whose client hung up before the response ended", ("model",)
+        )
+        self._upstream_retries_total = metrics.counter(
+            "tokentap_upstream_retries_total", "Requests retried on another replica after a connect failure", ("upstream",)
+        )
+        metrics.gauge(
+            "tokentap_upstream_outstanding",
+            "Requests in flight per upstream replica",
+            ("upstream",),
+            collect=lambda: {(u.name,): u.outstanding for u in self.upstreams.upstreams},
+        )
+        metrics.gauge(
+            "tokentap_upstream_healthy",
+            "Whether an upstream replica is receiving traffic (1) or ejected (0)",
+            ("upstream",),
+            collect=lambda: {(u.name,): int(u.healthy) for u in self.upstreams.upstreams},
+        )
+        if self.cache is not None:
+            for key, description in (
+                ("hits", "Requests answered from the response cache"),
+                ("misses", "Cacheable requests that went upstream"),
+                ("bypassed", "Requests not eligible for caching"),
+                ("bytes_saved", "Response bytes replayed from the cache"),
+            ):
+                metrics.counter(
+                    f"tokentap_cache_{key}_total", description, collect=lambda key=key: {(): self.cache.stats()[key]}
+                )
+        metrics.counter(
+            "tokentap_stage_seconds_total",
+            "Time spent in each request stage",
+            ("stage",),
+            collect=lambda: {(stage,): seconds for stage, seconds in self.stages.seconds.items()},
+        )
+        metrics.counter(
+            "tokentap_stage_samples_total",
+            "Timed occurrences of each request stage",
+            ("stage",),
+            collect=lambda: {(stage,): count for stage, count in self.stages.count.items()},
+        )
+        metrics.gauge(
+            "tokentap_admission_waiting",
+            "Requests waiting for upstream capacity",
+            collect=lambda: {(): self.admission.waiting},
+        )
+        self._admission_rejected_total = metrics.counter(
+            "tokentap_admission_rejected_total", "Requests refused by admission control", ("reason",)
+        )
+        self._admission_wait = metrics.histogram(
+            "tokentap_admission_wait_seconds", "Time requests waited for upstream capacity"
+        )
+        self._inflight_streams = metrics.gauge("tokentap_inflight_streams", "Requests currently being relayed")
+        self._request_duration = metrics.histogram(
+            "tokentap_request_duration_seconds", "Time from receiving a request to the end of its response", ("model",)
+        )
+        self._ttft = metrics.histogram("tokentap_ttft_seconds", "Time to the first generated token", ("model",))
+        metrics.gauge(
+            "tokentap_archive_queue_depth",
+            "Archive writes waiting for the writer thread",
+            collect=lambda: {(): self.archive.stats()["queued"]},
+        )
+        metrics.counter(
+            "tokentap_archive_dropped_total",
+            "Archive writes dropped because the queue was full",
+            collect=lambda: {(): self.archive.dropped},
+        )
+        metrics.gauge(
+            "tokentap_tokenizer_pending",
+            "Token counting requests waiting for a worker batch",
+            collect=lambda: {(): self._token_pool.stats()["pending"]} if self._token_pool else {},
+        )
+        for key, description in (
+            ("hits", "Message segments whose token count was cached"),
+            ("misses", "Message segments that had to be encoded"),
+        ):
+            metrics.counter(
+                f"tokentap_token_cache_{key}_total",
+                description,
+                collect=lambda key=key: {(): self._token_pool.cache_stats()[key]} if self._token_pool else {},
+            )
+        metrics.gauge(
+            "tokentap_startup_seconds",
+            "Seconds from launch until the proxy listened, loaded the tokenizer and relayed its first byte",
+            ("phase",),
+            collect=lambda: {(phase[:-2],): seconds for phase, seconds in self.startup.items() if seconds is not None},
+        )
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """Serve the metrics in the Prometheus text format, those of all workers with --workers."""
+        text = self.metrics.render()
+        if self.peer_metrics is not None:
+            text = merge_expositions([text, *await self.peer_metrics()])
+        return web.Response(
+            body=text.encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def handle_debug(self, request: web.Request) -> web.Response:
+        """Serve stage timings, profiler state and component counters as JSON."""
+        return web.json_response({
+            "worker": self.worker_id,
+            "startup": self.startup,
+            "stage_timing": self.stages.enabled,
+            "stages": self.stages.summary(),
+            "profiler": self.profiler.stats(),
+            "archive": self.archive.stats(),
+            "tokenizer": {
+                **(self._token_pool.stats() if self._token_pool else {}),
+                **self.tokenizers.stats(),
+                # Encoders of this process; process mode workers load their own
+                "encoders": encoders.stats(),
+                "cache": self._token_pool.cache_stats() if self._token_pool else None,
+            },
+            "upstreams": self.upstreams.stats(),
+            "admission": self.admission.stats(),
+            "prefix": self.prefixes.stats() if self.prefixes is not None else None,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        })
+
+    async def handle_stages(self, request: web.Request) -> web.Response:
+        """Turn stage timing on or off (``?enabled=0|1``)."""
+        self.stages.enabled = request.query.get("enabled", "1").lower() not in ("0", "false", "off")
+        return web.json_response({"stage_timing": self.stages.enabled})
+
+    def _write_profile(self, job: Callable[[], int] | None) -> None:
+        """Queue the report of a finished capture on the archive writer."""
+        if job is not None and not self.archive.run(job):
+            logger.warning("Archive queue full, profile report dropped")
+
+    async def handle_profile(self, request: web.Request) -> web.Response:
+        """Start a capture (POST ``?kind=cprofile|tracemalloc&requests=N``) or end it early (DELETE)."""
+        if request.method == "DELETE":
+            self._write_profile(self.profiler.finish())
+            return web.json_response(self.profiler.stats())
+        try:
+            requests = int(request.query.get("requests", DEFAULT_PROFILE_REQUESTS))
+        except ValueError:
+            return web.json_response({"error": "requests must be an integer"}, status=400)
+        try:
+            self.profiler.start(request.query.get("kind", PROFILE_KINDS[0]), requests)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        except RuntimeError as e:
+            return web.json_response({"error": str(e)}, status=409)
+        return web.json_response(self.profiler.stats(), status=202)
 
     async def handle_request(self, request: web.Request) -> web.Response:
         """Handle incoming request and forward to upstream."""
+        timer = StreamTimer()
         path = "/" + request.match_info.get("path", "")
         if request.query_string:
             path += "?" + request.query_string
 
-        upstream_base = self.base_url
-        upstream_url = upstream_base + path
-
-        # Read request body
-        body = await request.read()
+        # Large or unsized bodies are relayed as they arrive; small ones are read whole
+        content_length = request.content_length
+        streamed = request.body_exists and (content_length is None or content_length > self.stream_threshold)
 
-        # Parse and count tokens for supported endpoints
-        parsed = self._parse_request(body, path)
-        if body and self.on_request:
-            self.on_request(parsed)
-            self._save_prompt_to_file(parsed)
+        if streamed:
+            event, parsed, cache_key, body, hide_usage = self._new_event(path), None, None, None, False
+        else:
+            body = await request.read()
+            self.stages.record("read_body", time.perf_counter() - timer.start)
+            event, parsed, cache_key, body, hide_usage = self._prepare_request(body, path)
 
         # Forward request to upstream
-        headers = dict(request.headers)
-        headers.pop("Host", None)
-        headers.pop("Content-Length", None)
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in _REQUEST_ONLY_HEADERS}
+        priority = _priority(request.headers.get(PRIORITY_HEADER))
+        model = event.model
 
-        ssl_context = ssl.create_default_context()
-        timestamp = datetime.fromisoformat(parsed["timestamp"])
-        base_filename = timestamp.strftime(f"%Y-%m-%d_%H-%M-%S_{parsed['provider']}")
-        response_filename = self.prompts_dir / f"{base_filename}_chunks.txt"
-        chunks = []
+        assembler = None
+        resp = None
+        status = 502
+        admitted = None
+        served = None
+        cached = None
+        error = None
+        report = None
+        self._inflight_streams.inc()
 
         try:
-            with open(response_filename, "wb") as response_fp:
-                async with aiohttp.ClientSession() as session:
-                    async with session.request(
-                        method=request.method,
-                        url=upstream_url,
-                        headers=headers,
-                        data=body,
-                        ssl=ssl_context,
-                    ) as upstream_response:
-                        resp = web.StreamResponse(status=upstream_response.status)
-                        for k, v in upstream_response.headers.items():
-                            resp.headers[k] = v
-                        await resp.prepare(request)
-
-                        async for chunk in upstream_response.content:
-                            await resp.write(chunk)
-                            response_fp.write(chunk)
-                            chunks.append(chunk.decode("utf8"))
-                        await resp.write_eof()
-                        self._write_response_to_file(parsed, chunks)
-                        return resp
+            if cache_key is not None:
+                started = time.perf_counter()
+                cached = await self.cache.get(cache_key)
+                self.stages.record("cache_lookup", time.perf_counter() - started)
+            if cached is None:
+                started = time.perf_counter()
+                admitted, event.queue_depth = await self.admission.admit(model, priority)
+                if self.admission.limited:
+                    event.admission_wait_s = time.perf_counter() - started
+                    self._admission_wait.observe(event.admission_wait_s)
+                event.provider = admitted.name
+            else:
+                event.provider = self.upstreams.pick(model).name
+
+            # Report only once routed, so the event names its upstream
+            if streamed:
+                body = BodyTee(
+                    request.content,
+                    max_parse_bytes=self.max_parse_bytes,
+                    sink=None if self.store else self._archive_sink(self._archive_path(event, ".json")),
+                    # The dedup store keeps the raw bytes only of bodies it cannot parse
+                    spill=self._archive_spill(self._archive_path(event, "_body.raw")) if self.store else None,
+                )
+                report = self._spawn(self._report_streamed(event, body))
+            elif parsed is not None:
+                # Count tokens in the worker pool while forwarding
+                report = self._spawn(self._report_request(event, *parsed))
+                parsed = None
+            chunks_path = self._archive_path(event, "_chunks.txt")
+            self.archive.write(chunks_path, b"")
+
+            if cached is not None:
+                upstream_response = None
+                status = cached.status
+                response_headers = [*cached.headers, ("X-Tokentap-Cache", "hit")]
+                chunks = _replay(cached.chunks)
+            else:
+                served, upstream_response = await self._open_upstream(
+                    admitted, model, priority, request.method, path, headers, body, timer
+                )
+                self.stages.record("upstream_headers", time.perf_counter() - timer.upstream_start)
+                if timer.connect_s:
+                    self.stages.record("upstream_connect", timer.connect_s)
+                status = upstream_response.status
+                response_headers = upstream_response.headers.items()
+                chunks = upstream_response.content.iter_any()
+            # Record complete, successful responses to deterministic requests
+            record = [] if cache_key is not None and cached is None and status == 200 else None
+            recorded = 0
+
+            async with upstream_response or contextlib.nullcontext():
+                resp = web.StreamResponse(status=status)
+                for k, v in response_headers:
+                    resp.headers[k] = v
+                # The assembler still sees the usage report kept from the client
+                usage_filter = None
+                if hide_usage and "text/event-stream" in resp.headers.get("Content-Type", ""):
+                    usage_filter = UsageReportFilter()
+                    resp.headers.pop("Content-Length", None)
+                try:
+                    await resp.prepare(request)
+                except ConnectionResetError as e:
+                    raise _ClientGone() from e
+                if self.startup["first_byte_s"] is None:
+                    self._startup_done("first_byte_s")
+
+                assembler = ResponseAssembler(resp.headers.get("Content-Type", ""))
+                relay_s = parse_s = 0.0
+                async for chunk in chunks:
+                    started = time.perf_counter()
+                    relayed = usage_filter.feed(chunk) if usage_filter is not None else chunk
+                    try:
+                        if relayed:
+                            await resp.write(relayed)
+                    except ConnectionResetError as e:
+                        raise _ClientGone() from e
+                    self.archive.append(chunks_path, chunk)
+                    relayed = time.perf_counter()
+                    timer.on_chunk(assembler.feed(chunk))
+                    relay_s += relayed - started
+                    parse_s += time.perf_counter() - relayed
+                    if record is not None:
+                        record.append(chunk)
+                        recorded += len(chunk)
+                        if recorded > self.cache.max_entry_bytes:
+                            record = None
+                try:
+                    if usage_filter is not None and (rest := usage_filter.close()):
+                        await resp.write(rest)
+                    await resp.write_eof()
+                except ConnectionResetError as e:
+                    raise _ClientGone() from e
+                timer.on_chunk(assembler.close())
+                self.stages.record("relay", relay_s)
+                self.stages.record("sse_parse", parse_s)
+                self._write_response_to_file(event, assembler)
+                if record is not None:
+                    self._spawn(self.cache.put(cache_key, status, cacheable_headers(upstream_response.headers), record))
+                return resp
+        except AdmissionRejected as e:
+            status = e.status
+            self._admission_rejected_total.inc(1, ("queue_full" if status == 429 else "timeout",))
+            return web.Response(
+                status=status,
+                text=f"Upstream busy: {e.reason}",
+                headers={"Retry-After": "1"},
+            )
+        except _ClientGone:
+            # Not the upstream's fault: its slot is released without an error
+            status = _CLIENT_CLOSED
+            self._client_disconnects_total.inc(1, (event.model,))
+            return self._abort(request, resp)
+        except asyncio.TimeoutError as e:
+            # Before ClientError: aiohttp read timeouts are both
+            status = 504
+            error = e
+            self._upstream_errors_total.inc(1, ("timeout",))
+            if resp is not None and resp.prepared:
+                return self._abort(request, resp)
+            return web.Response(
+                status=504,
+                text="Upstream timeout",
+            )
         except aiohttp.ClientError as e:
+            status = 502
+            error = e
+            self._upstream_errors_total.inc(1, ("error",))
+            if resp is not None and resp.prepared:
+                return self._abort(request, resp)
             return web.Response(
                 status=502,
                 text=f"Upstream error: {e}",
             )
+        finally:
+            timer.finish()
+            self._inflight_streams.dec()
+            if isinstance(body, BodyTee):
+                body.release()
+            if self.profiler.active:
+                self._write_profile(self.profiler.request_finished())
+            if served is not None:
+                self.admission.release(served, model, error or (f"HTTP {status}" if status >= 500 else None))
+            labels = (event.model,)
+            self._requests_total.inc(1, (event.model, str(status)))
+            self._request_duration.observe(timer.end - timer.start, labels)
+            if timer.first_token is not None:
+                self._ttft.observe(timer.first_token - timer.start, labels)
+            if report is None:
+                # Refused before it was routed
+                if parsed is not None:
+                    report = self._spawn(self._report_request(event, *parsed))
+                elif streamed:
+                    report = self._spawn(self._report_unparsed(event))
+            if report is not None:
+                provider = served.name if served is not None else event.provider
+                self._spawn(
+                    self._report_response(event, report, timer, assembler, status, provider, cached is not None)
+                )
+
+    @staticmethod
+    def _abort(request: web.Request, resp: web.StreamResponse) -> web.StreamResponse:
+        """Cut off a response whose headers were already sent.
+
+        The client connection is dropped instead of ending the body, so the
+        client sees the response as truncated rather than complete.
+        """
+        resp.force_close()
+        if request.transport is not None:
+            request.transport.abort()
+        return resp
+
+    async def _open_upstream(
+        self,
+        upstream: Upstream,
+        model: str,
+        priority: int,
+        method: str,
+        path: str,
+        headers: dict,
+        body: bytes | BodyTee,
+        timer: StreamTimer,
+    ) -> tuple[Upstream, aiohttp.ClientResponse]:
+        """Send the request, failing over to other replicas while nothing was received.
+
+        The admitted replica arrives counted as in flight. Returns the
+        replica that answered, still counted, and its response; on failure
+        the admission is released. Only connection failures are retried, so
+        a request that may have reached a model server is never generated
+        twice, and a streamed body only while none of it was consumed. A
+        retry is admitted to the next replica like a new request, so it
+        waits for room there rather than exceeding its limits.
+        """
+        tried = []
+        while True:
+            timer.mark_upstream()
+            try:
+                response = await self._session.request(
+                    method=method,
+                    url=upstream.url + path,
+                    headers=headers,
+                    data=body,
+                    trace_request_ctx=timer,
+                )
+            except _CONNECT_ERRORS as e:
+                tried.append(upstream)
+                if getattr(body, "started", False):
+                    self.admission.release(upstream, model, e)
+                    raise
+                fallback = await self.admission.fail_over(upstream, model, e, priority, tried)
+                if fallback is None:
+                    raise
+                logger.warning("Upstream %s unreachable (%s), retrying on %s", upstream.name, e, fallback.name)
+                self._upstream_retries_total.inc(1, (upstream.name,))
+                upstream = fallback
+            except BaseException as e:
+                self.admission.release(upstream, model, e)
+                raise
+            else:
+                return upstream, response
 
-    def _parse_request(self, body: bytes, path: str) -> None:
-        """Process request body for token counting and logging."""
-        default = {
-            "timestamp": datetime.now().isoformat(),
-            "provider": urlparse(self.base_url).netloc,
-            "path": path,
-        }
+    def _spawn(self, coro) -> asyncio.Task:
+        """Run a coroutine in the background, keeping a reference until it is done."""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def _report_response(
+        self,
+        event: RequestEvent,
+        report: asyncio.Task,
+        timer: StreamTimer,
+        assembler: ResponseAssembler | None,
+        status: int,
+        provider: str,
+        cached: bool = False,
+    ) -> None:
+        """Settle token counts and report response metrics after the request event.
+
+        With usage_source "upstream" the request report hands over the
+        messages it did not count, and the prompt is counted and archived
+        here, from the server's usage if the response reported it.
+        """
+        await asyncio.wait([report])
+        deferred = report.result() if not report.cancelled() and report.exception() is None else None
+        usage = assembler.usage() if assembler is not None else None
+        trusted = usage if self.usage_source == "upstream" else None
+        source = event.usage_source
+        if deferred is not None:
+            messages, body_dict = deferred
+            if trusted is not None:
+                tokens, source = trusted["prompt_tokens"], "upstream"
+            else:
+                tokens, source = await self._count_prompt(event, messages), "local"
+            event = replace(event, tokens=tokens, usage_source=source)
+            self._prompt_tokens_total.inc(tokens, (event.model,))
+            self._track_prefix(event, messages)
+            self._save_prompt_to_file(event, messages, body_dict)
+
+        output_tokens = None
+        text = assembler.output_text() if assembler is not None and trusted is None else ""
+        if trusted is not None:
+            output_tokens = trusted["completion_tokens"]
+        elif text:
+            started = time.perf_counter()
+            try:
+                output_tokens = await self._token_pool.count(
+                    [{"role": "assistant", "content": text}],
+                    self.tokenizers.resolve(event.model),
+                    self.tokenizers.default,
+                )
+                self.stages.record("tokenize_output", time.perf_counter() - started)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Output token counting failed for %s", event.path)
+        elif assembler is not None:
+            output_tokens = timer.deltas
+        if output_tokens:
+            self._completion_tokens_total.inc(output_tokens, (event.model,))
+        if source is not None:
+            self._usage_source_total.inc(1, (source,))
+        if self.on_response:
+            self.on_response(
+                replace(
+                    event,
+                    type="response",
+                    provider=provider,
+                    status=status,
+                    cached=cached,
+                    cached_tokens=usage["cached_tokens"] if usage else None,
+                    usage_source=source,
+                    **timer.summary(output_tokens),
+                )
+            )
+
+    def _prepare_request(
+        self, body: bytes, path: str
+    ) -> tuple[RequestEvent, tuple[list[dict], object] | None, str | None, bytes, bool]:
+        """Parse the body into an event and what its report needs.
+
+        Returns the event; the messages and raw body to count and archive,
+        or None if the body is not a parseable request; the response cache
+        key, if the request is cacheable; the body to forward, which asks
+        for a usage report if include_usage is set; and whether that report
+        was added by the proxy, so it is kept from the client. The messages
+        and raw body are handed to the background report as soon as the
+        request is routed, so they are released once archived rather than
+        living as long as the proxied stream.
+        """
+        started = time.perf_counter()
+        event, messages, body_dict = self._parse_request(body, path)
+        self.stages.record("parse", time.perf_counter() - started)
+        hide_usage = False
+        if self.include_usage and messages is not None and "/v1/messages" not in path:
+            if _request_usage_report(body_dict):
+                body = json.dumps(body_dict, ensure_ascii=False).encode("utf-8", "surrogatepass")
+                hide_usage = True
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(path, body_dict)
+            if cache_key is None:
+                self.cache.bypass()
+        parsed = (messages, body_dict) if messages is not None else None
+        return event, parsed, cache_key, body, hide_usage
+
+    async def _report_request(
+        self, event: RequestEvent, messages: list[dict], body_dict
+    ) -> tuple[list[dict], object] | None:
+        """Count prompt tokens off the loop, then report and archive the request.
+
+        With usage_source "upstream" the request is reported uncounted and the
+        messages and body are returned for the response report to finish.
+        """
+        if self.usage_source == "upstream":
+            if self.on_request:
+                self.on_request(event)
+            return messages, body_dict
+        event.tokens = await self._count_prompt(event, messages)
+        event.usage_source = "local"
+        self._prompt_tokens_total.inc(event.tokens, (event.model,))
+        self._track_prefix(event, messages)
+        if self.on_request:
+            self.on_request(event)
+        self._save_prompt_to_file(event, messages, body_dict)
+        return None
+
+    def _track_prefix(self, event: RequestEvent, messages: list[dict]) -> None:
+        """Fill in how much of the counted prompt repeats an earlier one."""
+        if self.prefixes is None:
+            return
+        tracked = self.prefixes.track(messages, event.model, event.tokens)
+        if tracked is None:
+            return
+        event.prefix_tokens, event.session_id, event.session_reuse = tracked
+        self._prefix_tokens_total.inc(event.prefix_tokens, (event.model, "reused"))
+        self._prefix_tokens_total.inc(event.tokens - event.prefix_tokens, (event.model, "new"))
+        if event.tokens:
+            self._prefix_reuse.observe(event.prefix_tokens / event.tokens, (event.model,))
+
+    async def _count_prompt(self, event: RequestEvent, messages: list[dict]) -> int:
+        """Count prompt tokens in the worker pool, reporting 0 if counting fails."""
+        started = time.perf_counter()
+        try:
+            tokens = await self._token_pool.count(
+                messages, self.tokenizers.resolve(event.model), self.tokenizers.default
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Token counting failed for %s", event.path)
+            return 0
+        self.stages.record("tokenize_prompt", time.perf_counter() - started)
+        return tokens
+
+    def _parse_request(self, body: bytes, path: str) -> tuple[RequestEvent, list[dict] | None, object]:
+        """Parse the request body into a compact event plus the messages and raw body to archive."""
+        event = self._new_event(path)
+        messages, body_dict = self._parse_body(event, body)
+        return event, messages, body_dict
+
+    def _new_event(self, path: str) -> RequestEvent:
+        """Create the event for a request whose body is not parsed yet.
+
+        The provider stays empty until the request is routed, so a request
+        refused by admission control names no replica.
+        """
+        return RequestEvent(
+            request_id=next(self._request_ids),
+            timestamp=datetime.now().isoformat(),
+            provider="",
+            path=path,
+        )
+
+    def _parse_body(self, event: RequestEvent, body: bytes | None) -> tuple[list[dict] | None, object]:
+        """Fill in the event from the body; return the messages and raw body to archive."""
         if not body:
-            return default
+            return None, None
         try:
             body_dict = json.loads(body)
         except (json.JSONDecodeError, UnicodeDecodeError):
-            return default
+            return None, None
 
-        if "/v1/messages" in path:
+        if "/v1/messages" in event.path:
             parsed = parse_anthropic_request(body_dict)
         else:
             parsed = parse_openai_request(body_dict)
 
-        if parsed and self.on_request:
-            tokens = count_tokens(parsed.get("total_text", ""))
-            event = {
-                "timestamp": datetime.now().isoformat(),
-                "provider": urlparse(self.base_url).netloc,
-                "model": parsed.get("model", "unknown"),
-                "tokens": tokens,
-                "messages": parsed.get("messages", []),
-                "raw_body": body_dict,
-                "path": path,
-            }
-            return event
+        messages = parsed.get("messages", [])
+        last_prompt = extract_last_user_message(messages)
+        event.model = parsed.get("model", "unknown")
+        event.message_count = len(messages)
+        event.preview = last_prompt[:PROMPT_PREVIEW_LENGTH]
+        if len(last_prompt) > PROMPT_PREVIEW_LENGTH:
+            event.preview += "..."
+        return messages, body_dict
+
+    async def _report_streamed(self, event: RequestEvent, tee: BodyTee) -> tuple[list[dict], object] | None:
+        """Parse a streamed body once it has been relayed, then report it.
+
+        Parsing runs in a worker thread, since the body may be large. The
+        raw bytes were already archived by the tee for the files format, and
+        for the dedup store if the body was too large to parse; a dedup body
+        that fails to parse is archived raw here.
+        """
+        await tee.finished.wait()
+        started = time.perf_counter()
+
+        def read_and_parse() -> tuple[bytes | None, list[dict] | None, object]:
+            raw = tee.read()
+            return raw, *self._parse_body(event, raw)
+
+        try:
+            raw, messages, body_dict = await asyncio.get_running_loop().run_in_executor(None, read_and_parse)
+        finally:
+            tee.close()
+        self.stages.record("parse", time.perf_counter() - started)
+        if messages is None:
+            if tee.truncated:
+                event.preview = f"[{tee.size:,} byte request body relayed without parsing]"
+            elif self.store and raw is not None:
+                self.archive.write(self._archive_path(event, "_body.raw"), raw)
+            return await self._report_unparsed(event)
+        return await self._report_request(event, messages, body_dict if self.store else None)
+
+    async def _report_unparsed(self, event: RequestEvent) -> None:
+        """Report a request whose body was not parsed."""
+        if self.on_request:
+            self.on_request(event)
+
+    def _archive_sink(self, path: Path) -> Callable[[bytes], bool]:
+        """Return a callback appending relayed body chunks to an archive file."""
+        self.archive.write(path, b"")
+        return lambda chunk: self.archive.append(path, chunk)
+
+    def _archive_spill(self, path: Path) -> Callable[[Payload], bool]:
+        """Return a callback appending body bytes to an archive file created on first use."""
+        return lambda chunk: self.archive.append(path, chunk)
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        """Create the pooled keep-alive session shared by all upstream calls."""
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            keepalive_timeout=self.keepalive_timeout,
+            ssl=self._ssl_context,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_created)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[trace_config])
+
+    @staticmethod
+    async def _on_connection_created(session, context, params) -> None:
+        timer = context.trace_request_ctx
+        if isinstance(timer, StreamTimer) and timer.upstream_start is not None:
+            timer.connect_s = time.perf_counter() - timer.upstream_start
+
+    @staticmethod
+    async def _on_connection_reused(session, context, params) -> None:
+        timer = context.trace_request_ctx
+        if isinstance(timer, StreamTimer):
+            timer.connect_s = 0.0
 
     async def start(self) -> None:
         """Start the proxy server."""
+        self._session = self._create_session()
+        self.upstreams.start(self._session)
+        self._token_pool = TokenCountPool(workers=self.tokenizer_workers, mode=self.tokenizer_mode)
+        self.archive.start()
         self._runner = web.AppRunner(self.app)
         await self._runner.setup()
-        self._site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        self._site = web.TCPSite(self._runner, "127.0.0.1", self.port, reuse_port=self.workers > 1 or None)
         await self._site.start()
+        self._startup_done("listening_s")
+        # Load the encoding now rather than in the middle of the first request
+        self._spawn(self._warm_up_tokenizer())
+
+    async def _warm_up_tokenizer(self) -> None:
+        try:
+            await self._token_pool.warm_up(self.tokenizers.default)
+        except Exception:
+            logger.exception("Tokenizer warm-up failed; the first request will load it")
+            return
+        self._startup_done("tokenizer_s")
+
+    def _startup_done(self, phase: str) -> None:
+        self.startup[phase] = seconds = time.time() - self.launched_at
+        logger.info("Startup: %s %.3f", phase, seconds)
 
     async def stop(self) -> None:
         """Stop the proxy server."""
         if self._runner:
             await self._runner.cleanup()
+        await self.upstreams.stop()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self._token_pool:
+            self._token_pool.close()
+            self._token_pool = None
+        await asyncio.get_running_loop().run_in_executor(None, self.archive.close)
+        if self._session:
+            await self._session.close()
+            self._session = None
     
-    def _write_response_to_file(self, parsed, chunks):
-        timestamp = datetime.fromisoformat(parsed["timestamp"])
-        base_filename = timestamp.strftime(f"%Y-%m-%d_%H-%M-%S_{parsed['provider']}")
-        response_filename = self.prompts_dir / f"{base_filename}_response.json"
-        merged = {
-            "choices": {}
-        }
-        for chunk in chunks:
-            chunk: str
-            if not chunk.startswith("data: "):
-                continue
-            chunk = chunk[len("data: "):]
-            try:
-                chunk = json.loads(chunk)
-            except:
-                continue
-            assert type(chunk) is dict
-            if chunk["object"] != "chat.completion.chunk":
-                # other types are not implemented and could cause undefined behavior
-                return
-            for k,v in chunk.items():
-                if k != "choices":
-                    merged[k] = v
-                    continue
-                for choice in v:
-                    index = choice["index"]
-                    if index not in merged["choices"]:
-                        merged["choices"][index] = {
-                            "role": None,
-                            "content": {},
-                            "finish_reason": None,
-                        }
-                    at_index = merged["choices"][index]
-                    if choice.get("finish_reason", None):
-                        at_index["finish_reason"] = choice["finish_reason"]
-                    if choice.get("logprobs", None):
-                        if "logprobs" not in at_index:
-                            at_index["logprobs"] = []
-                        at_index["logprobs"].append(choice["logprobs"])
-                    if "delta" not in choice:
-                        merged["choices"][index] = at_index
-                        continue
-                    delta = choice["delta"]
-                    if delta.get("role", None):
-                        at_index["role"] = delta["role"]
-                    if "reasoning" in delta:
-                        if "reasoning" not in at_index["content"]:
-                            at_index["content"]["reasoning"] = ""
-                        at_index["content"]["reasoning"] += delta["reasoning"]
-                    if "content" in delta:
-                        if "content" not in at_index["content"]:
-                            at_index["content"]["content"] = ""
-                        at_index["content"]["content"] += delta["content"]
-                    if "tool_calls" in delta:
-                        if "tool_calls" not in at_index:
-                            at_index["tool_calls"] = {}
-                        for tool_call in delta["tool_calls"]:
-                            index = tool_call["index"]
-                            if index not in at_index["tool_calls"]:
-                                at_index["tool_calls"][index] = {"function": {"name": "", "arguments": ""}}
-                            if tool_call["type"] != "function":
-                                at_index["tool_calls"][index] = "unsupported"
-                                merged["choices"][index] = at_index
-                                continue
-                            if "id" in tool_call:
-                                at_index["tool_calls"][index]["id"] = tool_call["id"]
-                            if "function" in tool_call:
-                                for k,v in tool_call["function"].items():
-                                    at_index["tool_calls"][index]["function"][k] += v
-
-                    merged["choices"][index] = at_index
-        with open(response_filename, "w") as f:
-            json.dump(merged, f, indent=2)
-
-
-    def _save_prompt_to_file(self, body: dict) -> None:
-        """Save a prompt to markdown and raw JSON files."""
-        self.prompts_dir.mkdir(parents=True, exist_ok=True)
-
-        timestamp = datetime.fromisoformat(body["timestamp"])
-        base_filename = timestamp.strftime(f"%Y-%m-%d_%H-%M-%S_{body['provider']}")
+    @staticmethod
+    def _archive_name(event: RequestEvent) -> str:
+        """Return the collision-free archive file name stem for a request."""
+        timestamp = datetime.fromisoformat(event.timestamp)
+        return timestamp.strftime(f"%Y-%m-%d_%H-%M-%S-%f_{event.request_id:06d}_{event.provider or 'unrouted'}")
+
+    def _archive_path(self, event: RequestEvent, suffix: str) -> Path:
+        """Return the archive path of a request file."""
+        directory = self.store.requests_dir if self.store else self.prompts_dir
+        return directory / f"{self._archive_name(event)}{suffix}"
+
+    def _write_response_to_file(self, event: RequestEvent, assembler: ResponseAssembler) -> None:
+        """Queue the merged response document for the archive writer."""
+        merged = assembler.result()
+        if merged is None:
+            return
+        if self.store:
+            name = self._archive_name(event)
+            self.archive.run(lambda: self.store.save_response(name, merged))
+            return
+        self.archive.write(self._archive_path(event, "_response.json"), lambda: dump_json(merged))
+
+    def _save_prompt_to_file(self, event: RequestEvent, messages: list[dict], raw_body) -> None:
+        """Queue a prompt for the archive."""
+        if self.store:
+            name = self._archive_name(event)
+            metadata = {
+                "request_id": event.request_id,
+                "timestamp": event.timestamp,
+                "provider": event.provider,
+                "path": event.path,
+                "model": event.model,
+                "tokens": event.tokens,
+            }
+            self.archive.run(lambda: self.store.save_request(name, metadata, raw_body))
+            return
 
         # Save markdown file (human-readable)
-        md_filepath = self.prompts_dir / f"{base_filename}.md"
-        lines = [
-            f"# Prompt - {timestamp.strftime('%Y-%m-%d %H:%M:%S')}",
-            f"**Provider:** {body['provider'].capitalize()}",
-            f"**Model:** {body['model']}",
-            f"**Tokens:** {body['tokens']:,}",
-            "",
-            "## Messages",
-        ]
-
-        for msg in body.get("messages", []):
-            role = msg.get("role", "unknown").capitalize()
-            content = msg.get("content", "")
-            lines.append(f"### {role}")
-            lines.append(content)
-            lines.append("")
-
-        md_filepath.write_text("\n".join(lines))
+        self.archive.write(
+            self._archive_path(event, ".md"),
+            lambda: render_markdown(event.timestamp, event.provider, event.model, event.tokens, messages),
+        )
 
         # Save raw JSON file (original request body)
-        raw_body = body.get("raw_body")
         if raw_body is not None:
-            json_filepath = self.prompts_dir / f"{base_filename}.json"
-            json_filepath.write_text(json.dumps(raw_body, indent=2))
\ No newline at end of file
+            self.archive.write(self._archive_path(event, ".json"), lambda: dump_json(raw_body))
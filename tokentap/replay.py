@@ -0,0 +1,290 @@
+"""Replay archived requests against a model server and measure how it copes."""
+
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator
+
+import aiohttp
+
+from tokentap.archive import ContentStore, dump_json, parse_archive_name
+from tokentap.config import DEFAULT_READ_TIMEOUT, DEFAULT_REPLAY_CONCURRENCY
+from tokentap.sse import ResponseAssembler
+from tokentap.timing import StreamTimer
+
+
+@dataclass(slots=True)
+class ArchivedRequest:
+    """A captured request and when it was originally sent.
+
+    Only what the file name tells is kept; load() reads the body, so a
+    replay holds the bodies of the requests in flight, not the archive.
+    """
+
+    name: str
+    timestamp: datetime
+    source: Path
+    store: ContentStore | None = None
+
+    def load(self) -> tuple[str, dict] | None:
+        """Read the API path and body, or None if the file is gone or does not parse."""
+        path = None
+        try:
+            if self.store is not None:
+                manifest = self.store.load_manifest(self.source)
+                body = self.store.rebuild_body(manifest)
+                path = manifest.get("path")
+            else:
+                body = json.loads(self.source.read_bytes())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(body, dict):
+            return None
+        return (path or guess_path(body)).split("?", 1)[0], body
+
+
+def guess_path(body: dict) -> str:
+    """Return the API path a body was most likely sent to.
+
+    Per-request file archives do not record it; a top-level system prompt
+    only exists in Anthropic's Messages API.
+    """
+    if "messages" not in body and "prompt" in body:
+        return "/v1/completions"
+    if "system" in body or "anthropic_version" in body or "stop_sequences" in body:
+        return "/v1/messages"
+    return "/v1/chat/completions"
+
+
+def iter_archive(prompts_dir: Path) -> Iterator[ArchivedRequest]:
+    """Yield the requests of a prompts directory in either archive format, oldest first.
+
+    Only the directory listing is read here; each body is read when its
+    request is sent.
+    """
+    requests = []
+    store = ContentStore(prompts_dir)
+    for name, path in store.iter_requests():
+        parsed = parse_archive_name(name)
+        if parsed is not None:
+            requests.append(ArchivedRequest(name, datetime.fromisoformat(parsed["timestamp"]), path, store))
+
+    for path in prompts_dir.glob("*.json"):
+        parsed = parse_archive_name(path.stem)
+        if parsed is None or path.stem.endswith("_response"):
+            continue
+        requests.append(ArchivedRequest(path.stem, datetime.fromisoformat(parsed["timestamp"]), path))
+
+    requests.sort(key=lambda request: request.timestamp)
+    yield from requests
+
+
+def _prepare_body(body: dict, path: str, model: str | None, stream: bool | None) -> bytes:
+    body = dict(body)
+    if model is not None:
+        body["model"] = model
+    if stream is not None:
+        body["stream"] = stream
+    if body.get("stream") and path.endswith("/chat/completions"):
+        # Without it OpenAI-style servers report no usage, so decode rates would count events
+        body["stream_options"] = {**(body.get("stream_options") or {}), "include_usage": True}
+    return dump_json(body)
+
+
+def _stats(values: list[float], scale: float = 1.0) -> dict | None:
+    """Return mean, min, max and nearest-rank percentiles of values."""
+    ordered = sorted(value * scale for value in values)
+    if not ordered:
+        return None
+    last = len(ordered) - 1
+    return {
+        "mean": sum(ordered) / len(ordered),
+        "min": ordered[0],
+        **{f"p{q}": ordered[max(0, min(last, round(q / 100 * len(ordered)) - 1))] for q in (50, 90, 99)},
+        "max": ordered[last],
+    }
+
+
+class Replayer:
+    """Sends archived requests to a model server in closed or open loop.
+
+    Closed loop keeps ``concurrency`` requests in flight, each worker sending
+    the next request as soon as its last one finished. Open loop sends on a
+    schedule regardless of responses: ``rate`` requests per second, or the
+    recorded arrival times compressed by ``speedup``. Open loop has no cap
+    on requests in flight; the report shows the peak and how late requests
+    left relative to their schedule.
+    """
+
+    def __init__(
+        self,
+        target: str,
+        concurrency: int = DEFAULT_REPLAY_CONCURRENCY,
+        rate: float | None = None,
+        speedup: float | None = None,
+        model: str | None = None,
+        stream: bool | None = None,
+        path: str | None = None,
+        headers: dict[str, str] | None = None,
+        timeout: float = DEFAULT_READ_TIMEOUT,
+        on_result: Callable[[dict], None] | None = None,
+    ):
+        """Initialize the replayer.
+
+        Args:
+            target: Base URL of the model server
+            concurrency: Requests in flight in closed loop
+            rate: Open loop at this many requests per second
+            speedup: Open loop at the recorded arrival times divided by this factor
+            model: Model name to put in every request instead of the recorded one
+            stream: Force streaming on or off instead of replaying it as recorded
+            path: API path for every request instead of the recorded or guessed one
+            headers: Extra headers sent with every request
+            timeout: Seconds allowed between two reads of a response
+            on_result: Called with the measurements of each finished request
+        """
+        if rate is not None and speedup is not None:
+            raise ValueError("rate and speedup are mutually exclusive")
+        if (rate is not None and rate <= 0) or (speedup is not None and speedup <= 0) or concurrency < 1:
+            raise ValueError("concurrency, rate and speedup must be positive")
+        self.target = target.rstrip("/")
+        self.concurrency = concurrency
+        self.rate = rate
+        self.speedup = speedup
+        self.model = model
+        self.stream = stream
+        self.path = path
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.on_result = on_result
+        self._inflight = 0
+        self._peak_inflight = 0
+
+    @property
+    def mode(self) -> str:
+        return "closed" if self.rate is None and self.speedup is None else "open"
+
+    async def run(self, requests: list[ArchivedRequest]) -> dict:
+        """Replay the requests and return the report."""
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency if self.mode == "closed" else 0)
+        started_at = datetime.now()
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            started = time.perf_counter()
+            if self.mode == "closed":
+                results = await self._closed_loop(session, requests)
+            else:
+                results = await self._open_loop(session, requests, started)
+            wall = time.perf_counter() - started
+        return self._report(results, wall, started_at)
+
+    async def _closed_loop(self, session: aiohttp.ClientSession, requests: list[ArchivedRequest]) -> list[dict]:
+        results = []
+        pending = iter(requests)
+
+        async def worker() -> None:
+            for request in pending:
+                results.append(await self._send(session, request))
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(requests)))))
+        return results
+
+    async def _open_loop(
+        self, session: aiohttp.ClientSession, requests: list[ArchivedRequest], started: float
+    ) -> list[dict]:
+        if self.rate is not None:
+            offsets = [index / self.rate for index in range(len(requests))]
+        else:
+            first = requests[0].timestamp if requests else None
+            offsets = [(request.timestamp - first).total_seconds() / self.speedup for request in requests]
+
+        async def send_at(request: ArchivedRequest, offset: float) -> dict:
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            result = await self._send(session, request)
+            result["lag_s"] = max(0.0, result["sent"] - started - offset)
+            return result
+
+        return await asyncio.gather(*(send_at(request, offset) for request, offset in zip(requests, offsets)))
+
+    async def _send(self, session: aiohttp.ClientSession, request: ArchivedRequest) -> dict:
+        """Read one request body, send it and measure its response."""
+        loaded = await asyncio.get_running_loop().run_in_executor(None, request.load)
+        path = self.path or (loaded[0] if loaded else None)
+        headers = {"Content-Type": "application/json", **self.headers}
+        if path and path.endswith("/messages"):
+            headers.setdefault("anthropic-version", "2023-06-01")
+        body = _prepare_body(loaded[1], path, self.model, self.stream) if loaded else None
+        result = {"name": request.name, "path": path, "status": None, "error": None}
+        self._inflight += 1
+        self._peak_inflight = max(self._peak_inflight, self._inflight)
+        timer = StreamTimer()
+        result["sent"] = timer.start
+        assembler = None
+        try:
+            if body is None:
+                result["error"] = "UnreadableBody"
+            else:
+                async with session.post(self.target + path, data=body, headers=headers) as response:
+                    result["status"] = response.status
+                    assembler = ResponseAssembler(response.headers.get("Content-Type", ""))
+                    async for chunk in response.content.iter_any():
+                        timer.on_chunk(assembler.feed(chunk))
+                    timer.on_chunk(assembler.close())
+                if response.status != 200:
+                    result["error"] = f"HTTP {response.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            result["error"] = type(e).__name__
+        finally:
+            self._inflight -= 1
+        timer.finish()
+
+        usage = assembler.usage() if assembler is not None else None
+        output_tokens = usage["completion_tokens"] if usage else (timer.deltas or None)
+        timings = timer.summary(output_tokens)
+        result.update(
+            ttft_s=timings["ttft_s"],
+            duration_s=timings["duration_s"],
+            prompt_tokens=usage["prompt_tokens"] if usage else None,
+            output_tokens=output_tokens,
+            decode_tokens_per_s=timings["tokens_per_s"],
+        )
+        if self.on_result:
+            self.on_result(result)
+        return result
+
+    def _report(self, results: list[dict], wall: float, started_at: datetime) -> dict:
+        ok = [result for result in results if result["error"] is None]
+        errors: dict[str, int] = {}
+        for result in results:
+            if result["error"] is not None:
+                errors[result["error"]] = errors.get(result["error"], 0) + 1
+        output_tokens = sum(result["output_tokens"] or 0 for result in ok)
+        for result in results:
+            result.pop("sent", None)
+        return {
+            "started": started_at.isoformat(),
+            "target": self.target,
+            "mode": self.mode,
+            "concurrency": self.concurrency if self.mode == "closed" else None,
+            "rate": self.rate,
+            "speedup": self.speedup,
+            "model": self.model,
+            "requests": len(results),
+            "succeeded": len(ok),
+            "errors": errors,
+            "wall_s": wall,
+            "throughput_rps": len(ok) / wall if wall else 0.0,
+            "output_tokens": output_tokens,
+            "output_tokens_per_s": output_tokens / wall if wall else 0.0,
+            "peak_inflight": self._peak_inflight,
+            "ttft_ms": _stats([r["ttft_s"] for r in ok if r["ttft_s"] is not None], 1000),
+            "duration_ms": _stats([r["duration_s"] for r in ok], 1000),
+            "decode_tokens_per_s": _stats([r["decode_tokens_per_s"] for r in ok if r["decode_tokens_per_s"]]),
+            "schedule_lag_ms": _stats([r["lag_s"] for r in results if "lag_s" in r], 1000),
+            "results": results,
+        }
@@ -0,0 +1,360 @@
+"""Incremental parsing and merging of streamed LLM responses."""
+
+import codecs
+import json
+import re
+
+from tokentap.config import MAX_RESPONSE_BODY_BYTES
+
+_LINE_END = re.compile(r"\r\n|\r|\n")
+
+
+class SSEDecoder:
+    """Incremental Server-Sent Events parser.
+
+    Accepts arbitrary byte chunks, so frames and UTF-8 sequences split across
+    network reads are reassembled before they are dispatched.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial: list[str] = []
+        self._skip_lf = False
+        self._event = ""
+        self._data: list[str] = []
+
+    def feed(self, chunk: bytes) -> list[tuple[str, str]]:
+        """Feed raw bytes and return the completed (event, data) pairs."""
+        return self._feed_text(self._decoder.decode(chunk))
+
+    def close(self) -> list[tuple[str, str]]:
+        """Flush buffered input at the end of the stream."""
+        events = self._feed_text(self._decoder.decode(b"", final=True))
+        if self._partial:
+            self._process_line("".join(self._partial), events)
+            self._partial = []
+        self._process_line("", events)
+        return events
+
+    def _feed_text(self, text: str) -> list[tuple[str, str]]:
+        events: list[tuple[str, str]] = []
+        if not text:
+            # An empty read must not forget a pending "\r"
+            return events
+        if self._skip_lf and text.startswith("\n"):
+            text = text[1:]
+        self._skip_lf = False
+        pos = 0
+        for match in _LINE_END.finditer(text):
+            self._partial.append(text[pos:match.start()])
+            self._process_line("".join(self._partial), events)
+            self._partial = []
+            pos = match.end()
+        if pos < len(text):
+            self._partial.append(text[pos:])
+        elif text.endswith("\r"):
+            # The "\n" of a "\r\n" pair may arrive with the next chunk
+            self._skip_lf = True
+        return events
+
+    def _process_line(self, line: str, events: list[tuple[str, str]]) -> None:
+        if not line:
+            if self._data:
+                events.append((self._event or "message", "\n".join(self._data)))
+            self._event = ""
+            self._data = []
+            return
+        if line.startswith(":"):
+            return
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._event = value
+
+
+# The blank line closing an event, and what makes an OpenAI chunk a usage report
+_EVENT_END = re.compile(rb"\r\n\r\n|\n\n|\r\r")
+_EMPTY_CHOICES = re.compile(rb'"choices"\s*:\s*\[\s*\]')
+
+
+class UsageReportFilter:
+    """Removes the usage report from an OpenAI stream on its way to the client.
+
+    Used when the proxy added stream_options.include_usage itself: the
+    final chunk with ``choices: []`` is meant for the proxy, and a client
+    that did not ask for it may not expect a chunk without choices. Complete
+    events are passed on as soon as their blank line arrives; only an event
+    still being received is held back.
+    """
+
+    def __init__(self):
+        self._pending = b""
+        self.removed = 0
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Consume a network chunk and return the bytes to relay."""
+        data = self._pending + chunk if self._pending else chunk
+        relayed = []
+        start = 0
+        for match in _EVENT_END.finditer(data):
+            event = data[start:match.end()]
+            if self._is_usage_report(event):
+                self.removed += 1
+            else:
+                relayed.append(event)
+            start = match.end()
+        self._pending = data[start:]
+        return b"".join(relayed)
+
+    def close(self) -> bytes:
+        """Return what is left of an unterminated final event."""
+        rest, self._pending = self._pending, b""
+        return b"" if self._is_usage_report(rest) else rest
+
+    @staticmethod
+    def _is_usage_report(event: bytes) -> bool:
+        if not _EMPTY_CHOICES.search(event):
+            return False
+        data = [line[5:].removeprefix(b" ") for line in re.split(rb"\r\n|\r|\n", event) if line.startswith(b"data:")]
+        try:
+            payload = json.loads(b"\n".join(data))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return False
+        return isinstance(payload, dict) and payload.get("choices") == [] and isinstance(payload.get("usage"), dict)
+
+
+class ResponseAssembler:
+    """Builds the merged response document while the response streams in.
+
+    Handles OpenAI ``chat.completion.chunk`` streams, Anthropic Messages
+    event streams and plain (non-streamed) JSON bodies. Only the merged state
+    is kept, never the raw transcript.
+    """
+
+    def __init__(self, content_type: str = "", max_body_bytes: int = MAX_RESPONSE_BODY_BYTES):
+        self.streaming = "text/event-stream" in content_type
+        self.max_body_bytes = max_body_bytes
+        self.kind: str | None = None
+        self.events = 0
+        self._sse = SSEDecoder() if self.streaming else None
+        self._body = bytearray()
+        self._truncated = False
+        self._openai: dict = {"choices": {}}
+        self._anthropic: dict = {}
+        self._blocks: dict[int, dict] = {}
+        self._result: dict | None = None
+
+    def feed(self, chunk: bytes) -> int:
+        """Consume a network chunk. Returns the number of content deltas seen."""
+        if self._sse is None:
+            if len(self._body) + len(chunk) <= self.max_body_bytes:
+                self._body += chunk
+            else:
+                self._truncated = True
+            return 0
+        deltas = 0
+        for event, data in self._sse.feed(chunk):
+            deltas += self._handle_event(event, data)
+        return deltas
+
+    def close(self) -> int:
+        """Finish parsing. Returns the number of content deltas still buffered."""
+        if self._sse is None:
+            if self._body and not self._truncated:
+                try:
+                    self._result = json.loads(self._body)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    self._result = None
+            self._body = bytearray()
+            return 0
+        deltas = 0
+        for event, data in self._sse.close():
+            deltas += self._handle_event(event, data)
+        return deltas
+
+    def result(self) -> dict | None:
+        """Return the merged response document, if anything could be parsed."""
+        if self._sse is None:
+            return self._result if isinstance(self._result, dict) else None
+        if self.kind == "openai":
+            return self._openai
+        if self.kind == "anthropic":
+            message = dict(self._anthropic)
+            message["content"] = [self._blocks[index] for index in sorted(self._blocks)]
+            return message
+        return None
+
+    def usage(self) -> dict | None:
+        """Return the token usage the server reported, or None if it is missing.
+
+        OpenAI-style ``prompt_tokens``/``completion_tokens`` and Anthropic
+        ``input_tokens``/``output_tokens`` are normalized to prompt_tokens,
+        completion_tokens and cached_tokens (prompt tokens served from the
+        server's prefix cache, if reported). Anthropic reports cache reads
+        and writes separately from input_tokens; they count as prompt tokens.
+        """
+        result = self.result()
+        usage = result.get("usage") if result else None
+        if not isinstance(usage, dict):
+            return None
+        if "prompt_tokens" in usage:
+            prompt = usage.get("prompt_tokens")
+            completion = usage.get("completion_tokens")
+            cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        else:
+            cached = usage.get("cache_read_input_tokens")
+            prompt = usage.get("input_tokens")
+            if isinstance(prompt, int):
+                prompt += (cached or 0) + (usage.get("cache_creation_input_tokens") or 0)
+            completion = usage.get("output_tokens")
+        if not isinstance(prompt, int) or not isinstance(completion, int):
+            return None
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "cached_tokens": cached if isinstance(cached, int) else None,
+        }
+
+    def output_text(self) -> str:
+        """Return the generated text, reasoning and tool arguments for token counting."""
+        result = self.result()
+        if not result:
+            return ""
+        texts = []
+        if isinstance(result.get("choices"), dict):
+            for choice in result["choices"].values():
+                texts.extend(choice["content"].values())
+                for call in (choice.get("tool_calls") or {}).values():
+                    if isinstance(call, dict):
+                        texts.extend(call["function"].values())
+        elif isinstance(result.get("choices"), list):
+            for choice in result["choices"]:
+                message = choice.get("message") or {}
+                texts.append(message.get("reasoning_content") or message.get("reasoning") or "")
+                texts.append(message.get("content") or "")
+                for call in message.get("tool_calls") or []:
+                    texts.extend((call.get("function") or {}).values())
+        elif isinstance(result.get("content"), list):
+            for block in result["content"]:
+                for field in ("text", "thinking", "partial_json"):
+                    texts.append(block.get(field) or "")
+                if block.get("type") == "tool_use" and "input" in block:
+                    texts.append(json.dumps(block["input"]))
+        return "\n".join(text for text in texts if isinstance(text, str) and text)
+
+    def _handle_event(self, event: str, data: str) -> int:
+        if data == "[DONE]":
+            return 0
+        try:
+            payload = json.loads(data)
+        except json.JSONDecodeError:
+            return 0
+        if not isinstance(payload, dict):
+            return 0
+        self.events += 1
+        if payload.get("object") == "chat.completion.chunk":
+            self.kind = "openai"
+            return self._merge_openai(payload)
+        event_type = payload.get("type", event)
+        if event_type in _ANTHROPIC_EVENTS:
+            self.kind = "anthropic"
+            return self._merge_anthropic(event_type, payload)
+        return 0
+
+    def _merge_openai(self, chunk: dict) -> int:
+        deltas = 0
+        merged = self._openai
+        for key, value in chunk.items():
+            if key != "choices":
+                # With include_usage every chunk carries "usage": null until the last
+                if key != "usage" or value is not None:
+                    merged[key] = value
+                continue
+            for choice in value or []:
+                index = choice.get("index", 0)
+                at_index = merged["choices"].setdefault(
+                    index, {"role": None, "content": {}, "finish_reason": None}
+                )
+                if choice.get("finish_reason"):
+                    at_index["finish_reason"] = choice["finish_reason"]
+                if choice.get("logprobs"):
+                    at_index.setdefault("logprobs", []).append(choice["logprobs"])
+                delta = choice.get("delta")
+                if not delta:
+                    continue
+                if delta.get("role"):
+                    at_index["role"] = delta["role"]
+                for field in ("reasoning", "reasoning_content", "content"):
+                    if delta.get(field):
+                        content = at_index["content"]
+                        content[field] = content.get(field, "") + delta[field]
+                        deltas += 1
+                for tool_call in delta.get("tool_calls") or []:
+                    calls = at_index.setdefault("tool_calls", {})
+                    call_index = tool_call.get("index", 0)
+                    call = calls.setdefault(call_index, {"function": {"name": "", "arguments": ""}})
+                    if tool_call.get("type", "function") != "function":
+                        calls[call_index] = "unsupported"
+                        continue
+                    if call == "unsupported":
+                        continue
+                    if tool_call.get("id"):
+                        call["id"] = tool_call["id"]
+                    for name, part in (tool_call.get("function") or {}).items():
+                        if part:
+                            call["function"][name] = call["function"].get(name, "") + part
+                    deltas += 1
+        return deltas
+
+    def _merge_anthropic(self, event_type: str, payload: dict) -> int:
+        if event_type == "message_start":
+            self._anthropic = dict(payload.get("message") or {})
+            self._blocks = {}
+        elif event_type == "content_block_start":
+            self._blocks[payload.get("index", 0)] = dict(payload.get("content_block") or {})
+        elif event_type == "content_block_delta":
+            block = self._blocks.setdefault(payload.get("index", 0), {})
+            delta = payload.get("delta") or {}
+            delta_type = delta.get("type")
+            if delta_type == "text_delta":
+                block["text"] = block.get("text", "") + delta.get("text", "")
+            elif delta_type == "thinking_delta":
+                block["thinking"] = block.get("thinking", "") + delta.get("thinking", "")
+            elif delta_type == "input_json_delta":
+                block["partial_json"] = block.get("partial_json", "") + delta.get("partial_json", "")
+            elif delta_type == "signature_delta":
+                block["signature"] = delta.get("signature", "")
+            elif delta_type == "citations_delta":
+                block.setdefault("citations", []).append(delta.get("citation"))
+            return 1
+        elif event_type == "content_block_stop":
+            block = self._blocks.get(payload.get("index", 0))
+            if block and "partial_json" in block:
+                partial = block.pop("partial_json")
+                try:
+                    block["input"] = json.loads(partial) if partial else {}
+                except json.JSONDecodeError:
+                    block["input"] = partial
+        elif event_type == "message_delta":
+            self._anthropic.update(payload.get("delta") or {})
+            if payload.get("usage"):
+                usage = dict(self._anthropic.get("usage") or {})
+                usage.update(payload["usage"])
+                self._anthropic["usage"] = usage
+        elif event_type == "error":
+            self._anthropic["error"] = payload.get("error")
+        return 0
+
+
+_ANTHROPIC_EVENTS = {
+    "message_start",
+    "content_block_start",
+    "content_block_delta",
+    "content_block_stop",
+    "message_delta",
+    "message_stop",
+    "error",
+}
@@ -0,0 +1,356 @@
+"""Indexed SQLite store of per-request metadata for fast history queries."""
+
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from tokentap.config import STORE_FILENAME, STORE_FLUSH_INTERVAL, STORE_MAX_BATCH
+from tokentap.events import RequestEvent, Subscription
+
+# Event fields kept per request, in table column order
+COLUMNS = (
+    "timestamp",
+    "request_id",
+    "provider",
+    "path",
+    "model",
+    "status",
+    "prompt_tokens",
+    "completion_tokens",
+    "message_count",
+    "queue_s",
+    "connect_s",
+    "ttfb_s",
+    "ttft_s",
+    "gap_mean_s",
+    "gap_max_s",
+    "duration_s",
+    "tokens_per_s",
+    "cached_tokens",
+    "usage_source",
+    "queue_depth",
+    "admission_wait_s",
+    "prefix_tokens",
+    "session_id",
+)
+
+GROUP_BY = {
+    "model": "model",
+    "day": "substr(timestamp, 1, 10)",
+    "provider": "provider",
+    "path": "path",
+    "session": "session_id",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    request_id INTEGER NOT NULL,
+    provider TEXT NOT NULL DEFAULT '',
+    path TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL DEFAULT 'unknown',
+    status INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    message_count INTEGER,
+    queue_s REAL,
+    connect_s REAL,
+    ttfb_s REAL,
+    ttft_s REAL,
+    gap_mean_s REAL,
+    gap_max_s REAL,
+    duration_s REAL,
+    tokens_per_s REAL,
+    cached_tokens INTEGER,
+    usage_source TEXT,
+    queue_depth INTEGER,
+    admission_wait_s REAL,
+    prefix_tokens INTEGER,
+    session_id TEXT,
+    UNIQUE (timestamp, request_id)
+);
+"""
+
+# Columns added after the table was introduced, created on databases that lack them
+_ADDED_COLUMNS = {
+    "cached_tokens": "INTEGER",
+    "usage_source": "TEXT",
+    "queue_depth": "INTEGER",
+    "admission_wait_s": "REAL",
+    "prefix_tokens": "INTEGER",
+    "session_id": "TEXT",
+}
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS requests_timestamp ON requests (timestamp);
+CREATE INDEX IF NOT EXISTS requests_model ON requests (model, timestamp);
+CREATE INDEX IF NOT EXISTS requests_duration ON requests (duration_s);
+"""
+
+# A response row fills in what the request row left empty, and vice versa
+_UPSERT = (
+    f"INSERT INTO requests ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)}) "
+    "ON CONFLICT (timestamp, request_id) DO UPDATE SET "
+    + ", ".join(f"{column} = coalesce(excluded.{column}, {column})" for column in COLUMNS[2:])
+)
+
+# Imported rows never override what the proxy recorded live
+_INSERT_NEW = (
+    f"INSERT INTO requests ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)}) "
+    "ON CONFLICT (timestamp, request_id) DO NOTHING"
+)
+
+_MARKDOWN_TOKENS = re.compile(rb"^\*\*Tokens:\*\* ([\d,]+)", re.MULTILINE)
+
+
+def store_path(prompts_dir: Path) -> Path:
+    """Return the location of the session store for a prompts directory."""
+    return prompts_dir / STORE_FILENAME
+
+
+def event_row(event: RequestEvent) -> tuple:
+    """Convert an event into a row in COLUMNS order."""
+    return (
+        event.timestamp,
+        event.request_id,
+        event.provider,
+        event.path,
+        event.model,
+        event.status,
+        event.tokens,
+        event.output_tokens,
+        event.message_count,
+        event.queue_s,
+        event.connect_s,
+        event.ttfb_s,
+        event.ttft_s,
+        event.gap_mean_s,
+        event.gap_max_s,
+        event.duration_s,
+        event.tokens_per_s,
+        event.cached_tokens,
+        event.usage_source,
+        event.queue_depth,
+        event.admission_wait_s,
+        event.prefix_tokens,
+        event.session_id,
+    )
+
+
+def _completion_tokens(response: dict | None) -> int | None:
+    """Return the output token count reported in a response's usage block."""
+    usage = (response or {}).get("usage")
+    if not isinstance(usage, dict):
+        return None
+    return usage.get("completion_tokens", usage.get("output_tokens"))
+
+
+class SessionStore:
+    """Per-request metadata in a SQLite database in WAL mode.
+
+    A connection belongs to the thread that opened the store, so the proxy
+    records through a StoreRecorder thread and queries open their own store.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(requests)")}
+        for column, kind in _ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE requests ADD COLUMN {column} {kind}")
+        self._conn.executescript(_INDEXES)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self._conn.close()
+
+    def insert_rows(self, rows: list[tuple], merge: bool = True) -> None:
+        """Insert rows in a single transaction.
+
+        Args:
+            rows: Rows in COLUMNS order
+            merge: Fill in existing rows for the same request instead of skipping them
+        """
+        if not rows:
+            return
+        with self._conn:
+            self._conn.executemany(_UPSERT if merge else _INSERT_NEW, rows)
+
+    def insert_events(self, events: list[RequestEvent]) -> None:
+        """Insert or merge a batch of request and response events."""
+        self.insert_rows([event_row(event) for event in events])
+
+    def summary(self, group_by: str = "model", since: str | None = None) -> list[dict]:
+        """Aggregate requests, tokens and latency per group.
+
+        Args:
+            group_by: One of GROUP_BY ("model", "day", "provider", "path", "session")
+            since: Only include requests at or after this ISO timestamp
+        """
+        key = GROUP_BY[group_by]
+        query = (
+            f"SELECT {key} AS key, count(*) AS requests,"
+            " coalesce(sum(prompt_tokens), 0) AS prompt_tokens,"
+            " coalesce(sum(completion_tokens), 0) AS completion_tokens,"
+            " sum(prefix_tokens) * 1.0 / sum(CASE WHEN prefix_tokens IS NOT NULL THEN prompt_tokens END) AS reuse,"
+            " avg(ttft_s) AS ttft_s, avg(duration_s) AS duration_s, max(duration_s) AS max_duration_s"
+            " FROM requests WHERE timestamp >= ? GROUP BY key ORDER BY key"
+        )
+        return self._query(query, (since or "",))
+
+    def slowest(self, limit: int = 10, since: str | None = None) -> list[dict]:
+        """Return the requests with the longest total duration."""
+        query = (
+            f"SELECT {', '.join(COLUMNS)} FROM requests"
+            " WHERE duration_s IS NOT NULL AND timestamp >= ?"
+            " ORDER BY duration_s DESC LIMIT ?"
+        )
+        return self._query(query, (since or "", limit))
+
+    def _query(self, query: str, params: tuple) -> list[dict]:
+        cursor = self._conn.execute(query, params)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def import_prompts(self, prompts_dir: Path) -> int:
+        """Index an existing prompts directory in either archive format.
+
+        Token counts come from what was recorded at capture time (the
+        markdown header or the dedup manifest), so nothing is re-tokenized.
+        Importing the same directory twice is harmless. Returns the number
+        of requests found.
+        """
+        from tokentap.archive import ContentStore, parse_archive_name
+
+        rows = []
+        store = ContentStore(prompts_dir)
+        for name, manifest in store.iter_manifests():
+            body = manifest.get("body")
+            rows.append(self._archive_row(
+                manifest.get("timestamp"),
+                manifest.get("request_id", 0),
+                manifest.get("provider", ""),
+                manifest.get("path", ""),
+                manifest.get("model", "unknown"),
+                manifest.get("tokens"),
+                _completion_tokens(store.load_response(name)),
+                len((manifest.get("refs") or {}).get("messages") or []) or len((body or {}).get("messages") or []),
+            ))
+
+        for path in sorted(prompts_dir.glob("*.json")):
+            name = parse_archive_name(path.stem)
+            if name is None or path.stem.endswith("_response"):
+                continue
+            try:
+                body = json.loads(path.read_bytes())
+            except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            tokens = None
+            markdown = path.with_suffix(".md")
+            if markdown.exists():
+                found = _MARKDOWN_TOKENS.search(markdown.read_bytes())
+                tokens = int(found[1].replace(b",", b"")) if found else None
+            response = None
+            response_path = path.with_name(f"{path.stem}_response.json")
+            if response_path.exists():
+                try:
+                    response = json.loads(response_path.read_bytes())
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    response = None
+            body = body if isinstance(body, dict) else {}
+            rows.append(self._archive_row(
+                name["timestamp"],
+                name["request_id"],
+                name["provider"],
+                "",
+                body.get("model", "unknown"),
+                tokens,
+                _completion_tokens(response),
+                len(body.get("messages") or []),
+            ))
+
+        rows = [row for row in rows if row[0]]
+        self.insert_rows(rows, merge=False)
+        return len(rows)
+
+    @staticmethod
+    def _archive_row(timestamp, request_id, provider, path, model, tokens, completion_tokens, message_count) -> tuple:
+        row = dict.fromkeys(COLUMNS)
+        row.update(
+            timestamp=timestamp,
+            request_id=request_id,
+            provider=provider,
+            path=path,
+            model=model,
+            prompt_tokens=tokens,
+            completion_tokens=completion_tokens,
+            message_count=message_count,
+        )
+        return tuple(row.values())
+
+
+class StoreRecorder:
+    """Records events from a channel subscription into the session store.
+
+    Runs on its own thread and writes one transaction per batch of events,
+    so the proxy never waits for SQLite.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        events: Subscription,
+        flush_interval: float = STORE_FLUSH_INTERVAL,
+        max_batch: int = STORE_MAX_BATCH,
+    ):
+        self.path = path
+        self.events = events
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.recorded = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Start the recorder thread."""
+        self._thread = threading.Thread(target=self._run, name="tokentap-store", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float | None = 10) -> None:
+        """Record outstanding events and stop the recorder thread."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self.events.close()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        store = SessionStore(self.path)
+        try:
+            while True:
+                stopping = self._stop.is_set()
+                batch = self.events.wait(self.flush_interval, self.max_batch)
+                if batch:
+                    try:
+                        store.insert_events(batch)
+                        self.recorded += len(batch)
+                    except sqlite3.Error:
+                        self.errors += 1
+                elif stopping:
+                    break
+        finally:
+            store.close()
+
+    def stats(self) -> dict:
+        """Return recorded and failed batch counters."""
+        return {"recorded": self.recorded, "errors": self.errors}
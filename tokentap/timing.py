@@ -0,0 +1,84 @@
+"""Per-request latency measurement for proxied calls."""
+
+import time
+
+
+class StreamTimer:
+    """Tracks queueing, connect, first byte/token and inter-token timings.
+
+    All offsets are measured from the moment the proxy received the request.
+    """
+
+    __slots__ = (
+        "start",
+        "upstream_start",
+        "connect_s",
+        "first_byte",
+        "first_token",
+        "last_token",
+        "gap_sum",
+        "gap_max",
+        "gap_count",
+        "deltas",
+        "end",
+    )
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.upstream_start: float | None = None
+        self.connect_s: float | None = None
+        self.first_byte: float | None = None
+        self.first_token: float | None = None
+        self.last_token: float | None = None
+        self.gap_sum = 0.0
+        self.gap_max = 0.0
+        self.gap_count = 0
+        self.deltas = 0
+        self.end: float | None = None
+
+    def mark_upstream(self) -> None:
+        """Record that the request is being sent upstream."""
+        self.upstream_start = time.perf_counter()
+
+    def on_chunk(self, deltas: int) -> None:
+        """Record a relayed chunk carrying the given number of content deltas."""
+        now = time.perf_counter()
+        if self.first_byte is None:
+            self.first_byte = now
+        if not deltas:
+            return
+        self.deltas += deltas
+        if self.first_token is None:
+            self.first_token = now
+        else:
+            gap = now - self.last_token
+            self.gap_sum += gap
+            self.gap_count += 1
+            if gap > self.gap_max:
+                self.gap_max = gap
+        self.last_token = now
+
+    def finish(self) -> None:
+        """Record the end of the response."""
+        self.end = time.perf_counter()
+
+    def _offset(self, mark: float | None) -> float | None:
+        return None if mark is None else mark - self.start
+
+    def summary(self, output_tokens: int | None = None) -> dict:
+        """Return the timings as event fields, in seconds."""
+        end = self.end if self.end is not None else time.perf_counter()
+        tokens_per_s = None
+        if output_tokens and self.first_token is not None and end > self.first_token:
+            tokens_per_s = output_tokens / (end - self.first_token)
+        return {
+            "queue_s": self._offset(self.upstream_start),
+            "connect_s": self.connect_s,
+            "ttfb_s": self._offset(self.first_byte),
+            "ttft_s": self._offset(self.first_token),
+            "gap_mean_s": self.gap_sum / self.gap_count if self.gap_count else None,
+            "gap_max_s": self.gap_max if self.gap_count else None,
+            "duration_s": end - self.start,
+            "output_tokens": output_tokens,
+            "tokens_per_s": tokens_per_s,
+        }
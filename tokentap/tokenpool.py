@@ -0,0 +1,161 @@
+"""Worker pool that keeps token counting off the asyncio event loop."""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from tokentap.config import (
+    DEFAULT_TOKENIZER,
+    DEFAULT_TOKENIZER_MODE,
+    DEFAULT_TOKENIZER_WORKERS,
+    TOKENIZER_BATCH_WINDOW,
+    TOKENIZER_MAX_BATCH,
+)
+from tokentap.parser import count_message_tokens_batch, token_cache_stats, warm_up
+
+TOKENIZER_MODES = ("thread", "process")
+
+# Where prompt and completion token counts come from
+USAGE_SOURCES = ("local", "upstream")
+
+_CACHE_COUNTERS = ("hits", "misses", "evictions", "entries", "bytes")
+
+
+def _count_batch_reporting(
+    conversations: list[list[dict]], tokenizer: str, fallback: str
+) -> tuple[list[int], int, dict]:
+    """Count a batch in a worker process and return its token count cache stats with the counts."""
+    return count_message_tokens_batch(conversations, tokenizer, fallback), os.getpid(), token_cache_stats()
+
+
+class TokenCountPool:
+    """Counts message tokens in a thread or process pool.
+
+    Requests arriving within a short window are batched into one executor
+    call per tokenizer so they are encoded together. In process mode every
+    worker keeps its own token count cache and loaded encoders; each batch
+    brings back its worker's cache stats, which cache_stats() adds up.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_TOKENIZER_WORKERS,
+        mode: str = DEFAULT_TOKENIZER_MODE,
+        batch_window: float = TOKENIZER_BATCH_WINDOW,
+        max_batch: int = TOKENIZER_MAX_BATCH,
+    ):
+        if mode == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tokentap-tokenizer")
+        elif mode == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError(f"Unknown tokenizer mode: {mode!r}")
+        self.mode = mode
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.requests = 0
+        self._pending: list[tuple[list[dict], str, str, asyncio.Future]] = []
+        # Latest token count cache stats of each worker process, by pid
+        self._process_cache_stats: dict[int, dict] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+    async def count(
+        self, messages: list[dict], tokenizer: str = DEFAULT_TOKENIZER, fallback: str = DEFAULT_TOKENIZER
+    ) -> int:
+        """Count tokens of a parsed message list without blocking the loop.
+
+        Args:
+            messages: Parsed messages
+            tokenizer: Tokenizer spec to count with
+            fallback: Spec to count with if tokenizer cannot be loaded
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((messages, tokenizer, fallback, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Submit all pending requests to the executor, one batch per tokenizer."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        batches: dict[tuple[str, str], list[tuple[list[dict], asyncio.Future]]] = {}
+        for messages, tokenizer, fallback, future in pending:
+            batches.setdefault((tokenizer, fallback), []).append((messages, future))
+        loop = asyncio.get_running_loop()
+        count = _count_batch_reporting if self.mode == "process" else count_message_tokens_batch
+        for (tokenizer, fallback), batch in batches.items():
+            self.batches += 1
+            self.requests += len(batch)
+            work = loop.run_in_executor(self._executor, count, [messages for messages, _ in batch], tokenizer, fallback)
+            work.add_done_callback(lambda done, batch=batch: self._deliver(batch, done))
+
+    def _deliver(self, batch: list[tuple[list[dict], asyncio.Future]], work: asyncio.Future) -> None:
+        """Resolve the per-request futures of a finished batch."""
+        if work.cancelled():
+            for _, future in batch:
+                future.cancel()
+            return
+        error = work.exception()
+        if error is not None:
+            results = [None] * len(batch)
+        elif self.mode == "process":
+            results, pid, self._process_cache_stats[pid] = work.result()
+        else:
+            results = work.result()
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def warm_up(self, tokenizer: str = DEFAULT_TOKENIZER) -> asyncio.Future:
+        """Load a tokenizer in the workers in the background.
+
+        Threads share one encoder; in process mode every worker is asked, so
+        each loads its own copy before the first request needs it.
+        """
+        loop = asyncio.get_running_loop()
+        calls = self.workers if self.mode == "process" else 1
+        return asyncio.gather(*(loop.run_in_executor(self._executor, warm_up, tokenizer) for _ in range(calls)))
+
+    def stats(self) -> dict:
+        """Return batching statistics."""
+        return {
+            "mode": self.mode,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "requests": self.requests,
+        }
+
+    def cache_stats(self) -> dict:
+        """Return the token count cache statistics, summed over the worker processes in process mode.
+
+        A worker's numbers are as of its last batch.
+        """
+        if self.mode == "thread":
+            return token_cache_stats()
+        workers = self._process_cache_stats.values()
+        stats = {key: sum(worker[key] for worker in workers) for key in _CACHE_COUNTERS}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def close(self) -> None:
+        """Shut down the worker pool."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for *_, future in self._pending:
+            future.cancel()
+        self._pending = []
+        self._executor.shutdown(wait=False, cancel_futures=True)
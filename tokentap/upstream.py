@@ -0,0 +1,178 @@
+"""Upstream replicas with load-aware routing and background health checks."""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+from tokentap.config import (
+    DEFAULT_HEALTH_PATH,
+    DEFAULT_ROUTING,
+    UPSTREAM_EJECT_AFTER,
+    UPSTREAM_HEALTH_INTERVAL,
+    UPSTREAM_HEALTH_TIMEOUT,
+)
+
+if TYPE_CHECKING:
+    import aiohttp
+
+logger = logging.getLogger(__name__)
+
+ROUTING_POLICIES = ("least-loaded", "model")
+
+
+class Upstream:
+    """A single upstream replica and its live counters."""
+
+    __slots__ = ("url", "name", "outstanding", "requests", "errors", "failures", "healthy", "models", "last_error")
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.name = urlparse(self.url).netloc or self.url
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.healthy = True
+        self.models: frozenset[str] = frozenset()
+        self.last_error = ""
+
+    def stats(self) -> dict:
+        """Return the replica's counters for display."""
+        return {
+            "name": self.name,
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "models": sorted(self.models),
+            "last_error": self.last_error,
+        }
+
+
+class UpstreamPool:
+    """Routes requests across upstream replicas.
+
+    Each request goes to the healthy replica with the fewest requests in
+    flight; with "model" routing, replicas known to serve the requested model
+    are preferred. Replicas are ejected after consecutive failures and
+    re-admitted once a health check succeeds. Health checks only run when
+    there is more than one replica to fail over to.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        routing: str = DEFAULT_ROUTING,
+        health_path: str = DEFAULT_HEALTH_PATH,
+        health_interval: float = UPSTREAM_HEALTH_INTERVAL,
+        health_timeout: float = UPSTREAM_HEALTH_TIMEOUT,
+        eject_after: int = UPSTREAM_EJECT_AFTER,
+    ):
+        if not urls:
+            raise ValueError("At least one upstream is required")
+        if routing not in ROUTING_POLICIES:
+            raise ValueError(f"Unknown routing policy: {routing!r}")
+        self.upstreams = [Upstream(url) for url in urls]
+        self.routing = routing
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.eject_after = eject_after
+        self._next = 0
+        self._health_task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self.upstreams)
+
+    def pick(self, model: str | None = None, exclude: list[Upstream] = (), capacity: int = 0) -> Upstream | None:
+        """Choose the replica for a request.
+
+        Returns None if every replica was excluded or, with a capacity,
+        already has that many requests in flight.
+        """
+        candidates = [upstream for upstream in self.upstreams if upstream not in exclude]
+        if not candidates:
+            return None
+        # With every replica ejected, trying one beats refusing the request
+        candidates = [upstream for upstream in candidates if upstream.healthy] or candidates
+        if capacity:
+            candidates = [upstream for upstream in candidates if upstream.outstanding < capacity]
+            if not candidates:
+                return None
+        if self.routing == "model" and model:
+            candidates = [upstream for upstream in candidates if model in upstream.models] or candidates
+        # Rotate the starting point so ties are spread across replicas
+        self._next = (self._next + 1) % len(candidates)
+        rotated = candidates[self._next:] + candidates[: self._next]
+        return min(rotated, key=lambda upstream: upstream.outstanding)
+
+    def acquire(self, upstream: Upstream) -> None:
+        """Count a request as in flight on a replica."""
+        upstream.outstanding += 1
+        upstream.requests += 1
+
+    def release(self, upstream: Upstream, error: BaseException | str | None = None) -> None:
+        """Finish a request on a replica, recording a failure if error is set."""
+        upstream.outstanding -= 1
+        if error is None:
+            upstream.failures = 0
+            return
+        upstream.errors += 1
+        self._mark_failure(upstream, error)
+
+    def _mark_failure(self, upstream: Upstream, error: BaseException | str) -> None:
+        upstream.failures += 1
+        upstream.last_error = str(error) or type(error).__name__
+        if upstream.healthy and upstream.failures >= self.eject_after and len(self.upstreams) > 1:
+            upstream.healthy = False
+            logger.warning("Ejecting upstream %s: %s", upstream.name, upstream.last_error)
+
+    def start(self, session: "aiohttp.ClientSession") -> None:
+        """Start background health checks using the shared session."""
+        if len(self.upstreams) > 1 and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop(session))
+
+    async def stop(self) -> None:
+        """Stop background health checks."""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    async def _health_loop(self, session: "aiohttp.ClientSession") -> None:
+        while True:
+            await asyncio.gather(*(self.check(upstream, session) for upstream in self.upstreams))
+            await asyncio.sleep(self.health_interval)
+
+    async def check(self, upstream: Upstream, session: "aiohttp.ClientSession") -> bool:
+        """Probe a replica, updating its health and advertised models."""
+        import aiohttp
+
+        timeout = aiohttp.ClientTimeout(total=self.health_timeout)
+        try:
+            async with session.get(upstream.url + self.health_path, timeout=timeout) as response:
+                if response.status >= 500:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, (), status=response.status, message=response.reason or ""
+                    )
+                if response.status == 200 and response.content_type == "application/json":
+                    payload = await response.json()
+                    data = payload.get("data") if isinstance(payload, dict) else None
+                    if isinstance(data, list):
+                        upstream.models = frozenset(
+                            str(item["id"]) for item in data if isinstance(item, dict) and "id" in item
+                        )
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self._mark_failure(upstream, e)
+            return False
+        upstream.failures = 0
+        if not upstream.healthy:
+            logger.info("Upstream %s is healthy again", upstream.name)
+            upstream.healthy = True
+        return True
+
+    def stats(self) -> list[dict]:
+        """Return per-replica counters."""
+        return [upstream.stats() for upstream in self.upstreams]
@@ -0,0 +1,231 @@
+"""Multi-process proxy workers sharing one port and one event collector."""
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import socket
+import threading
+import time
+from typing import Callable
+
+from tokentap.config import EVENT_BUFFER_SIZE, METRICS_PATH, WORKER_METRICS_TIMEOUT, WORKER_SHUTDOWN_TIMEOUT
+from tokentap.events import RequestEvent
+
+logger = logging.getLogger(__name__)
+
+_COLLECT_INTERVAL = 0.5
+
+
+def reuse_port_supported() -> bool:
+    """Return whether this platform lets several processes bind one port."""
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def worker_share(limit: int, worker_id: int, workers: int) -> int:
+    """Return one worker's part of a limit split across workers, the parts summing to the limit."""
+    return limit // workers + (1 if worker_id < limit % workers else 0)
+
+
+def _run_worker(
+    worker_id: int,
+    workers: int,
+    proxy_options: dict,
+    cache_options: dict | None,
+    events,
+    ready,
+    stop,
+    metrics_ports,
+) -> None:
+    """Entry point of a worker process: serve until the stop event is set."""
+    # Ctrl+C reaches the whole process group; the parent coordinates shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import aiohttp
+    from aiohttp import web
+
+    from tokentap.cache import ResponseCache
+    from tokentap.proxy import ProxyServer
+
+    # Admission limits protect the backend, so the workers split them
+    proxy_options = {
+        **proxy_options,
+        "max_inflight": worker_share(proxy_options.get("max_inflight", 0), worker_id, workers),
+        "model_limits": {
+            model: worker_share(limit, worker_id, workers)
+            for model, limit in (proxy_options.get("model_limits") or {}).items()
+        },
+    }
+    dropped = 0
+
+    def publish(event: RequestEvent) -> None:
+        nonlocal dropped
+        try:
+            events.put_nowait(event)
+        except queue.Full:
+            dropped += 1
+
+    proxy = ProxyServer(
+        **proxy_options,
+        on_request=publish,
+        on_response=publish,
+        cache=ResponseCache(**cache_options) if cache_options is not None else None,
+        worker_id=worker_id,
+        workers=workers,
+    )
+    proxy.metrics.counter(
+        "tokentap_worker_events_dropped_total",
+        "Events dropped because the collector queue was full",
+        collect=lambda: {(): dropped},
+    )
+
+    async def handle_local_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=proxy.metrics.render())
+
+    async def serve() -> None:
+        await proxy.start()
+        # A scrape reaches one worker, which adds the others' metrics from
+        # their private ports
+        app = web.Application()
+        app.router.add_get(METRICS_PATH, handle_local_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        metrics_ports[worker_id] = runner.addresses[0][1]
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=WORKER_METRICS_TIMEOUT))
+
+        async def fetch(port: int) -> str:
+            try:
+                async with session.get(f"http://127.0.0.1:{port}{METRICS_PATH}") as resp:
+                    return await resp.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # A worker that is stopping or stuck is left out of the scrape
+                return ""
+
+        async def peer_metrics() -> list[str]:
+            ports = [port for peer, port in enumerate(metrics_ports[:]) if peer != worker_id and port]
+            return await asyncio.gather(*(fetch(port) for port in ports))
+
+        proxy.peer_metrics = peer_metrics
+        ready.release()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        finally:
+            await proxy.stop()
+            await session.close()
+            await runner.cleanup()
+
+    asyncio.run(serve())
+
+
+class ProxyWorkers:
+    """Runs N proxy processes on one port and funnels their events to a callback.
+
+    The kernel spreads incoming connections across the workers via
+    SO_REUSEPORT, so parsing, JSON decoding and token counting scale with
+    cores. Events travel over one bounded multiprocessing queue to a
+    collector thread in this process, which hands them to on_event (the
+    dashboard's event channel). Request ids are interleaved per worker, so
+    totals and the request log stay consistent. Each worker also serves its
+    metrics on a private port, so whichever worker answers a scrape can
+    include all of them.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        proxy_options: dict,
+        on_event: Callable[[RequestEvent], None],
+        cache_options: dict | None = None,
+        queue_size: int = EVENT_BUFFER_SIZE,
+    ):
+        if count > 1 and not reuse_port_supported():
+            raise ValueError("Multiple workers require SO_REUSEPORT, which this platform lacks")
+        self.count = count
+        self.proxy_options = proxy_options
+        self.cache_options = cache_options
+        self.on_event = on_event
+        self.received = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._events = self._context.Queue(queue_size)
+        self._stop = self._context.Event()
+        # Released once by each worker when it is listening
+        self._ready = self._context.Semaphore(0)
+        # Private metrics port of each worker, 0 until it is listening
+        self._metrics_ports = self._context.Array("i", count, lock=False)
+        self._processes: list[multiprocessing.Process] = []
+        self._collector: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Spawn the worker processes and the collector thread."""
+        for worker_id in range(self.count):
+            process = self._context.Process(
+                target=_run_worker,
+                args=(
+                    worker_id,
+                    self.count,
+                    self.proxy_options,
+                    self.cache_options,
+                    self._events,
+                    self._ready,
+                    self._stop,
+                    self._metrics_ports,
+                ),
+                name=f"tokentap-worker-{worker_id}",
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        self._collector = threading.Thread(target=self._collect, name="tokentap-collector", daemon=True)
+        self._collector.start()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """Wait until every worker is listening; False if one exited first or the timeout passed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for _ in self._processes:
+            while not self._ready.acquire(timeout=_COLLECT_INTERVAL):
+                if not all(process.is_alive() for process in self._processes):
+                    return False
+                if deadline is not None and time.monotonic() > deadline:
+                    return False
+        return True
+
+    def _collect(self) -> None:
+        while True:
+            try:
+                event = self._events.get(timeout=_COLLECT_INTERVAL)
+            except queue.Empty:
+                if not self.is_alive():
+                    return
+                continue
+            self.received += 1
+            self.on_event(event)
+
+    def is_alive(self) -> bool:
+        """Return whether any worker is still running."""
+        return any(process.is_alive() for process in self._processes)
+
+    def join(self, timeout: float | None = None) -> None:
+        """Wait for the workers to exit, like Thread.join."""
+        for process in self._processes:
+            process.join(timeout)
+
+    def close(self, timeout: float = WORKER_SHUTDOWN_TIMEOUT) -> None:
+        """Stop the workers, letting them flush their archives, then the collector."""
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in time, terminating", process.name)
+                process.terminate()
+        if self._collector is not None:
+            self._collector.join(timeout)
+            self._collector = None
+
+    def stats(self) -> dict:
+        """Return worker liveness and the number of events collected."""
+        return {
+            "workers": self.count,
+            "alive": sum(process.is_alive() for process in self._processes),
+            "received": self.received,
+        }